@@ -0,0 +1,101 @@
+# ==================================
+# קובץ: cache.py (קאש זיכרון עם TTL)
+# ==================================
+"""
+קאש פשוט בזיכרון התהליך, עם תפוגה לפי זמן.
+כל קאש נרשם לפי שם, כדי שקוד אחר (למשל פעולות DB) יוכל לפנות ממנו מפתחות בלי לייבא את המודול שמחזיק אותו.
+"""
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+_MISSING = object()
+_registry: Dict[str, "TTLCache"] = {}
+
+# פונקציה שמפיצה פינויים לשאר התהליכים (נרשמת ע"י cluster.py במצב multi-worker)
+_publisher: Optional[Callable[[str, Any], None]] = None
+
+
+class TTLCache:
+    """מילון עם תפוגה לכל מפתח. בטוח לשימוש מכמה threads."""
+
+    def __init__(self, name: str, ttl: float, maxsize: Optional[int] = None):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: Dict[Hashable, Any] = {} # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                self._data.pop(key, None)
+                return default
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            if self.maxsize and len(self._data) >= self.maxsize and key not in self._data:
+                self._evict_one()
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """מחזיר מהקאש, או טוען עם loader ושומר."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict_one(self):
+        # קודם פריטים שפג תוקפם, אחרת הוותיק ביותר (סדר הכנסה)
+        now = time.monotonic()
+        for key, (expires_at, _) in self._data.items():
+            if expires_at < now:
+                del self._data[key]
+                return
+        self._data.pop(next(iter(self._data)))
+
+
+def get_cache(name: str) -> Optional[TTLCache]:
+    return _registry.get(name)
+
+def cache_names() -> List[str]:
+    """שמות כל הקאשים הרשומים בתהליך."""
+    return list(_registry)
+
+def set_invalidation_publisher(publisher: Optional[Callable[[str, Any], None]]):
+    """רושם פונקציה שתקבל (name, key) על כל פינוי, כדי להפיץ אותו לתהליכים אחרים."""
+    global _publisher
+    _publisher = publisher
+
+def invalidate(name: str, key: Hashable = _MISSING):
+    """מפנה מפתח אחד (או את כל הקאש אם לא הועבר מפתח), מקומית ובשאר התהליכים."""
+    evict_local(name, key)
+    if _publisher is not None:
+        _publisher(name, None if key is _MISSING else key)
+
+def evict_local(name: str, key: Hashable = _MISSING):
+    """פינוי בתהליך הנוכחי בלבד. לא עושה כלום אם הקאש לא קיים בתהליך."""
+    cache = _registry.get(name)
+    if cache is None:
+        return
+    if key is _MISSING:
+        cache.clear()
+    else:
+        cache.invalidate(key)
@@ -0,0 +1,484 @@
+# ==================================
+# קובץ: cluster.py (מצב multi-worker)
+# ==================================
+"""
+הרצת הבוט בכמה תהליכים (workers) במקום לולאת אירועים אחת.
+
+- תהליך ה-dispatcher מושך עדכונים מטלגרם ומחלק אותם ל-workers לפי consistent hashing של ה-user ID,
+  כך שכל השיחות של משתמש מסוים נשארות על אותו worker.
+- מצב ה-ConversationHandler ו-user_data נשמרים ב-backend משותף (SharedPersistence),
+  כך ששינוי במספר ה-workers או הפעלה מחדש לא מאבדים שיחות.
+- פינויי קאש מופצים דרך אותו backend (Postgres NOTIFY, או תחליף בזיכרון לבדיקות).
+
+הפעלה: BOT_WORKERS=4 python main.py
+"""
+import os
+import abc
+import json
+import queue
+import bisect
+import asyncio
+import hashlib
+import uuid
+import logging
+import functools
+import threading
+import multiprocessing
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from telegram.ext import BasePersistence, PersistenceInput
+
+import cache
+from invalidation import CHANNEL
+
+logger = logging.getLogger(__name__)
+
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 1))
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "postgres").lower()
+INVALIDATION_CHANNEL = CHANNEL # אותו ערוץ שבו משתמשות פעולות ה-DB
+PERSISTENCE_UPDATE_INTERVAL = 5 # שניות בין כתיבות מצב השיחות ל-backend
+DISPATCH_BUFFER_SIZE = 1000      # עדכונים שממתינים ב-dispatcher לכל worker; מעבר לזה - נזרקים
+FORWARD_TIMEOUT = 5              # שניות לניסיון הכנסה לתור של worker לפני ניסיון חוזר
+SUPERVISE_INTERVAL = 5           # שניות בין בדיקות שה-workers חיים
+SUPERVISE_MAX_BACKOFF = 300      # השהיה מקסימלית בין הפעלות מחדש של worker שנופל שוב ושוב
+
+
+# ---------------------------------------------------------
+# 🔁 Consistent hashing
+# ---------------------------------------------------------
+
+class HashRing:
+    """טבעת consistent hashing עם צמתים וירטואליים (שינוי מספר ה-workers מזיז רק חלק קטן מהמשתמשים)."""
+
+    def __init__(self, nodes: List[int], replicas: int = 100):
+        self._ring: List[int] = []
+        self._owners: Dict[int, int] = {}
+        for node in nodes:
+            for replica in range(replicas):
+                point = self._hash(f"{node}:{replica}")
+                self._owners[point] = node
+                bisect.insort(self._ring, point)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def node_for(self, key: Any) -> int:
+        index = bisect.bisect(self._ring, self._hash(str(key))) % len(self._ring)
+        return self._owners[self._ring[index]]
+
+
+# ---------------------------------------------------------
+# 🗄️ Backends למצב משותף
+# ---------------------------------------------------------
+
+class StateBackend(abc.ABC):
+    """ממשק: key/value עם ערכי JSON + pub/sub."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Any: ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any): ...
+
+    @abc.abstractmethod
+    def delete(self, key: str): ...
+
+    @abc.abstractmethod
+    def scan(self, prefix: str) -> Dict[str, Any]: ...
+
+    @abc.abstractmethod
+    def publish(self, channel: str, message: Any): ...
+
+    @abc.abstractmethod
+    def subscribe(self, channel: str, callback: Callable[[Any], None]): ...
+
+    def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """תחליף בזיכרון (תהליך יחיד / בדיקות)."""
+
+    def __init__(self):
+        self._data: Dict[str, str] = {}
+        self._subscribers: Dict[str, List[Callable[[Any], None]]] = defaultdict(list)
+
+    def get(self, key):
+        raw = self._data.get(key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value):
+        self._data[key] = json.dumps(value)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def scan(self, prefix):
+        return {k: json.loads(v) for k, v in self._data.items() if k.startswith(prefix)}
+
+    def publish(self, channel, message):
+        for callback in list(self._subscribers[channel]):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers[channel].append(callback)
+
+
+class PostgresStateBackend(StateBackend):
+    """key/value בטבלת shared_state, ו-pub/sub עם LISTEN/NOTIFY."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._subscribers: Dict[str, List[Callable[[Any], None]]] = defaultdict(list)
+        self._listener: Optional[threading.Thread] = None
+        self._listen_conn = None
+        self._listening: set = set()
+        self._stop = threading.Event()
+
+    def get(self, key):
+        with self.engine.connect() as conn:
+            raw = conn.execute(text("SELECT value FROM shared_state WHERE key = :k"), {"k": key}).scalar()
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value):
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO shared_state (key, value, updated_at) VALUES (:k, :v, now()) "
+                "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = now()"
+            ), {"k": key, "v": json.dumps(value)})
+
+    def delete(self, key):
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM shared_state WHERE key = :k"), {"k": key})
+
+    def scan(self, prefix):
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT key, value FROM shared_state WHERE key LIKE :p"),
+                                {"p": prefix.replace("%", r"\%").replace("_", r"\_") + "%"}).all()
+        return {key: json.loads(value) for key, value in rows}
+
+    def publish(self, channel, message):
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:c, :m)"), {"c": channel, "m": json.dumps(message)})
+
+    def subscribe(self, channel, callback):
+        self._subscribers[channel].append(callback)
+        if self._listener is None:
+            self._listener = threading.Thread(target=self._listen_loop, name="pg-listen", daemon=True)
+            self._listener.start()
+
+    def _listen_loop(self):
+        import select
+        # חיבור ייעודי (raw psycopg2) ב-autocommit, נשאר פתוח לאורך חיי התהליך
+        self._listen_conn = self.engine.raw_connection()
+        dbapi_conn = self._listen_conn.driver_connection
+        dbapi_conn.set_session(autocommit=True)
+        while not self._stop.is_set():
+            # ערוצים שנרשמו אחרי תחילת ההאזנה מתווספים כאן (החיבור שייך ל-thread הזה בלבד)
+            for channel in set(self._subscribers) - self._listening:
+                with dbapi_conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{channel}"')
+                self._listening.add(channel)
+            if select.select([dbapi_conn], [], [], 5) == ([], [], []):
+                continue
+            dbapi_conn.poll()
+            while dbapi_conn.notifies:
+                notify = dbapi_conn.notifies.pop(0)
+                for callback in self._subscribers.get(notify.channel, []):
+                    try:
+                        callback(json.loads(notify.payload))
+                    except Exception as e:
+                        logger.error(f"Notification handler for {notify.channel} failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._listen_conn is not None:
+            self._listen_conn.close()
+
+
+_backend: Optional[StateBackend] = None
+
+def get_backend() -> StateBackend:
+    """מחזיר את ה-backend של התהליך (נוצר בפעם הראשונה לפי SHARED_STATE_BACKEND)."""
+    global _backend
+    if _backend is None:
+        if SHARED_STATE_BACKEND == "memory":
+            if BOT_WORKERS > 1:
+                # כל תהליך היה מקבל עותק נפרד - מצב השיחות והפינויים לא היו משותפים בכלל
+                raise RuntimeError("SHARED_STATE_BACKEND=memory cannot be used with BOT_WORKERS>1")
+            _backend = MemoryStateBackend()
+        else:
+            import db_models
+            _backend = PostgresStateBackend(db_models.engine)
+    return _backend
+
+def enable_shared_invalidation(backend: StateBackend):
+    """פינויי קאש מקומיים מתפרסמים לכל ה-workers, ופינויים מ-workers אחרים מתבצעים מקומית."""
+    origin = uuid.uuid4().hex # לא PID: ברפליקות Docker כולן PID 1
+
+    def publish(name, key):
+        try:
+            backend.publish(INVALIDATION_CHANNEL, {"origin": origin, "name": name, "key": key})
+        except Exception as e:
+            logger.error(f"Failed to publish cache invalidation {name}:{key}: {e}")
+
+    def on_message(message):
+        if message.get("origin") == origin:
+            return
+        if message.get("key") is None:
+            cache.evict_local(message["name"])
+        else:
+            cache.evict_local(message["name"], message["key"])
+
+    cache.set_invalidation_publisher(publish)
+    if isinstance(backend, PostgresStateBackend):
+        # ב-Postgres ההאזנה לערוץ נעשית ע"י InvalidationListener (invalidation.py) בלולאת האירועים
+        return
+    backend.subscribe(INVALIDATION_CHANNEL, on_message)
+
+
+# ---------------------------------------------------------
+# 💾 Persistence משותף ל-ConversationHandler ו-user_data
+# ---------------------------------------------------------
+
+class SharedPersistence(BasePersistence):
+    """
+    שומר מצב שיחות ו-user_data ב-StateBackend.
+    כל שיחה נשמרת במפתח משלה (conv:<name>:<key>) כדי ש-workers שונים לא ידרסו זה את זה.
+    """
+
+    def __init__(self, backend: StateBackend):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=PERSISTENCE_UPDATE_INTERVAL
+        )
+        self.backend = backend
+
+    async def _run(self, func, *args):
+        # ה-backend סינכרוני (DB) - מריצים ב-thread כדי לא לחסום את לולאת האירועים
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def get_user_data(self):
+        data = await self._run(self.backend.scan, "user:")
+        return {int(key.split(":", 1)[1]): value for key, value in data.items()}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        prefix = f"conv:{name}:"
+        data = await self._run(self.backend.scan, prefix)
+        return {tuple(json.loads(key[len(prefix):])): state for key, state in data.items()}
+
+    async def update_conversation(self, name, key, new_state):
+        backend_key = f"conv:{name}:{json.dumps(list(key))}"
+        if new_state is None:
+            await self._run(self.backend.delete, backend_key)
+        else:
+            await self._run(self.backend.set, backend_key, new_state)
+
+    async def update_user_data(self, user_id, data):
+        if data:
+            await self._run(self.backend.set, f"user:{user_id}", data)
+        else:
+            await self._run(self.backend.delete, f"user:{user_id}")
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._run(self.backend.delete, f"user:{user_id}")
+
+    async def refresh_user_data(self, user_id, user_data):
+        # משתמש תמיד מנותב לאותו worker, כך שהעותק בזיכרון הוא העדכני - אין צורך בקריאה ל-DB בכל עדכון
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass
+
+
+# ---------------------------------------------------------
+# 🚀 Dispatcher + workers
+# ---------------------------------------------------------
+
+# עדכוני הצטרפות מנותבים לפי הקבוצה: מוני גלי ההצטרפות (handlers/antispam.py) הם לכל קבוצה בזיכרון התהליך
+CHAT_ROUTED_FIELDS = ("chat_member", "chat_join_request")
+
+# כפתור שה-callback_data שלו מסתיים ב-@<id> מנותב לפי ה-id הזה (ראה review_queue.decision_callback):
+# כפתורי ההחלטה בערוץ הניהול מגיעים ל-worker של המשתמש שהגיש את הבקשה, שמחזיק את הפריט בתור
+ROUTE_HINT_SEPARATOR = "@"
+
+def routing_key(update_data: dict) -> int:
+    """
+    מפתח הניתוב של עדכון: ה-user ID (ואם אין - ה-chat ID).
+    עדכוני הצטרפות - ה-chat ID; כפתורים עם רמז ניתוב (@<id>) - ה-id שברמז.
+    """
+    data = (update_data.get("callback_query") or {}).get("data") or ""
+    hint = data.rpartition(ROUTE_HINT_SEPARATOR)[2] if ROUTE_HINT_SEPARATOR in data else ""
+    if hint.lstrip("-").isdigit():
+        return int(hint)
+    for field in CHAT_ROUTED_FIELDS:
+        payload = update_data.get(field)
+        if payload and payload.get("chat"):
+            return payload["chat"]["id"]
+    for field in ("message", "edited_message", "callback_query", "chat_member", "my_chat_member",
+                  "inline_query", "chat_join_request", "channel_post"):
+        payload = update_data.get(field)
+        if not payload:
+            continue
+        user = payload.get("from")
+        if user:
+            return user["id"]
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+async def serve_worker(application, queue):
+    """
+    לולאת ה-worker: מקבל עדכונים (dict) מה-dispatcher ומזין אותם ל-Application.
+    PTB מריץ את post_init/post_shutdown רק מתוך run_polling/run_webhook, ולכן קוראים להם כאן במפורש
+    (מאזין הפינויים, חימום הקאשים וכתיבת יומן הביקורת בסגירה).
+    """
+    from telegram import Update
+    loop = asyncio.get_running_loop()
+    async with application:
+        await application.start()
+        try:
+            if application.post_init:
+                await application.post_init(application)
+            while True:
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+        finally:
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+
+async def _forward(index: int, buffer: asyncio.Queue, queues: List[Any]):
+    """מעביר עדכונים מה-buffer של worker לתור שלו, בלי לחסום את לולאת ה-dispatcher."""
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await buffer.get()
+        while True:
+            try:
+                # queues[index] נקרא מחדש בכל ניסיון - ה-supervisor מחליף אותו כשה-worker מופעל מחדש
+                await loop.run_in_executor(None, functools.partial(queues[index].put, data, timeout=FORWARD_TIMEOUT))
+                break
+            except queue.Full:
+                logger.warning(f"Worker {index} queue is full, retrying ({buffer.qsize()} buffered)")
+
+
+async def _supervise(ctx, queues: List[Any], processes: List[Any], worker_target: Callable[[int, Any], None]):
+    """
+    מפעיל מחדש worker שמת (עם תור חדש - תור של תהליך שמת עלול להישאר נעול).
+    worker שנופל שוב ושוב מופעל בהשהיה הולכת וגדלה (עד SUPERVISE_MAX_BACKOFF).
+    """
+    loop = asyncio.get_running_loop()
+    failures: Dict[int, int] = defaultdict(int)
+    started_at = {index: loop.time() for index in range(len(processes))}
+    retry_at: Dict[int, float] = {}
+    while True:
+        await asyncio.sleep(SUPERVISE_INTERVAL)
+        now = loop.time()
+        for index, process in enumerate(processes):
+            if process.is_alive():
+                if now - started_at[index] > SUPERVISE_MAX_BACKOFF:
+                    failures[index] = 0 # רץ מספיק זמן - מאפסים את ההשהיה
+                continue
+            if index not in retry_at:
+                failures[index] += 1
+                delay = min(SUPERVISE_MAX_BACKOFF, SUPERVISE_INTERVAL * 2 ** (failures[index] - 1))
+                retry_at[index] = now + delay
+                logger.error(f"Worker {index} exited with code {process.exitcode}, restarting in {delay:.0f}s")
+            if now < retry_at[index]:
+                continue
+            del retry_at[index]
+            started_at[index] = now
+            queues[index] = ctx.Queue(maxsize=1000)
+            processes[index] = ctx.Process(target=worker_target, args=(index, queues[index]),
+                                           name=f"bot-worker-{index}")
+            processes[index].start()
+
+
+async def _dispatch(bot_token: str, queues: List[Any], ring: HashRing, supervise):
+    from telegram import Bot, Update
+    from telegram.error import TelegramError
+    buffers = [asyncio.Queue(maxsize=DISPATCH_BUFFER_SIZE) for _ in queues]
+    tasks = [asyncio.create_task(_forward(i, buffer, queues)) for i, buffer in enumerate(buffers)]
+    tasks.append(asyncio.create_task(supervise))
+    async with Bot(bot_token) as bot:
+        await bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except TelegramError as e:
+                logger.warning(f"get_updates failed: {e}")
+                await asyncio.sleep(2)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                data = update.to_dict()
+                index = ring.node_for(routing_key(data))
+                try:
+                    buffers[index].put_nowait(data)
+                except asyncio.QueueFull:
+                    # worker תקוע - זורקים את העדכון שלו במקום לעצור את החלוקה לכל השאר
+                    logger.error(f"Worker {index} is not keeping up, dropping update {update.update_id}")
+
+
+def run_cluster(bot_token: str, workers: int, worker_target: Callable[[int, Any], None]):
+    """מפעיל workers תהליכים ואת ה-dispatcher (בתהליך הנוכחי) עד עצירה. worker שמת מופעל מחדש."""
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue(maxsize=1000) for _ in range(workers)]
+    processes = [ctx.Process(target=worker_target, args=(i, queues[i]), name=f"bot-worker-{i}")
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    logger.info(f"Dispatching updates to {workers} workers")
+
+    async def run():
+        supervise = _supervise(ctx, queues, processes, worker_target)
+        await _dispatch(bot_token, queues, HashRing(list(range(workers))), supervise)
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for queue_ in queues:
+            try:
+                queue_.put(None, timeout=FORWARD_TIMEOUT)
+            except queue.Full:
+                pass
+        for process in processes:
+            process.join(timeout=30)
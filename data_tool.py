@@ -0,0 +1,299 @@
+# ==================================
+# קובץ: data_tool.py (ייצוא/ייבוא נתונים - users, sell_posts)
+# ==================================
+"""
+כלי שורת פקודה להעברת נתונים בין סביבות (Render / Replit / Postgres עצמאי) ולזריעת נתונים לבדיקות עומס.
+
+ייצוא - זורם מה-DB עם server-side cursor (yield_per), בלי לטעון את הטבלה לזיכרון:
+    python data_tool.py export users --format ndjson > users.ndjson
+    python data_tool.py export sell_posts --format csv --out posts.csv
+
+ייבוא - ב-Postgres דרך COPY לטבלה זמנית ואז INSERT ... SELECT אחד; אחרת executemany באצוות:
+    python data_tool.py import users users.ndjson
+    python data_tool.py import sell_posts posts.csv --update
+
+- משתמשים מזוהים לפי telegram_id (ה-id הפנימי נקבע מחדש ביעד); מודעות לפי id.
+- שורות כפולות בקובץ - נשמרת האחרונה (במסלול executemany - בתוך כל אצווה). רשומה שכבר קיימת ביעד נשמרת כמו שהיא, אלא אם הועבר --update.
+- יש לייבא users לפני sell_posts (מודעות של משתמשים שלא קיימים ביעד מדולגות).
+- ב-CSV ערך ריק מתפרש כ-NULL.
+"""
+import io
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List
+from sqlalchemy import select, text, Boolean, DateTime, Integer, BigInteger
+
+from db_models import User, SellPost, create_db_engine
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH = 2000 # שורות לכל fetch מה-cursor
+IMPORT_BATCH = 5000 # שורות לכל executemany
+
+# טבלה -> (מודל, מפתח לזיהוי כפילויות, עמודות שלא מועברות)
+TABLES = {
+    'users': (User, 'telegram_id', ('id',)),
+    'sell_posts': (SellPost, 'id', ()),
+}
+
+
+# ה-IDs מגיעים מהקובץ - מקדמים את ה-sequence כדי שהכנסות חדשות (add_sell_post) לא יתנגשו
+SETVAL_SQL = "SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1)) FROM {table}"
+
+
+def _columns(name: str) -> List:
+    model, _, excluded = TABLES[name]
+    return [c for c in model.__table__.columns if c.name not in excluded]
+
+
+# ---------------------------------------------------------
+# 📤 ייצוא
+# ---------------------------------------------------------
+
+def _to_json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _to_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return _to_json_value(value)
+
+def export_table(engine, name: str, fmt: str, out) -> int:
+    """כותב את הטבלה ל-out (NDJSON או CSV עם כותרת). מחזיר מספר שורות."""
+    columns = _columns(name)
+    names = [c.name for c in columns]
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer:
+        writer.writerow(names)
+
+    count = 0
+    with engine.connect().execution_options(yield_per=EXPORT_BATCH) as conn:
+        result = conn.execute(select(*columns).order_by(TABLES[name][0].__table__.c[TABLES[name][1]]))
+        for row in result:
+            if writer:
+                writer.writerow([_to_csv_value(v) for v in row])
+            else:
+                out.write(json.dumps({k: _to_json_value(v) for k, v in zip(names, row)}, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+# ---------------------------------------------------------
+# 📥 ייבוא
+# ---------------------------------------------------------
+
+def read_records(fmt: str, source) -> Iterator[Dict]:
+    """קורא רשומות מהקובץ אחת-אחת (dict לכל שורה)."""
+    if fmt == "csv":
+        for row in csv.DictReader(source):
+            yield {k: (v if v != "" else None) for k, v in row.items()}
+    else:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+def _coerce(column, value):
+    """ממיר ערך מהקובץ לטיפוס של העמודה (למסלול executemany)."""
+    if value is None:
+        return None
+    if isinstance(column.type, Boolean):
+        return value if isinstance(value, bool) else str(value).lower() in ("true", "t", "1")
+    if isinstance(column.type, DateTime):
+        return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if isinstance(column.type, (Integer, BigInteger)):
+        return int(value)
+    return str(value)
+
+
+class _CsvStream(io.RawIOBase):
+    """קובץ-לקריאה שמייצר שורות CSV מרשומות לפי דרישה - מזין את COPY בלי לכתוב קובץ ביניים."""
+
+    def __init__(self, records: Iterable[Dict], names: List[str]):
+        self._records = iter(records)
+        self._names = names
+        self._buffer = b""
+        self._text = io.StringIO()
+        self._writer = csv.writer(self._text)
+        self.rows = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self._buffer) < len(target):
+            record = next(self._records, None)
+            if record is None:
+                break
+            self._writer.writerow([_to_csv_value(record.get(n)) for n in self._names])
+            self._buffer += self._text.getvalue().encode()
+            self._text.seek(0)
+            self._text.truncate()
+            self.rows += 1
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _copy_import(engine, name: str, records: Iterable[Dict], update: bool):
+    """Postgres: COPY לטבלה זמנית, ואז הכנסה אחת עם איחוד כפילויות (האחרונה בקובץ גוברת)."""
+    model, key, _ = TABLES[name]
+    table = model.__tablename__
+    names = [c.name for c in _columns(name)]
+    cols = ", ".join(names)
+    staging = f"_import_{table}"
+
+    on_conflict = "DO NOTHING"
+    if update:
+        on_conflict = "DO UPDATE SET " + ", ".join(f"{n} = EXCLUDED.{n}" for n in names if n != key)
+    where = f"{key} IS NOT NULL"
+    if name == 'sell_posts':
+        where += " AND (user_id IS NULL OR user_id IN (SELECT telegram_id FROM users))"
+
+    stream = _CsvStream(records, names)
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {cols} FROM {table} WITH NO DATA")
+        cursor.execute(f"ALTER TABLE {staging} ADD COLUMN _seq BIGSERIAL")
+        cursor.copy_expert(f"COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv)", io.BufferedReader(stream))
+        cursor.execute(
+            f"INSERT INTO {table} ({cols}) "
+            f"SELECT DISTINCT ON ({key}) {cols} FROM {staging} WHERE {where} ORDER BY {key}, _seq DESC "
+            f"ON CONFLICT ({key}) {on_conflict}"
+        )
+        written = cursor.rowcount
+        if 'id' in names:
+            cursor.execute(SETVAL_SQL.format(table=table))
+        raw.commit()
+        return stream.rows, written
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+
+def _batched_import(engine, name: str, records: Iterable[Dict], update: bool):
+    """כל DB אחר (למשל SQLite): executemany באצוות, עם ON CONFLICT לפי המפתח."""
+    model, key, _ = TABLES[name]
+    columns = _columns(name)
+    batch_columns = {c.name for c in columns}
+    dialect = engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise ValueError(f"Import is not supported for {dialect}")
+
+    stmt = dialect_insert(model.__table__)
+    if update:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key],
+            set_={c.name: stmt.excluded[c.name] for c in columns if c.name != key}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[key])
+
+    read = written = 0
+    batch: Dict = {}
+
+    def flush(conn):
+        nonlocal written
+        rows = list(batch.values())
+        batch.clear()
+        if name == 'sell_posts':
+            # כמו במסלול ה-COPY: מודעות של משתמשים שלא קיימים ביעד מדולגות
+            user_ids = {row['user_id'] for row in rows if row['user_id'] is not None}
+            existing = set(conn.execute(select(User.telegram_id).where(User.telegram_id.in_(user_ids))).scalars())
+            rows = [row for row in rows if row['user_id'] is None or row['user_id'] in existing]
+        if rows:
+            result = conn.execute(stmt, rows)
+            # כמו cursor.rowcount במסלול ה-COPY: שורות שנוספו/עודכנו בפועל (בלי כאלה שדולגו ב-ON CONFLICT)
+            written += result.rowcount if result.rowcount >= 0 else len(rows)
+
+    with engine.begin() as conn:
+        for record in records:
+            read += 1
+            row = {c.name: _coerce(c, record.get(c.name)) for c in columns}
+            if row[key] is None:
+                continue
+            batch.pop(row[key], None) # כפילות בקובץ - האחרונה גוברת
+            batch[row[key]] = row
+            if len(batch) >= IMPORT_BATCH:
+                flush(conn)
+        flush(conn)
+        if dialect == 'postgresql' and 'id' in batch_columns:
+            conn.execute(text(SETVAL_SQL.format(table=model.__tablename__)))
+    return read, written
+
+
+def import_table(engine, name: str, records: Iterable[Dict], update: bool = False, use_copy: bool = True):
+    """מייבא רשומות. מחזיר (שורות שנקראו, שורות שנוספו/עודכנו בפועל) - באותה משמעות בשני המסלולים."""
+    if use_copy and engine.dialect.name == 'postgresql':
+        return _copy_import(engine, name, records, update)
+    return _batched_import(engine, name, records, update)
+
+
+# ---------------------------------------------------------
+# ▶️ CLI
+# ---------------------------------------------------------
+
+def main(argv):
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="ייצוא/ייבוא users ו-sell_posts")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("table", choices=TABLES)
+    export_parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    export_parser.add_argument("--out", help="קובץ יעד (ברירת מחדל: stdout)")
+
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("table", choices=TABLES)
+    import_parser.add_argument("file", help="קובץ מקור ('-' ל-stdin)")
+    import_parser.add_argument("--format", choices=("ndjson", "csv"),
+                               help="ברירת מחדל: לפי סיומת הקובץ (csv), אחרת ndjson")
+    import_parser.add_argument("--update", action="store_true", help="לעדכן רשומות קיימות במקום לדלג עליהן")
+    import_parser.add_argument("--no-copy", action="store_true", help="executemany גם ב-Postgres")
+
+    args = parser.parse_args(argv[1:])
+    engine = create_db_engine(os.getenv("DATABASE_URL") or os.getenv("DB_URL"))
+    started = time.monotonic()
+
+    if args.command == "export":
+        out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+        try:
+            count = export_table(engine, args.table, args.format, out)
+        finally:
+            if args.out:
+                out.close()
+        logger.info(f"Exported {count} {args.table} rows in {time.monotonic() - started:.1f}s")
+        return 0
+
+    fmt = args.format or ("csv" if args.file.endswith(".csv") else "ndjson")
+    source = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+    try:
+        read, written = import_table(engine, args.table, read_records(fmt, source),
+                                     update=args.update, use_copy=not args.no_copy)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    logger.info(f"Imported {args.table}: {read} rows read, {written} written in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,10 +1,13 @@
 # ==================================
 # קובץ: db_models.py (קובץ מלא להחלפה)
 # ==================================
-from sqlalchemy import Column, Integer, String, Boolean, BigInteger, DateTime, ForeignKey, create_engine
+from sqlalchemy import Column, Integer, String, Boolean, BigInteger, DateTime, ForeignKey, Index, create_engine
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
 import os
+import time
+import itertools
+import secrets
 
 # הגדרת הבסיס למודלים
 Base = declarative_base()
@@ -22,12 +25,17 @@ class User(Base):
     username = Column(String, nullable=True)
     full_name = Column(String, nullable=True)
     
+    # נתוני אימות
+    phone_number = Column(String, nullable=True)
+    license_photo_id = Column(String, nullable=True) # מזהה תמונת הרישיון בשרתי טלגרם
+    
     # הרשאות וסטטוסים
     is_approved = Column(Boolean, default=False) # האם אושר כחבר קהילה
     is_admin = Column(Boolean, default=False)    # האם מנהל מערכת
     is_banned = Column(Boolean, default=False)   # האם חסום
     
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True) # בסיס ל-reconcile מצטבר
 
     def __repr__(self):
         return f"<User {self.telegram_id} ({self.full_name})>"
@@ -45,23 +53,146 @@ class SellPost(Base):
     image_id = Column(String, nullable=True) # מזהה תמונה בשרתי טלגרם
     
     is_approved = Column(Boolean, default=False) # האם המודעה אושרה לפרסום
-    status = Column(String, default='active')    # active, sold, deleted
+    status = Column(String, default='active')    # active, sold, expired, deleted
     created_at = Column(DateTime, default=datetime.utcnow)
+    status_changed_at = Column(DateTime, nullable=True) # מתי הסטטוס יצא מ-active (בסיס לארכוב)
+    last_sent_at = Column(DateTime, nullable=True) # מתי נשלחה לאחרונה בשידור לקבוצות
 
     # יחסים (לא חובה אבל עוזר בקוד)
     user = relationship("User")
 
+    __table_args__ = (
+        # אינדקס חלקי: שאילתות "מודעות חיות" סורקות רק שורות פעילות
+        Index('ix_sell_posts_live', 'is_approved', 'created_at', postgresql_where=(status == 'active')),
+        # עבור משימת הארכוב (מודעות שנמכרו/פגו/נמחקו)
+        Index('ix_sell_posts_status_changed', 'status', 'status_changed_at'),
+        # "המודעות שלי" ובדיקת המכסה היומית
+        Index('ix_sell_posts_user_id', 'user_id'),
+    )
+
     def __repr__(self):
         return f"<SellPost {self.id} by {self.user_id}>"
 
-# --- פונקציית אתחול הדאטהבייס ---
-def init_db(db_url):
+# --- הודעות שפורסמו עבור מודעה (SellPostMessage) ---
+class SellPostMessage(Base):
+    """מיפוי מודעה -> ההודעות שפורסמו עבורה בקבוצות, כדי לערוך/למחוק אותן במקום לפרסם מחדש."""
+    __tablename__ = 'sell_post_messages'
+
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, nullable=False, index=True) # ללא FK: המודעה עשויה לעבור לארכיון
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(Integer, nullable=False)
+    has_photo = Column(Boolean, default=False) # קובע אם עורכים caption או text
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SellPostMessage post={self.post_id} chat={self.chat_id} msg={self.message_id}>"
+
+# --- היסטוריית מודעות (SellPostHistory) ---
+class SellPostHistory(Base):
     """
-    מאתחל את החיבור לדאטהבייס ויוצר טבלאות אם הן לא קיימות.
-    נקרא מתוך main.py בעלייה.
+    ארכיון מודעות שיצאו ממחזור החיים (נמכרו / פגו / נמחקו).
+    ב-Postgres הטבלה מחולקת (partitioned) לפי חודש הארכוב, כך ש-sell_posts נשארת קטנה.
     """
-    global engine # מעדכן את המשתנה הגלובלי שהגדרנו למעלה
-    
+    __tablename__ = 'sell_posts_history'
+
+    id = Column(Integer, primary_key=True, autoincrement=False) # ה-ID המקורי של המודעה
+    archived_at = Column(DateTime, primary_key=True, default=datetime.utcnow) # מפתח החלוקה
+    user_id = Column(BigInteger, index=True)
+
+    description = Column(String, nullable=False)
+    price = Column(String, nullable=True)
+    contact_info = Column(String, nullable=True)
+    image_id = Column(String, nullable=True)
+
+    is_approved = Column(Boolean, default=False)
+    status = Column(String)
+    created_at = Column(DateTime)
+    status_changed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = {'postgresql_partition_by': 'RANGE (archived_at)'}
+
+    def __repr__(self):
+        return f"<SellPostHistory {self.id} ({self.status})>"
+
+# --- מצב משותף בין תהליכים (SharedState) ---
+class SharedState(Base):
+    """מאגר key/value (JSON) משותף ל-workers: מצב שיחות ו-user_data (ראה cluster.py)."""
+    __tablename__ = 'shared_state'
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False) # JSON
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SharedState {self.key}>"
+
+# --- תור תופעות לוואי (Outbox) ---
+class OutboxEvent(Base):
+    """
+    פעולת Bot API שנרשמה באותה טרנזקציה של שינוי המצב ב-DB, ומבוצעת אח"כ ע"י worker (handlers/outbox.py).
+    idempotency_key ייחודי בין האירועים הממתינים, כך שאותה פעולה לא נכנסת לתור פעמיים.
+    """
+    __tablename__ = 'outbox'
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)     # grant_permissions, ban_chat_member, send_message...
+    payload = Column(String, nullable=False)  # JSON
+    idempotency_key = Column(String, nullable=False)
+    status = Column(String, default='pending') # pending, done, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('uq_outbox_pending_key', 'idempotency_key', unique=True,
+              postgresql_where=(status == 'pending'), sqlite_where=(status == 'pending')),
+        Index('ix_outbox_due', 'next_attempt_at',
+              postgresql_where=(status == 'pending'), sqlite_where=(status == 'pending')),
+    )
+
+    def __repr__(self):
+        return f"<OutboxEvent {self.id} {self.kind} ({self.status})>"
+
+# --- יומן ביקורת (AuditLog) ---
+_audit_sequence = itertools.count()
+# מזהה צומת אקראי לכל תהליך (לא PID - ב-Docker התהליך הראשי של כל רפליקה הוא PID 1)
+_AUDIT_NODE_ID = secrets.randbits(10)
+
+def next_audit_id() -> int:
+    """
+    מזהה ממוין לפי זמן וייחודי בין תהליכים, בלי sequence משותף:
+    מילישניות (41 ביט) | מזהה צומת אקראי (10 ביט) | מונה (12 ביט).
+    """
+    return (int(time.time() * 1000) << 22) | (_AUDIT_NODE_ID << 12) | (next(_audit_sequence) & 0xFFF)
+
+class AuditLog(Base):
+    """
+    יומן פעולות ניהול (append-only): אישורים, חסימות, מינוי מנהלים והחלטות על מודעות.
+    ב-Postgres הטבלה מחולקת לפי חודש, כך שהכנסה ושאילתות על התקופה האחרונה נשארות זולות.
+    """
+    __tablename__ = 'audit_log'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=False, default=next_audit_id)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow) # מפתח החלוקה
+    actor_id = Column(BigInteger, nullable=True)   # מי ביצע (None = המערכת)
+    action = Column(String, nullable=False)        # approve_user, ban_user, set_admin, approve_post, reject_post
+    target_id = Column(BigInteger, nullable=False) # המשתמש שעליו בוצעה הפעולה (בעל המודעה בהחלטות על מודעות)
+    details = Column(String, nullable=True)        # JSON
+
+    __table_args__ = (
+        Index('ix_audit_log_target', 'target_id', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+    def __repr__(self):
+        return f"<AuditLog {self.action} {self.target_id} by {self.actor_id}>"
+
+# --- פונקציית אתחול הדאטהבייס ---
+def create_db_engine(db_url):
+    """יוצר מנוע SQLAlchemy מכתובת החיבור (משמש גם את כלי ה-CLI)."""
     if not db_url:
         raise ValueError("Database URL is missing! Check environment variables.")
 
@@ -69,9 +200,28 @@ def init_db(db_url):
     if db_url.startswith("postgres://"):
         db_url = db_url.replace("postgres://", "postgresql://", 1)
 
+    return create_engine(db_url, echo=False)
+
+def init_db(db_url):
+    """
+    מאתחל את החיבור לדאטהבייס ומריץ מיגרציות סכמה שטרם הורצו.
+    נקרא מתוך main.py בעלייה.
+    """
+    global engine # מעדכן את המשתנה הגלובלי שהגדרנו למעלה
+
     # יצירת המנוע
-    engine = create_engine(db_url, echo=False)
-    
-    # יצירת הטבלאות בפועל (Create Tables)
-    Base.metadata.create_all(engine)
-    print("✅ Database tables created successfully.")
+    engine = create_db_engine(db_url)
+
+    # קישור ה-Session של db_operations למנוע (נוצר בייבוא, לפני שהיה מנוע)
+    from db_operations import Session
+    Session.configure(bind=engine)
+
+    # יצירת/עדכון הטבלאות דרך מנגנון המיגרציות.
+    # מסלול מהיר: אם הגרסה עדכנית - שאילתה אחת בלבד, בלי create_all ושאילתות reflection.
+    from migrations import run_migrations, current_version, LATEST_VERSION
+    version = current_version(engine)
+    if version >= LATEST_VERSION:
+        print(f"✅ Database schema is current (version {version}), skipping schema work.")
+        return
+    version = run_migrations(engine)
+    print(f"✅ Database schema is up to date (version {version}).")
@@ -1,10 +1,14 @@
 # ==================================
 # קובץ: db_operations.py (מלא - משתמשים + מכירות + אדמין)
 # ==================================
+import json
 import logging
-from sqlalchemy.orm import sessionmaker, scoped_session
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, text, literal, func, or_, and_, case, event, DateTime
+from sqlalchemy.orm import sessionmaker, scoped_session, Session as OrmSession
 from sqlalchemy.exc import SQLAlchemyError
-from db_models import engine, User, SellPost 
+from db_models import engine, User, SellPost, SellPostHistory, SellPostMessage, OutboxEvent, SharedState, AuditLog
+from invalidation import queue_invalidation
 
 # יצירת Session מנוהל
 session_factory = sessionmaker(bind=engine)
@@ -18,7 +22,8 @@ def get_session():
 # 👤 ניהול משתמשים (Users)
 # ---------------------------------------------------------
 
-def create_or_update_user(telegram_id, username=None, full_name=None, is_approved=None):
+def create_or_update_user(telegram_id, username=None, full_name=None, is_approved=None,
+                          phone_number=None, license_photo_id=None):
     session = Session()
     try:
         user = session.query(User).filter_by(telegram_id=telegram_id).first()
@@ -28,8 +33,12 @@ def create_or_update_user(telegram_id, username=None, full_name=None, is_approve
         
         if username: user.username = username
         if full_name: user.full_name = full_name
+        if phone_number: user.phone_number = phone_number
+        if license_photo_id: user.license_photo_id = license_photo_id
         if is_approved is not None: user.is_approved = is_approved
         
+        queue_invalidation(session, 'user_status', telegram_id)
+        queue_invalidation(session, 'pending_counts')
         session.commit()
         return user
     except SQLAlchemyError as e:
@@ -52,6 +61,68 @@ def get_all_pending_users():
     finally:
         session.close()
 
+def count_pending_users():
+    """ספירת משתמשים ממתינים (COUNT בלבד, בלי לטעון שורות)"""
+    session = Session()
+    try:
+        return session.query(func.count(User.id)).filter_by(is_approved=False, is_banned=False).scalar()
+    finally:
+        session.close()
+
+def get_pending_users_page(offset, limit):
+    """עמוד של משתמשים ממתינים, מהוותיק לחדש (דרך האינדקס החלקי ix_users_pending)"""
+    session = Session()
+    try:
+        return (session.query(User).filter_by(is_approved=False, is_banned=False)
+                .order_by(User.created_at, User.id).offset(offset).limit(limit).all())
+    finally:
+        session.close()
+
+def _like_escape(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_users(text_query, offset, limit, substring_min_len=3):
+    """
+    חיפוש משתמשים לפי @username / שם מלא (לא תלוי רישיות), או לפי ID מספרי.
+    - תחילית: lower(...) LIKE 'q%' - דרך אינדקסי ה-text_pattern_ops.
+    - מ-substring_min_len תווים גם התאמה בכל מקום במחרוזת - דרך אינדקסי ה-GIN של pg_trgm.
+    התאמות תחילית מוצגות קודם. מחזיר עמוד אחד של שורות.
+    """
+    term = text_query.strip().lstrip("@").lower()
+    if not term:
+        return []
+    username, full_name = func.lower(User.username), func.lower(User.full_name)
+    prefix = _like_escape(term) + "%"
+    is_prefix = or_(username.like(prefix, escape="\\"), full_name.like(prefix, escape="\\"))
+    condition = is_prefix
+    if len(term) >= substring_min_len:
+        contains = "%" + _like_escape(term) + "%"
+        condition = or_(username.like(contains, escape="\\"), full_name.like(contains, escape="\\"))
+    if term.isdigit():
+        condition = or_(condition, User.telegram_id == int(term))
+
+    session = Session()
+    try:
+        return (session.query(User).filter(condition)
+                .order_by(case((is_prefix, 0), else_=1), User.full_name, User.id)
+                .offset(offset).limit(limit).all())
+    finally:
+        session.close()
+
+def get_users_changed_since(updated_at, after_id, limit):
+    """משתמשים שהשתנו אחרי הסמן (updated_at, id), לפי הסדר - לסריקה מצטברת דרך האינדקס על updated_at"""
+    session = Session()
+    try:
+        query = session.query(User)
+        if updated_at is not None:
+            query = query.filter(or_(
+                User.updated_at > updated_at,
+                and_(User.updated_at == updated_at, User.id > after_id)
+            ))
+        return query.order_by(User.updated_at, User.id).limit(limit).all()
+    finally:
+        session.close()
+
 def get_all_admins():
     session = Session()
     try:
@@ -65,6 +136,8 @@ def set_user_admin(telegram_id, is_admin):
         user = session.query(User).filter_by(telegram_id=telegram_id).first()
         if user:
             user.is_admin = is_admin
+            queue_invalidation(session, 'user_status', telegram_id)
+            queue_invalidation(session, 'admin_ids')
             session.commit()
             return True
         return False
@@ -81,17 +154,84 @@ def ban_user_in_db(telegram_id):
         if user:
             user.is_banned = True
             user.is_approved = False
+            user.is_admin = False # משתמש חסום לא נשאר מנהל בבוט
+            queue_invalidation(session, 'user_status', telegram_id)
+            queue_invalidation(session, 'pending_counts')
+            queue_invalidation(session, 'admin_ids')
             session.commit()
     except SQLAlchemyError:
         session.rollback()
     finally:
         session.close()
 
+def approve_user_with_side_effects(telegram_id, chat_ids, notice=None):
+    """
+    מאשר משתמש, ובאותה טרנזקציה מכניס ל-outbox את מתן ההרשאות בכל הקבוצות ואת ההודעה הפרטית.
+    משתמש שהיה חסום מקבל קודם גם הסרת חסימה בכל קבוצה (הגבלת הרשאות לא מסירה חסימה בטלגרם).
+    מחזיר True אם ה-commit הצליח (הביצוע מול טלגרם נעשה ע"י ה-outbox worker).
+    """
+    session = Session()
+    try:
+        user = session.query(User).filter_by(telegram_id=telegram_id).first()
+        if not user:
+            user = User(telegram_id=telegram_id)
+            session.add(user)
+        was_banned = bool(user.is_banned)
+        user.is_approved = True
+        user.is_banned = False
+        for chat_id in chat_ids:
+            if was_banned:
+                # נכנס לפני ההרשאות (ID נמוך יותר), וה-outbox מבצע אירועים של אותו משתמש וקבוצה לפי הסדר
+                enqueue_outbox(session, 'unban_chat_member', {'chat_id': chat_id, 'user_id': telegram_id},
+                               f"unban:{chat_id}:{telegram_id}")
+            enqueue_outbox(session, 'grant_permissions', {'chat_id': chat_id, 'user_id': telegram_id},
+                           f"grant:{chat_id}:{telegram_id}")
+        if notice:
+            enqueue_outbox(session, 'send_message', {'chat_id': telegram_id, 'text': notice},
+                           f"approved-notice:{telegram_id}")
+        queue_invalidation(session, 'user_status', telegram_id)
+        queue_invalidation(session, 'pending_counts')
+        session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error approving user {telegram_id}: {e}")
+        return False
+    finally:
+        session.close()
+
+def ban_user_with_side_effects(telegram_id, chat_ids):
+    """חוסם משתמש ב-DB, ובאותה טרנזקציה מכניס ל-outbox את החסימה בכל הקבוצות."""
+    session = Session()
+    try:
+        user = session.query(User).filter_by(telegram_id=telegram_id).first()
+        if user:
+            user.is_banned = True
+            user.is_approved = False
+            user.is_admin = False # משתמש חסום לא נשאר מנהל בבוט
+        else:
+            # משתמש שעוד לא פנה לבוט - יוצרים רשומה חסומה, אחרת יוכל להירשם ולקבל אישור
+            session.add(User(telegram_id=telegram_id, is_banned=True, is_approved=False))
+        queue_invalidation(session, 'user_status', telegram_id)
+        queue_invalidation(session, 'pending_counts')
+        queue_invalidation(session, 'admin_ids')
+        for chat_id in chat_ids:
+            enqueue_outbox(session, 'ban_chat_member', {'chat_id': chat_id, 'user_id': telegram_id},
+                           f"ban:{chat_id}:{telegram_id}")
+        session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error banning user {telegram_id}: {e}")
+        return False
+    finally:
+        session.close()
+
 # ---------------------------------------------------------
 # 📦 ניהול מודעות מכירה (Sell Posts) - החלק שהיה חסר
 # ---------------------------------------------------------
 
-def add_sell_post(user_id, description, price, contact_info, image_id):
+def add_sell_post(user_id, description, price=None, contact_info=None, image_id=None):
     """יוצר מודעת מכירה חדשה"""
     session = Session()
     try:
@@ -105,6 +245,7 @@ def add_sell_post(user_id, description, price, contact_info, image_id):
             status='active'
         )
         session.add(new_post)
+        queue_invalidation(session, 'pending_counts')
         session.commit()
         # מרעננים כדי לקבל את ה-ID החדש
         session.refresh(new_post)
@@ -125,10 +266,23 @@ def get_sell_post(post_id):
         session.close()
 
 def get_user_posts(user_id):
-    """שולף את כל המודעות של משתמש מסוים"""
+    """שולף את כל המודעות של משתמש מסוים (ללא מודעות שנמחקו)"""
+    session = Session()
+    try:
+        return session.query(SellPost).filter(
+            SellPost.user_id == user_id,
+            SellPost.status != 'deleted'
+        ).all()
+    finally:
+        session.close()
+
+def count_user_posts_since(user_id, since):
+    """כמה מודעות המשתמש יצר מאז (כולל כאלה שנדחו/נמחקו) - בסיס למכסה היומית"""
     session = Session()
     try:
-        return session.query(SellPost).filter_by(user_id=user_id).all()
+        return session.query(func.count(SellPost.id)).filter(
+            SellPost.user_id == user_id, SellPost.created_at >= since
+        ).scalar()
     finally:
         session.close()
 
@@ -141,6 +295,7 @@ def update_sell_post(post_id, **kwargs):
             for key, value in kwargs.items():
                 if hasattr(post, key):
                     setattr(post, key, value)
+            queue_invalidation(session, 'pending_counts')
             session.commit()
             return True
         return False
@@ -150,14 +305,87 @@ def update_sell_post(post_id, **kwargs):
     finally:
         session.close()
 
+POST_EDIT_BACKUP_KEY = "post_edit:{}" # הגרסה המאושרת של מודעה שעריכתה ממתינה (shared_state)
+
+def submit_post_edit(post_id, description):
+    """
+    שומר עריכה של מודעה ומחזיר אותה לאישור (is_approved=False).
+    אם המודעה הייתה מאושרת - הגרסה המאושרת נשמרת בצד באותה טרנזקציה, כדי שדחיית העריכה תחזיר אותה.
+    בעריכה נוספת לפני ההחלטה נשמרת הגרסה המאושרת המקורית.
+    """
+    session = Session()
+    try:
+        post = session.query(SellPost).filter_by(id=post_id).first()
+        if not post:
+            return False
+        key = f"watermark:{POST_EDIT_BACKUP_KEY.format(post_id)}"
+        if post.is_approved and session.get(SharedState, key) is None:
+            session.add(SharedState(key=key, value=json.dumps({'description': post.description})))
+        post.description = description
+        post.is_approved = False
+        queue_invalidation(session, 'pending_counts')
+        session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error saving edit of post {post_id}: {e}")
+        return False
+    finally:
+        session.close()
+
+def approve_sell_post(post_id):
+    """מאשר מודעה (חדשה או עריכה) ומוחק את הגרסה הקודמת השמורה, אם יש."""
+    session = Session()
+    try:
+        post = session.query(SellPost).filter_by(id=post_id).first()
+        if not post:
+            return False
+        post.is_approved = True
+        session.query(SharedState).filter_by(key=f"watermark:{POST_EDIT_BACKUP_KEY.format(post_id)}").delete()
+        queue_invalidation(session, 'pending_counts')
+        session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error approving post {post_id}: {e}")
+        return False
+    finally:
+        session.close()
+
+def reject_post_edit(post_id):
+    """
+    דוחה עריכה: מחזיר את הגרסה המאושרת השמורה ואת האישור.
+    מחזיר False אם אין גרסה שמורה - כלומר זו מודעה חדשה, והדחייה שלה היא מחיקה (delete_sell_post).
+    """
+    session = Session()
+    try:
+        backup = session.get(SharedState, f"watermark:{POST_EDIT_BACKUP_KEY.format(post_id)}")
+        post = session.query(SellPost).filter_by(id=post_id).first()
+        if backup is None or post is None:
+            return False
+        post.description = json.loads(backup.value)['description']
+        post.is_approved = True
+        session.delete(backup)
+        queue_invalidation(session, 'pending_counts')
+        queue_invalidation(session, 'posts_index', post.user_id)
+        session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error restoring post {post_id} after a rejected edit: {e}")
+        return False
+    finally:
+        session.close()
+
 def delete_sell_post(post_id):
-    """מוחק מודעה (או מסמן כ-deleted)"""
+    """מסמן מודעה כ-deleted. המחיקה הפיזית נעשית בארכוב (archive_inactive_posts)"""
     session = Session()
     try:
         post = session.query(SellPost).filter_by(id=post_id).first()
-        if post:
-            session.delete(post) # מחיקה פיזית
-            # או: post.status = 'deleted' אם רוצים לשמור היסטוריה
+        if post and post.status != 'deleted':
+            post.status = 'deleted'
+            post.status_changed_at = datetime.utcnow()
+            queue_invalidation(session, 'pending_counts')
             session.commit()
             return True
         return False
@@ -167,6 +395,72 @@ def delete_sell_post(post_id):
     finally:
         session.close()
 
+def get_post_messages(post_id):
+    """שולף את ההודעות שפורסמו עבור מודעה"""
+    session = Session()
+    try:
+        return session.query(SellPostMessage).filter_by(post_id=post_id).all()
+    finally:
+        session.close()
+
+def add_post_message(post_id, chat_id, message_id, has_photo=False):
+    """רושם הודעה שפורסמה עבור מודעה"""
+    session = Session()
+    try:
+        session.add(SellPostMessage(post_id=post_id, chat_id=chat_id, message_id=message_id, has_photo=has_photo))
+        session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error saving published message for post {post_id}: {e}")
+        return False
+    finally:
+        session.close()
+
+def record_published_messages(post_id, messages):
+    """
+    רושם בטרנזקציה אחת את ההודעות שפורסמו עבור מודעה ומעדכן את last_sent_at.
+    messages: רשימת (chat_id, message_id, has_photo).
+    """
+    session = Session()
+    try:
+        session.add_all([
+            SellPostMessage(post_id=post_id, chat_id=chat_id, message_id=message_id, has_photo=has_photo)
+            for chat_id, message_id, has_photo in messages
+        ])
+        session.query(SellPost).filter_by(id=post_id).update({'last_sent_at': datetime.utcnow()}, synchronize_session=False)
+        session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error saving {len(messages)} published messages for post {post_id}: {e}")
+        return False
+    finally:
+        session.close()
+
+def get_published_post_ids(post_ids):
+    """מתוך post_ids - אלו שיש להן הודעות שפורסמו בקבוצות"""
+    if not post_ids:
+        return set()
+    session = Session()
+    try:
+        return set(session.execute(
+            select(SellPostMessage.post_id).where(SellPostMessage.post_id.in_(post_ids)).distinct()
+        ).scalars().all())
+    finally:
+        session.close()
+
+def delete_post_messages(post_id):
+    """מוחק את רישומי ההודעות שפורסמו עבור מודעה"""
+    session = Session()
+    try:
+        session.query(SellPostMessage).filter_by(post_id=post_id).delete(synchronize_session=False)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+    finally:
+        session.close()
+
 def get_pending_sell_posts():
     """עבור אדמין: שליפת כל המודעות הממתינות לאישור"""
     session = Session()
@@ -178,6 +472,14 @@ def get_pending_sell_posts():
     finally:
         session.close()
 
+def count_pending_sell_posts():
+    """ספירת מודעות ממתינות לאישור"""
+    session = Session()
+    try:
+        return session.query(func.count(SellPost.id)).filter_by(is_approved=False, status='active').scalar()
+    finally:
+        session.close()
+
 def get_approved_posts():
     """שליפת כל המודעות המאושרות"""
     session = Session()
@@ -188,3 +490,320 @@ def get_approved_posts():
         return []
     finally:
         session.close()
+
+# ---------------------------------------------------------
+# ♻️ מחזור חיים של מודעות (תפוגה, מכירה, ארכוב)
+# ---------------------------------------------------------
+
+# סטטוסים שאינם "חיים" - מועמדים להעברה לטבלת ההיסטוריה
+INACTIVE_POST_STATUSES = ('sold', 'expired', 'deleted')
+
+def mark_post_sold(post_id, user_id):
+    """מסמן מודעה פעילה כנמכרה. רק בעל המודעה רשאי."""
+    session = Session()
+    try:
+        updated = session.query(SellPost).filter_by(
+            id=post_id, user_id=user_id, status='active'
+        ).update(
+            {'status': 'sold', 'status_changed_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        session.commit()
+        return updated > 0
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error marking post {post_id} as sold: {e}")
+        return False
+    finally:
+        session.close()
+
+def expire_old_posts(max_age_days):
+    """מעביר ל-expired (ב-UPDATE ... RETURNING אחד) מודעות פעילות שגילן עבר את הסף. מחזיר את ה-IDs שפגו."""
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    session = Session()
+    try:
+        ids = session.execute(
+            update(SellPost)
+            .where(SellPost.status == 'active', SellPost.created_at < cutoff)
+            .values(status='expired', status_changed_at=datetime.utcnow())
+            .returning(SellPost.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        if ids:
+            queue_invalidation(session, 'pending_counts')
+        session.commit()
+        return ids
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error expiring old posts: {e}")
+        return []
+    finally:
+        session.close()
+
+_known_partitions = set() # מחיצות שכבר וידאנו בתהליך הזה (חוסך DDL על כל אצוות כתיבה)
+
+@event.listens_for(OrmSession, "after_commit")
+def _remember_partitions(session):
+    # נרשמות רק אחרי commit: טרנזקציה שבוטלה (או נסגרה בלי commit) מבטלת גם את ה-CREATE TABLE
+    _known_partitions.update(session.info.pop('new_partitions', ()))
+
+@event.listens_for(OrmSession, "after_transaction_end")
+def _forget_partitions(session, transaction):
+    # rollback או close בלי commit (ה-Session של scoped_session ממוחזר, אז לא משאירים שאריות)
+    if transaction.parent is None:
+        session.info.pop('new_partitions', None)
+
+def ensure_month_partition(session, parent_table, moment):
+    """יוצר (אם חסרה) את מחיצת החודש של moment עבור טבלה מחולקת. רלוונטי ל-Postgres בלבד."""
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    start = datetime(moment.year, moment.month, 1)
+    end = datetime(start.year + (start.month == 12), start.month % 12 + 1, 1)
+    partition = f"{parent_table}_{start:%Y_%m}"
+    if partition in _known_partitions:
+        return
+    session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {parent_table} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+    session.info.setdefault('new_partitions', set()).add(partition)
+
+def archive_inactive_posts(grace_days, batch_size=1000):
+    """
+    מעביר מודעות שנמכרו/פגו/נמחקו לפני יותר מ-grace_days ימים ל-sell_posts_history.
+    ההעברה מבוססת-סט: INSERT ... SELECT ו-DELETE על אותה קבוצת IDs, באצוות, באותה טרנזקציה.
+    מחזיר את ה-IDs של המודעות שהועברו.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=grace_days)
+    columns = ['id', 'user_id', 'description', 'price', 'contact_info', 'image_id',
+               'is_approved', 'status', 'created_at', 'status_changed_at']
+    archived = []
+    session = Session()
+    try:
+        now = datetime.utcnow()
+        ensure_month_partition(session, SellPostHistory.__tablename__, now)
+        while True:
+            ids = session.execute(
+                select(SellPost.id).where(
+                    SellPost.status.in_(INACTIVE_POST_STATUSES),
+                    SellPost.status_changed_at < cutoff
+                ).order_by(SellPost.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+
+            source = select(
+                *[getattr(SellPost, c) for c in columns],
+                literal(now, DateTime).label('archived_at')
+            ).where(SellPost.id.in_(ids))
+            session.execute(insert(SellPostHistory).from_select(columns + ['archived_at'], source))
+            session.execute(delete(SellPost).where(SellPost.id.in_(ids)))
+            session.commit()
+
+            archived.extend(ids)
+            if len(ids) < batch_size:
+                break
+        return archived
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error archiving inactive posts: {e}")
+        return archived
+    finally:
+        session.close()
+
+# ---------------------------------------------------------
+# 📤 Outbox - תופעות לוואי אמינות
+# ---------------------------------------------------------
+
+OUTBOX_LEASE_SECONDS = 60 # כמה זמן אירוע "תפוס" ע"י worker לפני שמותר לנסות אותו שוב
+
+def enqueue_outbox(session, kind, payload, idempotency_key):
+    """מוסיף אירוע ל-outbox בתוך הטרנזקציה של session. אירוע ממתין עם אותו מפתח לא יוכנס שוב."""
+    dialect = session.get_bind().dialect.name
+    values = dict(kind=kind, payload=json.dumps(payload), idempotency_key=idempotency_key,
+                  status='pending', attempts=0, next_attempt_at=datetime.utcnow(), created_at=datetime.utcnow())
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        session.execute(dialect_insert(OutboxEvent).values(**values).on_conflict_do_nothing(
+            index_elements=['idempotency_key'], index_where=(OutboxEvent.status == 'pending')
+        ))
+        return
+    exists = session.query(OutboxEvent.id).filter_by(idempotency_key=idempotency_key, status='pending').first()
+    if not exists:
+        session.add(OutboxEvent(**values))
+
+def claim_outbox_batch(limit):
+    """
+    תופס אצווה של אירועים שהגיע זמנם (FOR UPDATE SKIP LOCKED ב-Postgres) ודוחה את next_attempt_at
+    כ"חכירה", כך ש-worker אחר לא יבצע אותם במקביל. מחזיר [(id, kind, payload, attempts)].
+    """
+    session = Session()
+    try:
+        now = datetime.utcnow()
+        query = session.query(OutboxEvent).filter(
+            OutboxEvent.status == 'pending',
+            OutboxEvent.next_attempt_at <= now
+        ).order_by(OutboxEvent.id).limit(limit)
+        if session.get_bind().dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+        events = query.all()
+        lease_until = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        batch = []
+        for event in events:
+            event.next_attempt_at = lease_until
+            batch.append((event.id, event.kind, json.loads(event.payload), event.attempts))
+        session.commit()
+        return batch
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error claiming outbox batch: {e}")
+        return []
+    finally:
+        session.close()
+
+def complete_outbox_events(event_ids):
+    """מסמן אירועים שבוצעו (UPDATE אחד לכל האצווה)"""
+    if not event_ids:
+        return
+    session = Session()
+    try:
+        session.query(OutboxEvent).filter(OutboxEvent.id.in_(event_ids)).update(
+            {'status': 'done', 'processed_at': datetime.utcnow()}, synchronize_session=False
+        )
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error completing outbox events: {e}")
+    finally:
+        session.close()
+
+def fail_outbox_event(event_id, error, retry_at=None, count_attempt=True):
+    """רושם כישלון. retry_at=None מסמן כישלון סופי (failed)."""
+    session = Session()
+    try:
+        values = {'last_error': str(error)[:500]}
+        if count_attempt:
+            values['attempts'] = OutboxEvent.attempts + 1
+        if retry_at is None:
+            values.update(status='failed', processed_at=datetime.utcnow())
+        else:
+            values['next_attempt_at'] = retry_at
+        session.query(OutboxEvent).filter_by(id=event_id).update(values, synchronize_session=False)
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error recording outbox failure {event_id}: {e}")
+    finally:
+        session.close()
+
+def enqueue_side_effects(events):
+    """מכניס ל-outbox רשימת אירועים [(kind, payload, idempotency_key)] בטרנזקציה אחת"""
+    if not events:
+        return True
+    session = Session()
+    try:
+        for kind, payload, key in events:
+            enqueue_outbox(session, kind, payload, key)
+        session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error enqueueing side effects: {e}")
+        return False
+    finally:
+        session.close()
+
+# ---------------------------------------------------------
+# 🔖 סמנים (watermarks) של משימות מחזוריות
+# ---------------------------------------------------------
+
+def get_watermark(name):
+    """מחזיר את הסמן השמור של משימה (מחרוזת JSON מפוענחת) או None"""
+    session = Session()
+    try:
+        row = session.query(SharedState).filter_by(key=f"watermark:{name}").first()
+        return json.loads(row.value) if row else None
+    finally:
+        session.close()
+
+def set_watermark(name, value):
+    session = Session()
+    try:
+        key = f"watermark:{name}"
+        row = session.query(SharedState).filter_by(key=key).first()
+        if not row:
+            row = SharedState(key=key)
+            session.add(row)
+        row.value = json.dumps(value)
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error saving watermark {name}: {e}")
+    finally:
+        session.close()
+
+def get_chat_lock(chat_id):
+    """נעילת קבוצה שמורה (גל הצטרפות): {'until': epoch, 'permissions': dict|None} או None"""
+    return get_watermark(f"chat_lock:{chat_id}")
+
+def get_chat_locks():
+    """כל נעילות הקבוצות השמורות: {chat_id: {'until', 'permissions'}} - לשחזור אחרי הפעלה מחדש"""
+    session = Session()
+    try:
+        rows = session.query(SharedState).filter(SharedState.key.like("watermark:chat_lock:%")).all()
+        return {int(row.key.rsplit(":", 1)[1]): json.loads(row.value) for row in rows}
+    finally:
+        session.close()
+
+def save_chat_lock(chat_id, until, permissions):
+    set_watermark(f"chat_lock:{chat_id}", {'until': until, 'permissions': permissions})
+
+def delete_chat_lock(chat_id):
+    session = Session()
+    try:
+        session.query(SharedState).filter_by(key=f"watermark:chat_lock:{chat_id}").delete()
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error deleting chat lock {chat_id}: {e}")
+    finally:
+        session.close()
+
+# ---------------------------------------------------------
+# 📜 יומן ביקורת (Audit log)
+# ---------------------------------------------------------
+
+def write_audit_entries(entries):
+    """
+    כותב אצוות רשומות ליומן הביקורת בהכנסה אחת (executemany).
+    entries: רשימת dicts עם actor_id, action, target_id, details, created_at. מחזיר True אם נכתב.
+    """
+    if not entries:
+        return True
+    session = Session()
+    try:
+        for month in {(e['created_at'].year, e['created_at'].month) for e in entries}:
+            ensure_month_partition(session, AuditLog.__tablename__, datetime(*month, 1))
+        session.execute(insert(AuditLog), entries)
+        session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error writing {len(entries)} audit entries: {e}")
+        return False
+    finally:
+        session.close()
+
+def get_audit_entries(target_id, limit=20):
+    """הרשומות האחרונות על משתמש (דרך ix_audit_log_target), מהחדשה לישנה"""
+    session = Session()
+    try:
+        return session.execute(
+            select(AuditLog).where(AuditLog.target_id == target_id)
+            .order_by(AuditLog.created_at.desc()).limit(limit)
+        ).scalars().all()
+    finally:
+        session.close()
@@ -2,6 +2,7 @@
 # קובץ: handlers/admin.py (מתוקן)
 # ==================================
 import logging
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -10,13 +11,24 @@ from telegram.ext import (
     ContextTypes
 )
 from db_operations import (
-    create_or_update_user, set_user_admin, get_all_pending_users, 
-    get_pending_sell_posts, get_approved_posts, get_all_admins
+    create_or_update_user, set_user_admin, get_pending_users_page, search_users,
+    get_approved_posts, get_all_admins,
+    get_sell_post, approve_sell_post, reject_post_edit, delete_sell_post, approve_user_with_side_effects
 )
+import tracing
 from handlers.utils import (
     is_chat_admin, ALL_COMMUNITY_CHATS, is_super_admin, 
-    is_user_admin, build_main_menu_for_user
+    is_user_admin, build_main_menu_for_user, ban_user_globally,
+    get_pending_counts
 )
+from handlers.review_queue import review_queue
+from handlers.ui import render
+from handlers.verification_intake import verification_intake
+from handlers.outbox import trigger_outbox
+from handlers.audit import audit
+from handlers.publisher import publish_post, refresh_published_post, remove_published_post
+from handlers.sessions import active_sessions, stats as session_stats
+from handlers.rate_limit import stats as rate_limit_stats
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +38,11 @@ CALLBACK_ADMIN_STATS = "admin_stats"         # עבור סטטיסטיקות
 CALLBACK_ADMIN_PENDING = "approve_pending"   # עבור אישור ממתינים (או admin_pending_menu)
 CALLBACK_VIEW_USERS = "admin_view_pending_users"
 CALLBACK_SEND_PENDING = "sendpending"
+CALLBACK_USERS = "usr" # רשימות משתמשים בעמודים: usr_<view>_page_<n>, usr_<view>_<action>_<id>_<n>
+
+PENDING_PAGE_SIZE = 10
+FIND_PAGE_SIZE = 5
+FIND_QUERY_MAX_LEN = 64
 
 # --- פונקציות Callback לניהול ---
 
@@ -36,32 +53,35 @@ async def handle_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     user_id = query.from_user.id
     if not is_user_admin(user_id):
-        await query.edit_message_text("⛔ אין לך הרשאות צפייה בנתונים אלו.", reply_markup=build_main_menu_for_user(user_id))
+        await render(update, "⛔ אין לך הרשאות צפייה בנתונים אלו.", reply_markup=build_main_menu_for_user(user_id))
         return
 
-    # שליפת נתונים
-    pending_users = get_all_pending_users()
-    pending_posts = get_pending_sell_posts()
+    # שליפת נתונים (ממתינים - ספירה מהקאש, בלי לטעון את השורות)
+    pending_users_count, pending_posts_count = get_pending_counts()
     active_posts = get_approved_posts()
     admins = get_all_admins()
     
     stats_text = f"""📊 **לוח בקרה וסטטיסטיקות:**
 
 👥 **משתמשים:**
-• ממתינים לאישור: {len(pending_users)}
+• ממתינים לאישור: {pending_users_count}
 • מנהלים במערכת: {len(admins)}
 
 📦 **מודעות מכירה:**
-• ממתינות לאישור: {len(pending_posts)}
+• ממתינות לאישור: {pending_posts_count}
 • פעילות ומאושרות: {len(active_posts)}
 
+🧹 **סשנים:** פעילים {active_sessions(context.application)}, פונו {session_stats['evicted']}, שיחות שפג תוקפן {session_stats['timed_out']}
+🚦 **הגבלת קצב:** נחסמו {rate_limit_stats['refused']} ניסיונות, {rate_limit_stats['quota_refused']} מעבר למכסה היומית
+📥 **תור קליטת אימות:** {verification_intake.depth()} (אוחדו: {verification_intake.coalesced}, נדחו בעומס: {verification_intake.rejected})
+
 ⚙️ **סטטוס מערכת:** תקין
 """
     
     # כפתור חזרה לתפריט הראשי
     keyboard = [[InlineKeyboardButton("⬅️ חזור לתפריט", callback_data="main_menu_return")]]
     
-    await query.edit_message_text(stats_text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+    await render(update, stats_text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 async def handle_admin_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -69,8 +89,7 @@ async def handle_admin_pending(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
     
-    pending_users_count = len(get_all_pending_users())
-    pending_posts_count = len(get_pending_sell_posts())
+    pending_users_count, pending_posts_count = get_pending_counts()
     
     text = f"🚨 **ניהול ממתינים**\n\nבחר קטגוריה לטיפול:"
     
@@ -89,28 +108,159 @@ async def handle_admin_pending(update: Update, context: ContextTypes.DEFAULT_TYP
         
     keyboard.append([InlineKeyboardButton("⬅️ חזור", callback_data="main_menu_return")])
     
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+    await render(update, text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+
+# --- רשימות משתמשים בעמודים (ממתינים / תוצאות /find) ---
+
+def _user_line(index: int, user) -> str:
+    if user.is_admin:
+        status = "👑"
+    elif user.is_banned:
+        status = "🚫"
+    elif user.is_approved:
+        status = "✅"
+    else:
+        status = "⏳"
+    username = f" @{user.username}" if user.username else ""
+    return f"{index}. {status} {user.full_name or '—'}{username} (ID: {user.telegram_id})"
+
+def _can_ban(viewer_id: int, target_id: int, target_is_admin: bool) -> bool:
+    """אדמינים (והסופר-אדמין) נחסמים רק ע"י הסופר-אדמין; אף אחד לא חוסם את עצמו."""
+    if target_id == viewer_id:
+        return False
+    if target_is_admin or is_super_admin(target_id):
+        return is_super_admin(viewer_id)
+    return True
+
+def _load_users_page(view: str, page: int, query: str = None):
+    """(שורות העמוד, האם יש עמוד הבא). שולף שורה אחת מעבר לעמוד כדי לדעת אם להציג "הבא"."""
+    size = FIND_PAGE_SIZE if view == "find" else PENDING_PAGE_SIZE
+    if view == "find":
+        users = search_users(query, page * size, size + 1)
+    else:
+        users = get_pending_users_page(page * size, size + 1)
+    return users[:size], len(users) > size
+
+def _build_users_page(view: str, page: int, viewer_id: int, query: str = None):
+    """טקסט ומקלדת של עמוד: שורה לכל משתמש, כפתורי פעולה ממוספרים, ודפדוף."""
+    users, has_next = _load_users_page(view, page, query)
+    size = FIND_PAGE_SIZE if view == "find" else PENDING_PAGE_SIZE
+    back = [InlineKeyboardButton("⬅️ חזור", callback_data=CALLBACK_ADMIN_PENDING)] if view == "pending" else []
+
+    if not users and page == 0:
+        text = f"🔍 לא נמצאו משתמשים עבור \"{query}\"." if view == "find" else "✅ אין משתמשים ממתינים כרגע."
+        return text, InlineKeyboardMarkup([back]) if back else None
+
+    title = f"🔍 תוצאות עבור \"{query}\"" if view == "find" else "📋 משתמשים לאישור"
+    lines = [f"{title} (עמוד {page + 1}):", ""]
+    keyboard = []
+    for index, user in enumerate(users, start=page * size + 1):
+        lines.append(_user_line(index, user))
+        tid, row = user.telegram_id, []
+        if not user.is_approved or user.is_banned:
+            row.append(InlineKeyboardButton(f"✅ {index}", callback_data=f"{CALLBACK_USERS}_{view}_approve_{tid}_{page}"))
+        if not user.is_banned and _can_ban(viewer_id, tid, user.is_admin):
+            row.append(InlineKeyboardButton(f"🚫 {index}", callback_data=f"{CALLBACK_USERS}_{view}_ban_{tid}_{page}"))
+        if is_super_admin(viewer_id) and not user.is_admin and not user.is_banned:
+            row.append(InlineKeyboardButton(f"👑 {index}", callback_data=f"{CALLBACK_USERS}_{view}_admin_{tid}_{page}"))
+        if row:
+            keyboard.append(row)
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ הקודם", callback_data=f"{CALLBACK_USERS}_{view}_page_{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("הבא ▶️", callback_data=f"{CALLBACK_USERS}_{view}_page_{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    if back:
+        keyboard.append(back)
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def _render_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE, view: str, page: int) -> bool:
+    """מציג עמוד (עריכה במקום דרך render). False אם החיפוש כבר לא שמור (user_data פונה)."""
+    query = None
+    if view == "find":
+        query = (context.user_data or {}).get('find_query')
+        if not query:
+            return False
+    text, markup = _build_users_page(view, page, update.effective_user.id, query)
+    await render(update, text, reply_markup=markup)
+    return True
 
 async def handle_view_pending_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """מציג את רשימת המשתמשים הממתינים."""
+    """מציג את רשימת המשתמשים הממתינים (עמוד ראשון)."""
     query = update.callback_query
     await query.answer()
-    
-    users = get_all_pending_users()
-    if not users:
-        await query.edit_message_text(
-            "✅ אין משתמשים ממתינים כרגע.", 
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("חזור", callback_data=CALLBACK_ADMIN_PENDING)]])
-        )
+    if not is_user_admin(query.from_user.id):
         return
+    await _render_users_page(update, context, "pending", 0)
 
-    text = "📋 **משתמשים לאישור:**\nהשתמש בפקודה `/approve ID` כדי לאשר ידנית:\n\n"
-    for u in users[:10]: 
-        text += f"• {u.full_name} (ID: `{u.telegram_id}`)\n"
-    
-    # כפתור חזרה לתפריט הניהול הקודם
-    keyboard = [[InlineKeyboardButton("⬅️ חזור", callback_data=CALLBACK_ADMIN_PENDING)]]
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+async def handle_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """דפדוף ברשימות המשתמשים."""
+    query = update.callback_query
+    if not is_user_admin(query.from_user.id):
+        await query.answer("⛔ אין הרשאה.", show_alert=True)
+        return
+    _, view, _, page = query.data.split("_")
+    if not await _render_users_page(update, context, view, int(page)):
+        await query.answer("החיפוש פג - שלח /find שוב.", show_alert=True)
+        return
+    await query.answer()
+
+async def handle_users_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """כפתורי אישור / חסימה / מינוי לאדמין מתוך הרשימות, ואז רענון העמוד."""
+    query = update.callback_query
+    admin = query.from_user
+    if not is_user_admin(admin.id):
+        await query.answer("⛔ אין הרשאה.", show_alert=True)
+        return
+    _, view, action, target, page = query.data.split("_")
+    target = int(target)
+
+    if action == "approve":
+        ok = await approve_user(context, target, admin.id)
+        label = f"✅ אושר ע\"י {admin.full_name}"
+    elif action == "ban":
+        if not _can_ban(admin.id, target, is_user_admin(target)):
+            await query.answer("⛔ רק הסופר-אדמין יכול לחסום אדמינים.", show_alert=True)
+            return
+        ok = await ban_user_globally(context.bot, target)
+        if ok:
+            audit(admin.id, 'ban_user', target)
+        trigger_outbox(context.job_queue)
+        label = f"🚫 נחסם ע\"י {admin.full_name}"
+    else:
+        if not is_super_admin(admin.id):
+            await query.answer("⛔ רק הסופר-אדמין ממנה אדמינים.", show_alert=True)
+            return
+        ok = set_user_admin(target, True)
+        if ok:
+            create_or_update_user(target, is_approved=True)
+            audit(admin.id, 'set_admin', target)
+        label = f"👑 מונה לאדמין ע\"י {admin.full_name}"
+
+    if not ok:
+        await query.answer("שגיאה.", show_alert=True)
+        return
+    await query.answer(label[:200])
+    if action != "admin":
+        await _resolve_review_item(context, f"user:{target}", label)
+    await _render_users_page(update, context, view, int(page))
+
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/find <שם או @username> - חיפוש משתמשים (תחילית, ומ-3 תווים גם באמצע השם)."""
+    if update.effective_chat.type != "private": return
+    if not is_user_admin(update.effective_user.id):
+        await update.message.reply_text("⛔️ אין הרשאה.")
+        return
+    if not context.args:
+        await update.message.reply_text("שימוש: /find <שם או @username או ID>")
+        return
+    query = " ".join(context.args)[:FIND_QUERY_MAX_LEN]
+    context.user_data['find_query'] = query # הדפדוף והכפתורים קוראים את החיפוש מכאן
+    text, markup = _build_users_page("find", 0, update.effective_user.id, query)
+    await update.message.reply_text(text, reply_markup=markup)
 
 
 # --- פקודות טקסט ---
@@ -125,25 +275,134 @@ async def set_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     try:
         target = int(context.args[0])
-        set_user_admin(target, True)
-        create_or_update_user(target, is_approved=True)
-        await update.message.reply_text(f"✅ אדמין {target} הוגדר בהצלחה.")
-    except Exception:
+    except ValueError:
         await update.message.reply_text("שגיאה בפורמט ה-ID.")
+        return
+    # קודם יוצרים את המשתמש (אם עוד לא פנה לבוט), אחרת set_user_admin לא ימצא אותו
+    create_or_update_user(target, is_approved=True)
+    if not set_user_admin(target, True):
+        await update.message.reply_text(f"❌ שגיאה בהגדרת {target} כאדמין. נסה שוב.")
+        return
+    audit(update.effective_user.id, 'set_admin', target)
+    await update.message.reply_text(f"✅ אדמין {target} הוגדר בהצלחה.")
+
+async def traces_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/traces [N] - העקבות האיטיות האחרונות (רק כש-TRACING=1)."""
+    if update.effective_chat.type != "private": return
+    if not is_user_admin(update.effective_user.id):
+        await update.message.reply_text("⛔️ אין הרשאה.")
+        return
+    if not tracing.TRACING_ENABLED:
+        await update.message.reply_text("המעקב כבוי (TRACING=1 להפעלה).")
+        return
+    if not tracing.slow_traces:
+        await update.message.reply_text(f"אין עקבות מעל {tracing.TRACE_SLOW_MS}ms.")
+        return
+
+    count = int(context.args[0]) if context.args and context.args[0].isdigit() else 5
+    for recorded_at, trace in list(tracing.slow_traces)[-count:]:
+        header = datetime.utcfromtimestamp(recorded_at).strftime('%H:%M:%S UTC')
+        await update.message.reply_text(f"🐢 {header}\n{trace}"[:4096]) # מגבלת אורך הודעה
+
+async def approve_user(context: ContextTypes.DEFAULT_TYPE, tid: int, actor_id: int = None) -> bool:
+    """
+    מאשר משתמש. האישור, מתן ההרשאות בכל הקבוצות וההודעה הפרטית נרשמים באותה טרנזקציה (outbox),
+    והביצוע מול טלגרם קורה ברקע - ה-handler לא מחכה ל-N קריאות API.
+    """
+    ok = approve_user_with_side_effects(tid, ALL_COMMUNITY_CHATS, notice="✅ אושרת בקהילה! כעת ניתן לכתוב.")
+    if ok:
+        trigger_outbox(context.job_queue)
+        audit(actor_id, 'approve_user', tid)
+    return ok
+
+async def _resolve_review_item(context: ContextTypes.DEFAULT_TYPE, key: str, label: str):
+    """סוגר פריט בערוץ הניהול אחרי פעולה שכבר הצליחה; כישלון בעריכת ההודעה רק נרשם ללוג."""
+    try:
+        await review_queue.resolve(context.bot, key, label)
+    except Exception as e:
+        logger.warning(f"Failed to update review message for {key}: {e}")
 
 async def approve_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_chat_admin(update.effective_chat, update.effective_user): return
     if not context.args: return
     try:
         tid = int(context.args[0])
-        create_or_update_user(tid, is_approved=True)
-        from handlers.utils import grant_user_permissions
-        for cid in ALL_COMMUNITY_CHATS:
-            await grant_user_permissions(cid, tid)
-        await update.message.reply_text(f"✅ משתמש {tid} אושר!")
-        try: await context.bot.send_message(tid, "✅ אושרת בקהילה! כעת ניתן לכתוב.")
-        except: pass
-    except: await update.message.reply_text("שגיאה.")
+    except ValueError:
+        await update.message.reply_text("שגיאה בפורמט ה-ID.")
+        return
+    if not await approve_user(context, tid, update.effective_user.id):
+        await update.message.reply_text("שגיאה.")
+        return
+    await update.message.reply_text(f"✅ משתמש {tid} אושר!")
+    await _resolve_review_item(context, f"user:{tid}", f"✅ אושר (/approve)")
+
+async def handle_review_decision(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """מטפל בכפתורי ההחלטה שנשלחו לערוץ הניהול (אימות משתמשים ומודעות)."""
+    query = update.callback_query
+    admin = query.from_user
+    if not is_user_admin(admin.id):
+        await query.answer("⛔ אין הרשאה.", show_alert=True)
+        return
+
+    action, target = query.data.split("@", 1)[0].rsplit("_", 1) # @<owner> הוא רמז ניתוב בלבד
+    target = int(target)
+
+    if action == "approve":
+        if not await approve_user(context, target, admin.id):
+            await query.answer("❌ שגיאה באישור המשתמש. נסה שוב.", show_alert=True)
+            return
+        key, label = f"user:{target}", f"✅ אושר ע\"י {admin.full_name}"
+    elif action == "ban":
+        if not _can_ban(admin.id, target, is_user_admin(target)):
+            await query.answer("⛔ רק הסופר-אדמין יכול לחסום אדמינים.", show_alert=True)
+            return
+        if not await ban_user_globally(context.bot, target):
+            await query.answer("❌ שגיאה בחסימת המשתמש. נסה שוב.", show_alert=True)
+            return
+        audit(admin.id, 'ban_user', target)
+        trigger_outbox(context.job_queue)
+        key, label = f"user:{target}", f"🚫 נחסם ע\"י {admin.full_name}"
+    else:
+        post = get_sell_post(target)
+        if action == "approve_post":
+            key = f"post:{target}"
+            if not post or post.status != 'active':
+                # המוכר מחק או סימן כנמכרה בזמן ההמתנה - לא מפרסמים, רק סוגרים את הפריט
+                label, post = "⚠️ המודעה כבר לא פעילה - לא פורסמה", None
+            elif not approve_sell_post(target):
+                await query.answer("❌ שגיאה באישור המודעה. נסה שוב.", show_alert=True)
+                return
+            else:
+                label, notice = f"✅ מודעה אושרה ע\"י {admin.full_name}", f"✅ מודעה {target} אושרה!"
+                # עריכה של מודעה שכבר פורסמה: ההודעות הקיימות מקבלות את הטקסט המאושר, ורק קבוצות חסרות מקבלות פרסום
+                await refresh_published_post(context.bot, post)
+                report = await publish_post(context.bot, post)
+                label += f" · פורסמה ב-{report.ok}/{report.total} קבוצות"
+                if report.failures:
+                    label += "\n⚠️ נכשל: " + ", ".join(f"{chat_id} ({error})" for chat_id, error in report.failures.items())
+        elif reject_post_edit(target):
+            # דחיית עריכה של מודעה מאושרת: הגרסה הקודמת חוזרת, וההודעות שפורסמו (שלא נערכו) נשארות
+            key = f"post:{target}"
+            label = f"❌ עריכה נדחתה ע\"י {admin.full_name} - הגרסה הקודמת נשארה"
+            notice = f"❌ העריכה של מודעה {target} נדחתה. הגרסה הקודמת נשארת בפרסום."
+        else:
+            delete_sell_post(target)
+            await remove_published_post(context.bot, target) # למקרה שפורסמה לפני שנשמרה גרסה קודמת
+            key, label, notice = f"post:{target}", f"❌ מודעה נדחתה ע\"י {admin.full_name}", f"❌ מודעה {target} נדחתה."
+        if post:
+            audit(admin.id, action, post.user_id, post_id=target)
+            try: await context.bot.send_message(post.user_id, notice)
+            except Exception: pass
+
+    await query.answer(label[:200]) # מגבלת טלגרם להתראת callback
+    try:
+        if not await review_queue.resolve(context.bot, key, label):
+            # ההודעה לא מוכרת לתור (למשל אחרי הפעלה מחדש) - מסירים רק את שורת הכפתורים שנלחצה
+            rows = [row for row in (query.message.reply_markup.inline_keyboard if query.message.reply_markup else [])
+                    if all(b.callback_data != query.data for b in row)]
+            await query.edit_message_reply_markup(InlineKeyboardMarkup(rows) if rows else None)
+    except Exception as e:
+        logger.warning(f"Failed to update review message for {key}: {e}")
 
 async def send_pending_trigger(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Callback wrapper."""
@@ -159,6 +418,8 @@ def setup_admin_handlers(application: Application):
     
     application.add_handler(CommandHandler("approve", approve_user_command))
     application.add_handler(CommandHandler("set_admin", set_admin_command))
+    application.add_handler(CommandHandler("traces", traces_command))
+    application.add_handler(CommandHandler("find", find_command))
     
     # --- התיקון הגדול כאן: שימוש ב-Regex גמיש ---
     
@@ -170,7 +431,14 @@ def setup_admin_handlers(application: Application):
     
     # תפריטים פנימיים
     application.add_handler(CallbackQueryHandler(handle_view_pending_users, pattern=f"^{CALLBACK_VIEW_USERS}$"))
+    application.add_handler(CallbackQueryHandler(handle_users_page, pattern=rf"^{CALLBACK_USERS}_(pending|find)_page_\d+$"))
+    application.add_handler(CallbackQueryHandler(
+        handle_users_action, pattern=rf"^{CALLBACK_USERS}_(pending|find)_(approve|ban|admin)_\d+_\d+$"
+    ))
     application.add_handler(CallbackQueryHandler(send_pending_trigger, pattern=f"^{CALLBACK_SEND_PENDING}$"))
     application.add_handler(CallbackQueryHandler(ignore_callback, pattern="^ignore$"))
+
+    # החלטות מערוץ הניהול (אימות משתמשים / מודעות)
+    application.add_handler(CallbackQueryHandler(handle_review_decision, pattern=r"^(approve|ban|approve_post|reject_post)_\d+(@\d+)?$"))
     
     logger.info("Admin handlers setup complete with flexible patterns")
@@ -0,0 +1,220 @@
+# ==================================
+# קובץ: handlers/antispam.py (זיהוי גלי הצטרפות וניקוד משתמשים חשודים)
+# ==================================
+import os
+import re
+import time
+import logging
+from array import array
+from typing import Dict, Optional, Tuple
+from telegram import Bot, ChatPermissions, User
+from telegram.ext import ContextTypes, JobQueue
+
+from db_operations import get_chat_lock, get_chat_locks, save_chat_lock, delete_chat_lock
+from handlers.utils import set_group_read_only
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+ANTISPAM_WINDOW = int(os.getenv("ANTISPAM_WINDOW", 60))                      # חלון הספירה בשניות
+ANTISPAM_CHAT_JOIN_LIMIT = int(os.getenv("ANTISPAM_CHAT_JOIN_LIMIT", 20))    # הצטרפויות לקבוצה בחלון
+ANTISPAM_GLOBAL_JOIN_LIMIT = int(os.getenv("ANTISPAM_GLOBAL_JOIN_LIMIT", 50)) # הצטרפויות לכל הקבוצות בחלון
+ANTISPAM_LOCK_SECONDS = int(os.getenv("ANTISPAM_LOCK_SECONDS", 600))         # כמה זמן קבוצה נעולה אחרי גל
+ANTISPAM_BOT_SCORE = float(os.getenv("ANTISPAM_BOT_SCORE", 0.6))             # מעל הציון הזה - לא שולחים הודעת ברוכים הבאים
+# IDs של טלגרם עולים עם הזמן; מעל הסף הזה החשבון נחשב חדש יחסית
+ANTISPAM_NEW_ACCOUNT_ID = int(os.getenv("ANTISPAM_NEW_ACCOUNT_ID", 7_000_000_000))
+
+LINK_PATTERN = re.compile(r"(https?://|t\.me/|www\.|@\w{4,}|\.(com|ru|io|xyz)\b)", re.IGNORECASE)
+
+
+class SlidingWindowCounter:
+    """
+    מונה בחלון זמן נע: מערך מעגלי של דליים (דלי לכל שנייה), בלי לשמור אירועים בודדים.
+    הזיכרון קבוע (window מספרים שלמים) בלי קשר לכמות האירועים.
+    """
+    __slots__ = ("_size", "_buckets", "_last_tick", "_total")
+
+    def __init__(self, window: int = ANTISPAM_WINDOW):
+        self._size = max(1, window)
+        self._buckets = array("I", [0]) * self._size
+        self._last_tick = 0
+        self._total = 0
+
+    def _advance(self, tick: int):
+        elapsed = tick - self._last_tick
+        if elapsed <= 0:
+            return
+        if elapsed >= self._size:
+            for i in range(self._size):
+                self._buckets[i] = 0
+            self._total = 0
+        else:
+            for step in range(1, elapsed + 1):
+                slot = (self._last_tick + step) % self._size
+                self._total -= self._buckets[slot]
+                self._buckets[slot] = 0
+        self._last_tick = tick
+
+    def add(self, now: Optional[float] = None, amount: int = 1) -> int:
+        tick = int(now if now is not None else time.monotonic())
+        self._advance(tick)
+        self._buckets[tick % self._size] += amount
+        self._total += amount
+        return self._total
+
+    def count(self, now: Optional[float] = None) -> int:
+        self._advance(int(now if now is not None else time.monotonic()))
+        return self._total
+
+
+def score_user(user: User, via_join_request: bool = False) -> float:
+    """ציון היוריסטי 0..1 לסבירות שהמצטרף הוא בוט/ספאמר, לפי מה שזמין ב-Update בלבד (בלי קריאות API)."""
+    if user.is_bot:
+        return 1.0
+    score = 0.0
+    name = f"{user.first_name or ''} {user.last_name or ''}".strip()
+    if not user.username:
+        score += 0.2
+    if LINK_PATTERN.search(name):
+        score += 0.4
+    if len(name) > 40 or not re.search(r"\w", name):
+        score += 0.1
+    if user.id >= ANTISPAM_NEW_ACCOUNT_ID:
+        score += 0.2
+    if not user.language_code:
+        score += 0.05
+    if user.is_premium:
+        score -= 0.3
+    if via_join_request:
+        score -= 0.1 # עבר בקשת הצטרפות שאושרה
+    return max(0.0, min(1.0, score))
+
+
+class JoinGuard:
+    """מונים לכל קבוצה ולכל הקהילה, ומצב 'גל הצטרפות' לכל קבוצה."""
+
+    def __init__(self):
+        self._per_chat: Dict[int, SlidingWindowCounter] = {}
+        self._global = SlidingWindowCounter()
+        self._locked_until: Dict[int, float] = {}
+        self.suppressed_dms = 0
+
+    def record_join(self, chat_id: int, now: Optional[float] = None) -> Tuple[int, int]:
+        """רושם הצטרפות ומחזיר (הצטרפויות לקבוצה בחלון, הצטרפויות גלובליות בחלון)."""
+        counter = self._per_chat.get(chat_id)
+        if counter is None:
+            counter = self._per_chat[chat_id] = SlidingWindowCounter()
+        return counter.add(now), self._global.add(now)
+
+    def chat_rate(self, chat_id: int) -> int:
+        counter = self._per_chat.get(chat_id)
+        return counter.count() if counter else 0
+
+    def is_raid(self, chat_id: int) -> bool:
+        return chat_id in self._locked_until or self._global.count() > ANTISPAM_GLOBAL_JOIN_LIMIT
+
+    def should_lock(self, chat_id: int, chat_joins: int) -> bool:
+        return chat_joins > ANTISPAM_CHAT_JOIN_LIMIT and chat_id not in self._locked_until
+
+    def mark_locked(self, chat_id: int):
+        self._locked_until[chat_id] = time.monotonic() + ANTISPAM_LOCK_SECONDS
+
+    def mark_unlocked(self, chat_id: int):
+        self._locked_until.pop(chat_id, None)
+
+
+join_guard = JoinGuard()
+
+
+async def _lock_chat(bot: Bot, job_queue: JobQueue, chat_id: int) -> bool:
+    """
+    נועל קבוצה לקריאה בלבד. ההרשאות הקודמות ומועד הפתיחה נשמרים ב-DB (shared_state),
+    כך שהפתיחה מחזירה בדיוק את מה שהיה - גם אחרי הפעלה מחדש באמצע הנעילה.
+    """
+    existing = get_chat_lock(chat_id)
+    if existing:
+        permissions = existing['permissions'] # כבר נעולה (למשל לפני הפעלה מחדש) - לא לצלם את מצב הנעילה
+    else:
+        try:
+            chat = await bot.get_chat(chat_id)
+        except Exception as e:
+            logger.error(f"Failed to read permissions of chat {chat_id}, not locking: {e}")
+            return False
+        permissions = chat.permissions.to_dict() if chat.permissions else None
+    until = time.time() + ANTISPAM_LOCK_SECONDS
+    save_chat_lock(chat_id, until, permissions)
+    if not await set_group_read_only(bot, chat_id, True):
+        if not existing:
+            delete_chat_lock(chat_id)
+        return False
+    join_guard.mark_locked(chat_id)
+    _schedule_unlock(job_queue, chat_id, ANTISPAM_LOCK_SECONDS)
+    return True
+
+def _schedule_unlock(job_queue: JobQueue, chat_id: int, delay: float):
+    job_queue.run_once(_unlock_chat_callback, max(1.0, delay), data=chat_id, name=f"antispam_unlock_{chat_id}")
+
+async def _unlock_chat_callback(context: ContextTypes.DEFAULT_TYPE):
+    """פותח קבוצה שננעלה בגלל גל הצטרפות - או מאריך את הנעילה אם הגל עדיין נמשך."""
+    chat_id = context.job.data
+    lock = get_chat_lock(chat_id)
+    if join_guard.chat_rate(chat_id) > ANTISPAM_CHAT_JOIN_LIMIT:
+        logger.warning(f"Join surge still active in chat {chat_id}, extending lock")
+        save_chat_lock(chat_id, time.time() + ANTISPAM_LOCK_SECONDS, lock['permissions'] if lock else None)
+        _schedule_unlock(context.job_queue, chat_id, ANTISPAM_LOCK_SECONDS)
+        return
+
+    saved = lock['permissions'] if lock else None
+    if saved is None:
+        # אין צילום הרשאות (קבוצה בלי הרשאות ברירת מחדל) - ברירת המחדל של הפתיחה
+        unlocked = await set_group_read_only(context.bot, chat_id, False)
+    else:
+        try:
+            await context.bot.set_chat_permissions(chat_id, ChatPermissions.de_json(saved, context.bot))
+            unlocked = True
+        except Exception as e:
+            logger.error(f"Failed to restore permissions of chat {chat_id}: {e}")
+            unlocked = False
+
+    if unlocked:
+        delete_chat_lock(chat_id)
+        join_guard.mark_unlocked(chat_id)
+        logger.info(f"Chat {chat_id} unlocked after join surge")
+    else:
+        _schedule_unlock(context.job_queue, chat_id, 60) # הנעילה שמורה - מנסים שוב בעוד דקה
+
+
+async def restore_chat_locks_callback(context: ContextTypes.DEFAULT_TYPE):
+    """משימה חד-פעמית בעלייה: מחזירה לתזמון פתיחה של קבוצות שננעלו לפני הפעלה מחדש."""
+    now = time.time()
+    for chat_id, lock in get_chat_locks().items():
+        join_guard.mark_locked(chat_id)
+        _schedule_unlock(context.job_queue, chat_id, lock['until'] - now)
+        logger.info(f"Restored join-surge lock of chat {chat_id} ({max(0, lock['until'] - now):.0f}s left)")
+
+def schedule_chat_lock_restore(job_queue: JobQueue):
+    """מגדיר את שחזור הנעילות (פעם אחת, בתהליך הראשי בלבד)."""
+    job_queue.run_once(restore_chat_locks_callback, 1, name="antispam_restore_locks")
+
+
+async def on_member_joined(bot: Bot, job_queue: JobQueue, chat_id: int, user: User,
+                           via_join_request: bool = False) -> bool:
+    """
+    נקרא על כל הצטרפות. נועל את הקבוצה (קריאה בלבד) אם קצב ההצטרפות חורג, ומתזמן פתיחה.
+    מחזיר True אם כדאי לשלוח למשתמש הודעת ברוכים הבאים (False למשתמש שנראה כמו בוט).
+    במצב multi-worker עדכוני הצטרפות מנותבים לפי chat ID (cluster.routing_key), כך שכל המונים של קבוצה באותו תהליך.
+    """
+    chat_joins, global_joins = join_guard.record_join(chat_id)
+
+    if join_guard.should_lock(chat_id, chat_joins):
+        logger.warning(f"Join surge in chat {chat_id}: {chat_joins} joins / {ANTISPAM_WINDOW}s - locking")
+        await _lock_chat(bot, job_queue, chat_id)
+
+    score = score_user(user, via_join_request)
+    if join_guard.is_raid(chat_id):
+        score += 0.2 # בזמן גל, אותם סימנים שווים יותר
+    if score >= ANTISPAM_BOT_SCORE:
+        join_guard.suppressed_dms += 1
+        logger.info(f"Suppressing welcome DM to likely bot {user.id} (score {score:.2f}, global {global_joins})")
+        return False
+    return True
@@ -0,0 +1,112 @@
+# ==================================
+# קובץ: handlers/audit.py (יומן ביקורת לפעולות ניהול)
+# ==================================
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ContextTypes, JobQueue
+
+from db_operations import write_audit_entries, get_audit_entries
+from handlers.utils import is_user_admin
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+AUDIT_FLUSH_INTERVAL = int(os.getenv("AUDIT_FLUSH_INTERVAL", 5)) # שניות בין כתיבות אצווה
+AUDIT_BUFFER_MAX = 10_000 # אם ה-DB לא זמין לאורך זמן - הרשומות הוותיקות נזרקות (ונרשמת שגיאה)
+AUDIT_QUERY_LIMIT = 20
+
+ACTION_LABELS = {
+    'approve_user': "✅ אישור משתמש",
+    'ban_user': "🚫 חסימה",
+    'set_admin': "👑 מינוי למנהל",
+    'approve_post': "📦 אישור מודעה",
+    'reject_post': "❌ דחיית מודעה",
+}
+
+_buffer: List[dict] = []
+_flush_lock: Optional[asyncio.Lock] = None
+
+
+def audit(actor_id: Optional[int], action: str, target_id: int, **details):
+    """
+    רושם פעולת ניהול. לא כותב ל-DB - רק מוסיף לבאפר בזיכרון, שנכתב באצווה ע"י audit_flush_callback.
+    """
+    _buffer.append({
+        'actor_id': actor_id,
+        'action': action,
+        'target_id': target_id,
+        'details': json.dumps(details, ensure_ascii=False) if details else None,
+        'created_at': datetime.utcnow(),
+    })
+    if len(_buffer) > AUDIT_BUFFER_MAX:
+        dropped = len(_buffer) - AUDIT_BUFFER_MAX
+        del _buffer[:dropped]
+        logger.error(f"Audit buffer overflow, dropped {dropped} oldest entries")
+
+
+async def flush_audit_log() -> int:
+    """כותב את כל מה שנאגר בהכנסה אחת (ב-thread נפרד). מחזיר כמה רשומות נכתבו."""
+    global _flush_lock
+    if _flush_lock is None:
+        _flush_lock = asyncio.Lock()
+    async with _flush_lock:
+        if not _buffer:
+            return 0
+        batch = _buffer[:]
+        del _buffer[:len(batch)]
+        ok = await asyncio.get_running_loop().run_in_executor(None, write_audit_entries, batch)
+        if not ok:
+            _buffer[:0] = batch # ננסה שוב בסבב הבא, בלי לשבש את הסדר
+            return 0
+        return len(batch)
+
+
+async def audit_flush_callback(context: ContextTypes.DEFAULT_TYPE):
+    """משימה: כתיבת אצוות היומן."""
+    await flush_audit_log()
+
+
+def schedule_audit_flush(job_queue: JobQueue):
+    """מגדיר את הכתיבה המחזורית (הבאפר הוא לכל תהליך, ולכן רץ בכל worker)."""
+    logger.info(f"Scheduling audit log flush every {AUDIT_FLUSH_INTERVAL}s")
+    job_queue.run_repeating(audit_flush_callback, interval=AUDIT_FLUSH_INTERVAL,
+                            first=AUDIT_FLUSH_INTERVAL, name="audit_flush")
+
+
+# --- פקודת צפייה ---
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/audit <user_id> - היסטוריית פעולות הניהול על משתמש."""
+    if update.effective_chat.type != "private": return
+    if not is_user_admin(update.effective_user.id):
+        await update.message.reply_text("⛔️ אין הרשאה.")
+        return
+    if not context.args or not context.args[0].lstrip('-').isdigit():
+        await update.message.reply_text("שימוש: /audit <ID>")
+        return
+
+    target_id = int(context.args[0])
+    await flush_audit_log() # כדי שגם פעולות מהשניות האחרונות יופיעו
+    entries = get_audit_entries(target_id, AUDIT_QUERY_LIMIT)
+    if not entries:
+        await update.message.reply_text(f"אין רשומות ביומן עבור {target_id}.")
+        return
+
+    lines = [f"📜 יומן פעולות עבור {target_id} (אחרונות {len(entries)}):", ""]
+    for entry in entries:
+        actor = entry.actor_id if entry.actor_id is not None else "מערכת"
+        line = f"• {entry.created_at:%d/%m/%Y %H:%M} UTC — {ACTION_LABELS.get(entry.action, entry.action)} (ע\"י {actor})"
+        if entry.details:
+            details = json.loads(entry.details)
+            line += " " + ", ".join(f"{k}={v}" for k, v in details.items())
+        lines.append(line)
+    await update.message.reply_text("\n".join(lines))
+
+
+def setup_audit_handlers(application: Application):
+    application.add_handler(CommandHandler("audit", audit_command))
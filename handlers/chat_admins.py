@@ -0,0 +1,64 @@
+# ==================================
+# קובץ: handlers/chat_admins.py (עדכון קאש מנהלי הקבוצות)
+# ==================================
+import logging
+from telegram import Update
+from telegram.constants import ChatMemberStatus
+from telegram.ext import Application, ChatMemberHandler, ContextTypes, JobQueue
+
+import cache
+from handlers.utils import (
+    ALL_COMMUNITY_CHATS, CHAT_ADMINS_REFRESH_INTERVAL, get_cached_chat_admins, set_cached_chat_admins,
+    refresh_chat_admins
+)
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+# קבוצת handlers נפרדת, כדי לא להתחרות ב-handle_new_member (רק handler אחד רץ בכל קבוצה)
+CHAT_ADMINS_HANDLER_GROUP = 1
+
+
+async def handle_admin_change(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """מעדכן את הקאש כשמישהו (או הבוט עצמו) מקודם למנהל או מורד מניהול."""
+    change = update.chat_member or update.my_chat_member
+    was_admin = change.old_chat_member.status in ADMIN_STATUSES
+    is_admin = change.new_chat_member.status in ADMIN_STATUSES
+    if was_admin == is_admin:
+        return
+
+    chat_id = change.chat.id
+    admin_ids = get_cached_chat_admins(chat_id)
+    # שאר ה-workers יטענו מחדש בבדיקה הבאה
+    cache.invalidate('chat_admins', chat_id)
+
+    if update.my_chat_member is not None:
+        # הבוט עצמו קודם/הורד - רשימת המנהלים שנטענה קודם (אם בכלל) לא אמינה
+        if is_admin:
+            await refresh_chat_admins(context.bot, chat_id)
+        return
+
+    if admin_ids is not None:
+        user_id = change.new_chat_member.user.id
+        set_cached_chat_admins(chat_id, (admin_ids | {user_id}) if is_admin else (admin_ids - {user_id}))
+    logger.info(f"Chat {chat_id}: admin status of {change.new_chat_member.user.id} changed ({'+' if is_admin else '-'})")
+
+
+async def refresh_chat_admins_callback(context: ContextTypes.DEFAULT_TYPE):
+    """משימה: טעינה מחדש של מנהלי כל קבוצות הקהילה (גם החימום בעלייה)."""
+    for chat_id in ALL_COMMUNITY_CHATS:
+        await refresh_chat_admins(context.bot, chat_id)
+
+
+def setup_chat_admins_handlers(application: Application):
+    application.add_handler(
+        ChatMemberHandler(handle_admin_change, ChatMemberHandler.ANY_CHAT_MEMBER),
+        group=CHAT_ADMINS_HANDLER_GROUP
+    )
+
+
+def schedule_chat_admins_refresh(job_queue: JobQueue):
+    """מגדיר רענון איטי של הקאש (הקאש הוא לכל תהליך, ולכן רץ בכל worker)."""
+    logger.info(f"Scheduling chat admins refresh every {CHAT_ADMINS_REFRESH_INTERVAL}s")
+    job_queue.run_repeating(refresh_chat_admins_callback, interval=CHAT_ADMINS_REFRESH_INTERVAL,
+                            first=2, name="chat_admins_refresh")
@@ -1,27 +1,64 @@
 # ====================================
 # קובץ: handlers/jobs.py
 # ====================================
+import os
 import logging
-from telegram.ext import JobQueue
+from datetime import time
+import pytz
+from telegram.ext import JobQueue, ContextTypes
+
+from db_operations import expire_old_posts, archive_inactive_posts, get_published_post_ids
+from handlers.publisher import remove_published_post
 
 logger = logging.getLogger(__name__)
 
+ISRAEL_TZ = pytz.timezone('Asia/Jerusalem')
+
+# --- הגדרות מחזור חיים של מודעות ---
+POST_EXPIRY_DAYS = int(os.getenv("POST_EXPIRY_DAYS", 30))               # אחרי כמה ימים מודעה פעילה פגה
+POST_ARCHIVE_GRACE_DAYS = int(os.getenv("POST_ARCHIVE_GRACE_DAYS", 7))  # כמה זמן מודעה לא פעילה נשארת לפני ארכוב
+
 # הפונקציה שנדרשת לייבוא ב-main.py
 def schedule_weekly_posts(job_queue: JobQueue):
     """
     מגדיר את משימת השליחה השבועית של המודעות.
     (הלוגיקה המלאה של שליחת ההודעות תבוא כאן).
+    השליפה תיעשה דרך get_approved_posts, שמחזירה רק מודעות חיות (status='active').
     """
     logger.info("Scheduling weekly posts job...")
-    
+
     # Placeholder: שליחה פעם בשבוע (לדוגמה, כל יום שני ב-10:00 בבוקר)
     # יש להחליף את הלוגיקה בלוגיקת השליחה בפועל
     # job_queue.run_repeating(
-    #     callback=send_weekly_ads_callback, 
+    #     callback=send_weekly_ads_callback,
     #     interval=24 * 60 * 60 * 7, # שבוע
     #     first=target_datetime,
     #     name="weekly_ads"
     # )
-    
+
     # כרגע נשאיר את זה כפונקציה ריקה כדי שהקוד יעבור את שלב הייבוא
     pass
+
+
+async def post_lifecycle_callback(context: ContextTypes.DEFAULT_TYPE):
+    """
+    מריץ תפוגה של מודעות ישנות ואז מעביר מודעות לא פעילות לטבלת ההיסטוריה.
+    ההודעות שפורסמו בקבוצות עבור מודעות שפגו או הועברו לארכיון נמחקות (יחד עם השורות ב-sell_post_messages).
+    """
+    expired = expire_old_posts(POST_EXPIRY_DAYS)
+    archived = archive_inactive_posts(POST_ARCHIVE_GRACE_DAYS)
+    published = get_published_post_ids(list(set(expired) | set(archived)))
+    for post_id in sorted(published):
+        await remove_published_post(context.bot, post_id)
+    logger.info(f"Post lifecycle: {len(expired)} expired, {len(archived)} archived, "
+                f"{len(published)} removed from groups")
+
+
+def schedule_post_lifecycle(job_queue: JobQueue):
+    """מגדיר את משימת מחזור החיים היומית (בשעות השקטות של הלילה)."""
+    logger.info("Scheduling post lifecycle job...")
+    job_queue.run_daily(
+        post_lifecycle_callback,
+        time=time(hour=3, minute=30, tzinfo=ISRAEL_TZ),
+        name="post_lifecycle"
+    )
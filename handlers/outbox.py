@@ -0,0 +1,147 @@
+# ==================================
+# קובץ: handlers/outbox.py (ביצוע תופעות לוואי מה-outbox)
+# ==================================
+import os
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from telegram import Bot
+from telegram.error import RetryAfter, BadRequest, Forbidden
+from telegram.ext import JobQueue, ContextTypes
+
+from db_operations import claim_outbox_batch, complete_outbox_events, fail_outbox_event
+from handlers.utils import grant_user_permissions, restrict_user_permissions
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+OUTBOX_POLL_INTERVAL = int(os.getenv("OUTBOX_POLL_INTERVAL", 5))  # שניות בין סבבי ריקון
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 20))
+OUTBOX_CONCURRENCY = 5   # קריאות Bot API במקביל בתוך אצווה (בין קבוצות שונות)
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_MAX_BACKOFF = 3600 # שניות
+
+
+# --- ביצוע לפי סוג אירוע ---
+
+async def _grant_permissions(bot: Bot, payload: dict):
+    await grant_user_permissions(payload['chat_id'], payload['user_id'], bot=bot)
+
+async def _restrict_permissions(bot: Bot, payload: dict):
+    await restrict_user_permissions(payload['chat_id'], payload['user_id'], bot=bot)
+
+async def _ban_chat_member(bot: Bot, payload: dict):
+    await bot.ban_chat_member(payload['chat_id'], payload['user_id'])
+
+async def _unban_chat_member(bot: Bot, payload: dict):
+    await bot.unban_chat_member(payload['chat_id'], payload['user_id'], only_if_banned=True)
+
+async def _send_message(bot: Bot, payload: dict):
+    await bot.send_message(payload['chat_id'], payload['text'])
+
+EXECUTORS = {
+    'grant_permissions': _grant_permissions,
+    'restrict_permissions': _restrict_permissions,
+    'ban_chat_member': _ban_chat_member,
+    'unban_chat_member': _unban_chat_member,
+    'send_message': _send_message,
+}
+
+
+async def _execute(bot: Bot, semaphore: asyncio.Semaphore, event):
+    """
+    מבצע אירוע אחד. מחזיר (ID אם הצליח אחרת None, מועד הניסיון הבא אם ייעשה ניסיון חוזר).
+    הכישלון עצמו נרשם כאן.
+    """
+    event_id, kind, payload, attempts = event
+    executor = EXECUTORS.get(kind)
+    if executor is None:
+        fail_outbox_event(event_id, f"unknown kind {kind}")
+        return None, None
+
+    async with semaphore:
+        try:
+            await executor(bot, payload)
+            return event_id, None
+        except RetryAfter as e:
+            # טלגרם ביקש להמתין - לא נחשב לכישלון "אמיתי" מבחינת מגבלת הניסיונות
+            retry_after = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+            retry_at = datetime.utcnow() + timedelta(seconds=retry_after)
+            fail_outbox_event(event_id, e, retry_at, count_attempt=False)
+            return None, retry_at
+        except (BadRequest, Forbidden) as e:
+            # שגיאה קבועה (משתמש לא בקבוצה, חסם את הבוט וכו') - אין טעם לנסות שוב
+            logger.warning(f"Outbox event {event_id} ({kind}) failed permanently: {e}")
+            fail_outbox_event(event_id, e)
+        except Exception as e:
+            if attempts + 1 >= OUTBOX_MAX_ATTEMPTS:
+                logger.error(f"Outbox event {event_id} ({kind}) gave up after {attempts + 1} attempts: {e}")
+                fail_outbox_event(event_id, e)
+            else:
+                retry_at = datetime.utcnow() + timedelta(seconds=min(2 ** attempts * 5, OUTBOX_MAX_BACKOFF))
+                fail_outbox_event(event_id, e, retry_at)
+                return None, retry_at
+        return None, None
+
+
+def _group_key(event):
+    """אירועים על אותו (קבוצה, משתמש) חייבים לרוץ לפי הסדר (למשל הרשאה ואז הגבלה)."""
+    payload = event[2]
+    return payload.get('chat_id'), payload.get('user_id')
+
+async def _execute_group(bot: Bot, semaphore: asyncio.Semaphore, events) -> list:
+    """
+    מבצע את האירועים של קבוצה אחת בזה אחר זה, לפי ה-ID. מחזיר את ה-IDs שבוצעו.
+    אירוע שנדחה לניסיון חוזר מעכב את כל מה שאחריו באותה קבוצה, כדי שלא יעקפו אותו.
+    """
+    done = []
+    for index, event in enumerate(events):
+        event_id, retry_at = await _execute(bot, semaphore, event)
+        if event_id is not None:
+            done.append(event_id)
+        elif retry_at is not None:
+            for later in events[index + 1:]:
+                fail_outbox_event(later[0], f"waiting for event {event[0]}", retry_at, count_attempt=False)
+            break
+    return done
+
+
+async def drain_outbox(bot: Bot) -> int:
+    """
+    מרוקן את ה-outbox באצוות עד שאין אירועים שהגיע זמנם. מחזיר כמה בוצעו.
+    בתוך אצווה: קבוצות שונות רצות במקביל, ואירועים של אותה קבוצה - בסדר שבו נוצרו.
+    """
+    semaphore = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+    done_total = 0
+    while True:
+        batch = claim_outbox_batch(OUTBOX_BATCH_SIZE)
+        if not batch:
+            return done_total
+        groups = defaultdict(list)
+        for event in batch: # האצווה כבר ממוינת לפי ID
+            groups[_group_key(event)].append(event)
+        results = await asyncio.gather(*(_execute_group(bot, semaphore, events) for events in groups.values()))
+        done = [event_id for group_done in results for event_id in group_done]
+        complete_outbox_events(done)
+        done_total += len(done)
+        if len(batch) < OUTBOX_BATCH_SIZE:
+            return done_total
+
+
+async def outbox_callback(context: ContextTypes.DEFAULT_TYPE):
+    """משימה: ריקון ה-outbox."""
+    done = await drain_outbox(context.bot)
+    if done:
+        logger.info(f"Outbox: {done} events delivered")
+
+
+def trigger_outbox(job_queue: JobQueue):
+    """מריץ ריקון מיידי (אחרי commit של handler), בלי לחכות לסבב המחזורי."""
+    job_queue.run_once(outbox_callback, when=0)
+
+
+def schedule_outbox(job_queue: JobQueue):
+    """מגדיר את ריקון ה-outbox המחזורי."""
+    logger.info(f"Scheduling outbox drain every {OUTBOX_POLL_INTERVAL}s")
+    job_queue.run_repeating(outbox_callback, interval=OUTBOX_POLL_INTERVAL, first=OUTBOX_POLL_INTERVAL, name="outbox")
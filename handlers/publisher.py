@@ -0,0 +1,141 @@
+# ==================================
+# קובץ: handlers/publisher.py (פרסום מודעות מאושרות לקבוצות)
+# ==================================
+"""
+מנוע הפרסום: כל פעולה על מודעה מפורסמת (פרסום, עריכה, סימון כנמכרה, מחיקה) עוברת דרך
+_fan_out - צינור אחד שמריץ את הקריאות לכל הקבוצות במקביל (עם הגבלה) ומחזיר תוצאה לכל קבוצה.
+התמונה נשלחת לפי ה-file_id השמור (בלי העלאה מחדש), ומזהי ההודעות נשמרים ב-sell_post_messages
+כדי שעריכות ומחיקות יתבצעו על אותן הודעות.
+"""
+import os
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from db_operations import get_post_messages, delete_post_messages, record_published_messages
+from handlers.utils import SELL_GROUP_ID, ALL_COMMUNITY_CHATS
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+PUBLISH_CONCURRENCY = int(os.getenv("PUBLISH_CONCURRENCY", 5)) # קריאות Bot API במקביל
+CAPTION_LIMIT = 1024 # מגבלת טלגרם לכיתוב תמונה
+
+
+def publish_targets() -> List[int]:
+    """קבוצת המכירות ואחריה קבוצות הקהילה, בלי כפילויות."""
+    targets = []
+    if SELL_GROUP_ID:
+        try:
+            targets.append(int(SELL_GROUP_ID))
+        except ValueError:
+            logger.error("SELL_GROUP_ID must be an integer chat ID.")
+    return list(dict.fromkeys(targets + ALL_COMMUNITY_CHATS))
+
+
+def format_published_post(post) -> str:
+    """הטקסט של מודעה כפי שהוא מופיע בקבוצות."""
+    text = post.description
+    if post.price:
+        text += f"\n💰 מחיר: {post.price}"
+    if post.contact_info:
+        text += f"\n📞 יצירת קשר: {post.contact_info}"
+    if post.status == 'sold':
+        text = "✅ נמכר!\n\n" + text
+    return text
+
+def _caption(text: str) -> str:
+    return text if len(text) <= CAPTION_LIMIT else text[:CAPTION_LIMIT - 1] + "…"
+
+
+@dataclass
+class FanOutReport:
+    """תוצאת פעולה על כל הקבוצות: מה הצליח ומה נכשל (chat_id -> שגיאה)."""
+    results: Dict[int, object] = field(default_factory=dict)
+    failures: Dict[int, str] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> int:
+        return len(self.results)
+
+    @property
+    def total(self) -> int:
+        return len(self.results) + len(self.failures)
+
+
+async def _fan_out(chat_ids: List[int], action: Callable[[int], Awaitable[object]]) -> FanOutReport:
+    """מריץ action לכל קבוצה במקביל (עד PUBLISH_CONCURRENCY), עם ניסיון חוזר אחד אחרי RetryAfter."""
+    semaphore = asyncio.Semaphore(PUBLISH_CONCURRENCY)
+    report = FanOutReport()
+
+    async def run(chat_id: int):
+        async with semaphore:
+            for attempt in range(2):
+                try:
+                    report.results[chat_id] = await action(chat_id)
+                    return
+                except RetryAfter as e:
+                    if attempt:
+                        report.failures[chat_id] = str(e)
+                        return
+                    retry_after = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+                    await asyncio.sleep(retry_after)
+                except Exception as e:
+                    report.failures[chat_id] = str(e)
+                    return
+
+    await asyncio.gather(*(run(chat_id) for chat_id in chat_ids))
+    for chat_id, error in report.failures.items():
+        logger.warning(f"Publisher: chat {chat_id} failed: {error}")
+    return report
+
+
+async def publish_post(bot: Bot, post) -> FanOutReport:
+    """
+    מפרסם מודעה מאושרת לכל הקבוצות ושומר את מזהי ההודעות.
+    קבוצה שכבר יש בה הודעה של המודעה מדולגת, כך שאישור חוזר לא מפרסם פעמיים.
+    """
+    published = {msg.chat_id for msg in get_post_messages(post.id)}
+    targets = [chat_id for chat_id in publish_targets() if chat_id not in published]
+    text = format_published_post(post)
+
+    async def send(chat_id: int):
+        if post.image_id:
+            return await bot.send_photo(chat_id=chat_id, photo=post.image_id, caption=_caption(text))
+        return await bot.send_message(chat_id=chat_id, text=text)
+
+    report = await _fan_out(targets, send)
+    messages = [(chat_id, message.message_id, bool(post.image_id)) for chat_id, message in report.results.items()]
+    if messages:
+        record_published_messages(post.id, messages)
+    logger.info(f"Post {post.id} published to {report.ok}/{report.total} chats")
+    return report
+
+
+async def refresh_published_post(bot: Bot, post) -> FanOutReport:
+    """עורך במקום את ההודעות שכבר פורסמו עבור המודעה (ללא פרסום מחדש)."""
+    text = format_published_post(post)
+    messages = {msg.chat_id: msg for msg in get_post_messages(post.id)}
+
+    async def edit(chat_id: int):
+        msg = messages[chat_id]
+        if msg.has_photo:
+            return await bot.edit_message_caption(chat_id=chat_id, message_id=msg.message_id, caption=_caption(text))
+        return await bot.edit_message_text(chat_id=chat_id, message_id=msg.message_id, text=text)
+
+    return await _fan_out(list(messages), edit)
+
+
+async def remove_published_post(bot: Bot, post_id: int) -> FanOutReport:
+    """מוחק את ההודעות שפורסמו עבור המודעה."""
+    messages = {msg.chat_id: msg.message_id for msg in get_post_messages(post_id)}
+
+    async def delete(chat_id: int):
+        return await bot.delete_message(chat_id=chat_id, message_id=messages[chat_id])
+
+    report = await _fan_out(list(messages), delete)
+    delete_post_messages(post_id)
+    return report
@@ -0,0 +1,135 @@
+# ==================================
+# קובץ: handlers/rate_limit.py (הגבלת קצב לכל משתמש: /sell, /verify)
+# ==================================
+"""
+שתי שכבות, מהזולה ליקרה:
+- token bucket בזיכרון לכל (פעולה, משתמש) - עוצר לולאות של /sell או /verify לפני כל קריאה ל-DB או ל-Bot API.
+- מכסה יומית של מודעות - נספרת ב-DB (המקור הקובע, משותף לכל ה-workers), לפי היום בשעון ישראל.
+  משתמש שמיצה את המכסה נשמר בזיכרון עד חצות, כך שניסיונות חוזרים לא מגיעים שוב ל-DB.
+אדמינים פטורים. הסירוב כולל את השעה שבה אפשר לנסות שוב.
+"""
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+import pytz
+from telegram.ext import ContextTypes, JobQueue
+
+from db_operations import count_user_posts_since
+from handlers.jobs import ISRAEL_TZ
+from handlers.utils import is_user_admin
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+SELL_RATE_BURST = int(os.getenv("SELL_RATE_BURST", 3))            # כניסות רצופות ל-/sell
+SELL_RATE_INTERVAL = int(os.getenv("SELL_RATE_INTERVAL", 600))    # שניות לכל כניסה נוספת
+VERIFY_RATE_BURST = int(os.getenv("VERIFY_RATE_BURST", 3))
+VERIFY_RATE_INTERVAL = int(os.getenv("VERIFY_RATE_INTERVAL", 1800))
+SELL_POSTS_PER_DAY = int(os.getenv("SELL_POSTS_PER_DAY", 5))      # מודעות ליום (כולל כאלה שנדחו)
+RATE_LIMIT_SWEEP_INTERVAL = 600
+
+
+class TokenBucket:
+    """
+    דלי אסימונים לכל משתמש: עד burst פעולות רצופות, ואסימון חדש כל interval שניות.
+    נשמרים רק (אסימונים, זמן עדכון); דלי שהתמלא מחדש שקול לדלי שלא קיים ומפונה ב-prune.
+    """
+
+    def __init__(self, name: str, burst: int, interval: float):
+        self.name = name
+        self.burst = burst
+        self.interval = interval
+        self._buckets: Dict[int, Tuple[float, float]] = {}
+
+    def _level(self, user_id: int, now: float) -> float:
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) / self.interval)
+
+    def take(self, user_id: int, now: Optional[float] = None) -> float:
+        """מנסה לצרוך אסימון. מחזיר 0 אם מותר, אחרת כמה שניות לחכות."""
+        now = now if now is not None else time.monotonic()
+        tokens = self._level(user_id, now)
+        if tokens < 1:
+            return (1 - tokens) * self.interval
+        self._buckets[user_id] = (tokens - 1, now)
+        return 0
+
+    def prune(self, now: Optional[float] = None) -> int:
+        now = now if now is not None else time.monotonic()
+        full = [user_id for user_id in self._buckets if self._level(user_id, now) >= self.burst]
+        for user_id in full:
+            del self._buckets[user_id]
+        return len(full)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+buckets = {
+    'sell': TokenBucket('sell', SELL_RATE_BURST, SELL_RATE_INTERVAL),
+    'verify': TokenBucket('verify', VERIFY_RATE_BURST, VERIFY_RATE_INTERVAL),
+}
+_posts_exhausted: Dict[int, float] = {} # user_id -> time.time() של חצות הבאה (שעון ישראל)
+stats = {'refused': 0, 'quota_refused': 0}
+
+
+def _israel_day_bounds(now: datetime) -> Tuple[datetime, datetime]:
+    """(תחילת היום, תחילת מחר) בשעון ישראל, כ-datetime עם אזור זמן."""
+    local = now.astimezone(ISRAEL_TZ)
+    start = ISRAEL_TZ.localize(datetime(local.year, local.month, local.day))
+    tomorrow = local.date() + timedelta(days=1)
+    return start, ISRAEL_TZ.localize(datetime(tomorrow.year, tomorrow.month, tomorrow.day))
+
+def format_retry_at(moment: datetime) -> str:
+    """השעה (שעון ישראל) שבה אפשר לנסות שוב; עם תאריך אם זה לא היום."""
+    local = moment.astimezone(ISRAEL_TZ)
+    if local.date() == datetime.now(ISRAEL_TZ).date():
+        return local.strftime("%H:%M")
+    return local.strftime("%d/%m %H:%M")
+
+
+def check_rate(user_id: int, action: str) -> Optional[str]:
+    """בדיקת הקצב בזיכרון (בלי DB). מחזיר הודעת סירוב, או None אם מותר."""
+    if is_user_admin(user_id):
+        return None
+    wait = buckets[action].take(user_id)
+    if not wait:
+        return None
+    stats['refused'] += 1
+    retry_at = datetime.now(ISRAEL_TZ) + timedelta(seconds=wait)
+    return f"⏳ יותר מדי ניסיונות ברצף. נסה שוב ב-{format_retry_at(retry_at)}."
+
+def check_daily_posts(user_id: int) -> Optional[str]:
+    """המכסה היומית של מודעות (ספירה ב-DB). מחזיר הודעת סירוב, או None אם נשאר מקום."""
+    if is_user_admin(user_id):
+        return None
+    reset_at = _posts_exhausted.get(user_id)
+    if reset_at is None or reset_at <= time.time():
+        start, tomorrow = _israel_day_bounds(datetime.now(ISRAEL_TZ))
+        # created_at נשמר כ-UTC בלי אזור זמן
+        since = start.astimezone(pytz.utc).replace(tzinfo=None)
+        if count_user_posts_since(user_id, since) < SELL_POSTS_PER_DAY:
+            _posts_exhausted.pop(user_id, None)
+            return None
+        reset_at = tomorrow.timestamp()
+        _posts_exhausted[user_id] = reset_at
+    stats['quota_refused'] += 1
+    retry_at = datetime.fromtimestamp(reset_at, ISRAEL_TZ)
+    return f"⏳ הגעת למכסה של {SELL_POSTS_PER_DAY} מודעות ביום. נסה שוב ב-{format_retry_at(retry_at)}."
+
+
+async def rate_limit_sweep_callback(context: ContextTypes.DEFAULT_TYPE):
+    """משימה: פינוי דליים שהתמלאו ומכסות שהתאפסו."""
+    pruned = sum(bucket.prune() for bucket in buckets.values())
+    now = time.time()
+    for user_id in [uid for uid, reset_at in _posts_exhausted.items() if reset_at <= now]:
+        del _posts_exhausted[user_id]
+    if pruned:
+        logger.debug(f"Rate limit: pruned {pruned} idle buckets")
+
+def schedule_rate_limit_sweep(job_queue: JobQueue):
+    """מגדיר את הפינוי המחזורי (הדליים הם לכל תהליך, ולכן רץ בכל worker)."""
+    job_queue.run_repeating(rate_limit_sweep_callback, interval=RATE_LIMIT_SWEEP_INTERVAL,
+                            first=RATE_LIMIT_SWEEP_INTERVAL, name="rate_limit_sweep")
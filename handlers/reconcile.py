@@ -0,0 +1,109 @@
+# ==================================
+# קובץ: handlers/reconcile.py (סנכרון הרשאות בין ה-DB לקבוצות)
+# ==================================
+import os
+import asyncio
+import logging
+from datetime import datetime
+from telegram import Bot
+from telegram.constants import ChatMemberStatus
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.ext import JobQueue, ContextTypes
+
+from db_operations import get_users_changed_since, enqueue_side_effects, get_watermark, set_watermark
+from handlers.utils import ALL_COMMUNITY_CHATS
+from handlers.outbox import trigger_outbox
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", 15 * 60)) # שניות
+RECONCILE_BATCH_USERS = int(os.getenv("RECONCILE_BATCH_USERS", 200)) # משתמשים לכל הרצה
+RECONCILE_CALL_DELAY = 0.05 # ~20 קריאות get_chat_member בשנייה
+WATERMARK_NAME = "permissions_reconcile"
+
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+GONE_STATUSES = (ChatMemberStatus.LEFT,)
+
+
+def _expected_fix(user, member):
+    """מחזיר את סוג אירוע ה-outbox שמתקן את הפער, או None אם המצב תקין."""
+    status = member.status
+    if status in ADMIN_STATUSES:
+        return None # לא נוגעים במנהלי קבוצה
+
+    if user.is_banned:
+        return None if status == ChatMemberStatus.BANNED else 'ban_chat_member'
+    if status in GONE_STATUSES or status == ChatMemberStatus.BANNED:
+        return None # לא בקבוצה - אין מה לתקן
+
+    can_send = status == ChatMemberStatus.MEMBER or (
+        status == ChatMemberStatus.RESTRICTED and member.can_send_messages
+    )
+    if user.is_approved and not can_send:
+        return 'grant_permissions'
+    if not user.is_approved and can_send:
+        return 'restrict_permissions'
+    return None
+
+
+async def reconcile_permissions(bot: Bot) -> dict:
+    """
+    סבב אחד: עובר על משתמשים שהשתנו מאז הסמן האחרון, משווה מול הסטטוס בכל קבוצה
+    ומכניס תיקונים ל-outbox (שמבצע אותם באצוות עם הגבלת קצב).
+    """
+    watermark = get_watermark(WATERMARK_NAME) or {}
+    since = datetime.fromisoformat(watermark['updated_at']) if watermark.get('updated_at') else None
+    users = get_users_changed_since(since, watermark.get('id', 0), RECONCILE_BATCH_USERS)
+
+    stats = {'users': 0, 'checked': 0, 'fixes': 0}
+    fixes, processed = [], []
+    rate_limited = False
+    for user in users:
+        user_fixes = []
+        for chat_id in ALL_COMMUNITY_CHATS:
+            try:
+                member = await bot.get_chat_member(chat_id, user.telegram_id)
+            except RetryAfter as e:
+                logger.warning(f"Reconcile rate-limited, stopping early: {e}")
+                rate_limited = True
+                break
+            except (BadRequest, Forbidden):
+                continue # המשתמש לא נמצא בקבוצה / אין לבוט גישה
+            finally:
+                await asyncio.sleep(RECONCILE_CALL_DELAY)
+            stats['checked'] += 1
+
+            kind = _expected_fix(user, member)
+            if kind:
+                user_fixes.append((kind, {'chat_id': chat_id, 'user_id': user.telegram_id},
+                                   f"reconcile:{kind}:{chat_id}:{user.telegram_id}"))
+        if rate_limited:
+            break # הסמן מתקדם רק עד המשתמש האחרון שנבדק במלואו
+        fixes.extend(user_fixes)
+        processed.append(user)
+
+    if fixes and not enqueue_side_effects(fixes):
+        return stats # לא מקדמים את הסמן - ננסה שוב בהרצה הבאה
+    stats['users'], stats['fixes'] = len(processed), len(fixes)
+
+    if processed:
+        last = processed[-1]
+        set_watermark(WATERMARK_NAME, {'updated_at': last.updated_at.isoformat(), 'id': last.id})
+    return stats
+
+
+async def reconcile_callback(context: ContextTypes.DEFAULT_TYPE):
+    """משימה: סנכרון הרשאות מצטבר."""
+    if not ALL_COMMUNITY_CHATS:
+        return
+    stats = await reconcile_permissions(context.bot)
+    if stats['fixes']:
+        trigger_outbox(context.job_queue)
+    logger.info(f"Permission reconcile: {stats}")
+
+
+def schedule_permission_reconcile(job_queue: JobQueue):
+    """מגדיר את סבבי הסנכרון המחזוריים."""
+    logger.info(f"Scheduling permission reconcile every {RECONCILE_INTERVAL}s")
+    job_queue.run_repeating(reconcile_callback, interval=RECONCILE_INTERVAL, first=60, name="permission_reconcile")
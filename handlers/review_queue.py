@@ -0,0 +1,242 @@
+# ==================================
+# קובץ: handlers/review_queue.py (תור בקשות לערוץ הניהול)
+# ==================================
+import os
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.ext import JobQueue, ContextTypes
+
+from handlers.utils import ADMIN_CHAT_ID
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+# immediate: כל בקשה נשלחת מיד כהודעה נפרדת (מתאים לתנועה נמוכה)
+# digest: הבקשות נאגרות ונשלחות כל N שניות או כל K פריטים כהודעה מרוכזת אחת
+ADMIN_REVIEW_MODE = os.getenv("ADMIN_REVIEW_MODE", "immediate").lower()
+ADMIN_DIGEST_INTERVAL = int(os.getenv("ADMIN_DIGEST_INTERVAL", 60))
+ADMIN_DIGEST_MAX_ITEMS = int(os.getenv("ADMIN_DIGEST_MAX_ITEMS", 10))
+
+MEDIA_GROUP_LIMIT = 10      # מגבלת טלגרם לאלבום
+DIGEST_ITEM_TEXT_LIMIT = 300 # חיתוך טקסט של פריט בהודעה המרוכזת (מגבלת 4096 תווים להודעה)
+# פריט שלא הוחלט בתהליך הזה (למשל טופל ב-worker אחר או ב-/approve) נשכח אחרי הזמן הזה
+REVIEW_ITEM_TTL = int(os.getenv("REVIEW_ITEM_TTL", 7 * 24 * 3600))
+REVIEW_PRUNE_INTERVAL = 3600
+
+
+@dataclass
+class ReviewItem:
+    """פריט אחד לבדיקת מנהל (בקשת אימות / מודעת מכירה)."""
+    key: str # מזהה ייחודי, למשל user:123 או post:45
+    text: str
+    buttons: List[InlineKeyboardButton]
+    photo_id: Optional[str] = None
+
+
+def decision_callback(action: str, target: int, owner_id: int) -> str:
+    """
+    callback_data לכפתור החלטה: <action>_<target>@<owner_id>.
+    במצב multi-worker הלחיצה מנותבת לפי owner_id (cluster.routing_key) - ל-worker שהגיש את הפריט ומחזיק אותו בתור.
+    """
+    return f"{action}_{target}@{owner_id}"
+
+
+@dataclass
+class _Digest:
+    """הודעה מרוכזת שנשלחה לערוץ הניהול."""
+    message_id: int
+    items: List[ReviewItem]
+    resolved: Dict[str, str] = field(default_factory=dict) # key -> תיאור ההחלטה
+    sent_at: float = field(default_factory=time.monotonic)
+
+
+class ReviewQueue:
+    """
+    מרכז את כל השליחות לערוץ הניהול.
+    במצב digest הפריטים נאגרים ונשלחים יחד (אלבום תמונות + הודעת סיכום עם מקלדת משותפת),
+    וכשפריט מטופל - הודעת הסיכום נערכת במקום.
+    """
+
+    def __init__(self, mode: str = ADMIN_REVIEW_MODE, max_items: int = ADMIN_DIGEST_MAX_ITEMS):
+        self.mode = mode
+        self.max_items = max_items
+        self._buffer: "OrderedDict[str, ReviewItem]" = OrderedDict()
+        self._singles: Dict[str, Tuple[int, ReviewItem, float]] = {} # key -> (message_id, item, sent_at)
+        self._digests: Dict[int, _Digest] = {}                 # message_id -> digest
+        self._digest_by_key: Dict[str, int] = {}               # key -> message_id
+
+    def pending_count(self) -> int:
+        """כמה פריטים ממתינים לשליחה (במצב digest)."""
+        return len(self._buffer)
+
+    async def submit(self, bot: Bot, item: ReviewItem):
+        """
+        מוסיף פריט לבדיקה. שליחה חוזרת עם אותו key מחליפה את הפריט הקודם:
+        בתור - במקום; אם כבר נשלח והמתין להחלטה - ההודעה הקיימת נערכת (או מסומנת כמוחלפת ב-digest).
+        """
+        if self.mode != "digest":
+            if item.key in self._singles and await self._replace_single(bot, item):
+                return
+            await self._send_single(bot, item)
+            return
+
+        if item.key in self._digest_by_key:
+            await self.resolve(bot, item.key, "🔁 הוחלף בבקשה מעודכנת")
+        self._buffer.pop(item.key, None)
+        self._buffer[item.key] = item
+        if len(self._buffer) >= self.max_items:
+            await self.flush(bot)
+
+    async def flush(self, bot: Bot):
+        """שולח את כל הפריטים שנאגרו כהודעות מרוכזות."""
+        while self._buffer:
+            batch = []
+            while self._buffer and len(batch) < self.max_items:
+                batch.append(self._buffer.popitem(last=False)[1])
+            try:
+                await self._send_digest(bot, batch)
+            except Exception as e:
+                logger.error(f"Failed to send review digest ({len(batch)} items): {e}")
+                # מחזירים לתור כדי לנסות שוב בהרצה הבאה
+                for item in reversed(batch):
+                    self._buffer[item.key] = item
+                    self._buffer.move_to_end(item.key, last=False)
+                return
+
+    async def resolve(self, bot: Bot, key: str, label: str) -> bool:
+        """מסמן פריט כמטופל ועורך את ההודעה המתאימה במקום. מחזיר False אם הפריט לא מוכר."""
+        if key in self._singles:
+            message_id, item, _ = self._singles.pop(key)
+            text = f"{item.text}\n\n{label}"
+            if item.photo_id:
+                await bot.edit_message_caption(chat_id=int(ADMIN_CHAT_ID), message_id=message_id, caption=text)
+            else:
+                await bot.edit_message_text(chat_id=int(ADMIN_CHAT_ID), message_id=message_id, text=text)
+            return True
+
+        if key in self._digest_by_key:
+            digest = self._digests[self._digest_by_key.pop(key)]
+            digest.resolved[key] = label
+            text, markup = self._render_digest(digest)
+            await bot.edit_message_text(chat_id=int(ADMIN_CHAT_ID), message_id=digest.message_id,
+                                        text=text, reply_markup=markup)
+            if len(digest.resolved) == len(digest.items):
+                self._digests.pop(digest.message_id, None)
+            return True
+
+        # פריט שעוד לא נשלח - פשוט מוציאים מהתור
+        return self._buffer.pop(key, None) is not None
+    def prune(self, max_age: float = REVIEW_ITEM_TTL) -> int:
+        """שוכח הודעות ששמורות יותר מ-max_age שניות בלי החלטה בתהליך הזה. מחזיר כמה פריטים נשכחו."""
+        cutoff = time.monotonic() - max_age
+        stale = [key for key, (_, _, sent_at) in self._singles.items() if sent_at < cutoff]
+        for key in stale:
+            del self._singles[key]
+        pruned = len(stale)
+        for message_id in [m for m, digest in self._digests.items() if digest.sent_at < cutoff]:
+            digest = self._digests.pop(message_id)
+            for item in digest.items:
+                if self._digest_by_key.get(item.key) == message_id:
+                    del self._digest_by_key[item.key]
+                    pruned += 1
+        return pruned
+
+    # --- שליחה בפועל ---
+
+    async def _send_single(self, bot: Bot, item: ReviewItem):
+        markup = InlineKeyboardMarkup([item.buttons])
+        if item.photo_id:
+            message = await bot.send_photo(chat_id=int(ADMIN_CHAT_ID), photo=item.photo_id,
+                                           caption=item.text, reply_markup=markup)
+        else:
+            message = await bot.send_message(chat_id=int(ADMIN_CHAT_ID), text=item.text, reply_markup=markup)
+        self._singles[item.key] = (message.message_id, item, time.monotonic())
+
+    async def _replace_single(self, bot: Bot, item: ReviewItem) -> bool:
+        """עורך את ההודעה שכבר נשלחה לפריט עם אותו key. False אם אי אפשר (ואז שולחים חדשה)."""
+        message_id, previous, sent_at = self._singles[item.key]
+        markup = InlineKeyboardMarkup([item.buttons])
+        try:
+            if previous.photo_id and item.photo_id:
+                await bot.edit_message_media(chat_id=int(ADMIN_CHAT_ID), message_id=message_id,
+                                             media=InputMediaPhoto(item.photo_id, caption=item.text),
+                                             reply_markup=markup)
+            elif not previous.photo_id and not item.photo_id:
+                await bot.edit_message_text(chat_id=int(ADMIN_CHAT_ID), message_id=message_id,
+                                            text=item.text, reply_markup=markup)
+            else:
+                return False
+        except Exception as e:
+            logger.warning(f"Could not edit review message for {item.key}, sending a new one: {e}")
+            self._singles.pop(item.key, None)
+            return False
+        self._singles[item.key] = (message_id, item, sent_at)
+        return True
+
+    async def _send_digest(self, bot: Bot, batch: List[ReviewItem]):
+        photos = [(n, item) for n, item in enumerate(batch, 1) if item.photo_id]
+        for start in range(0, len(photos), MEDIA_GROUP_LIMIT):
+            chunk = photos[start:start + MEDIA_GROUP_LIMIT]
+            if len(chunk) == 1:
+                n, item = chunk[0]
+                await bot.send_photo(chat_id=int(ADMIN_CHAT_ID), photo=item.photo_id, caption=f"#{n}")
+            else:
+                await bot.send_media_group(
+                    chat_id=int(ADMIN_CHAT_ID),
+                    media=[InputMediaPhoto(item.photo_id, caption=f"#{n}") for n, item in chunk]
+                )
+
+        digest = _Digest(message_id=0, items=batch)
+        text, markup = self._render_digest(digest)
+        message = await bot.send_message(chat_id=int(ADMIN_CHAT_ID), text=text, reply_markup=markup)
+        digest.message_id = message.message_id
+        self._digests[digest.message_id] = digest
+        for item in batch:
+            self._digest_by_key[item.key] = digest.message_id
+
+    @staticmethod
+    def _render_digest(digest: _Digest) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        lines = [f"📥 {len(digest.items)} פריטים לבדיקה:"]
+        keyboard = []
+        for n, item in enumerate(digest.items, 1):
+            body = item.text if len(item.text) <= DIGEST_ITEM_TEXT_LIMIT else item.text[:DIGEST_ITEM_TEXT_LIMIT] + "…"
+            if item.key in digest.resolved:
+                lines.append(f"#{n} — {digest.resolved[item.key]}")
+                continue
+            lines.append(f"#{n}\n{body}")
+            keyboard.append([
+                InlineKeyboardButton(f"#{n} {button.text}", callback_data=button.callback_data)
+                for button in item.buttons
+            ])
+        markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        return "\n\n".join(lines), markup
+
+
+# מופע יחיד לכל התהליך
+review_queue = ReviewQueue()
+
+
+async def review_digest_callback(context: ContextTypes.DEFAULT_TYPE):
+    """שולח את הפריטים שנאגרו (משימה מחזורית)."""
+    await review_queue.flush(context.bot)
+
+
+async def review_prune_callback(context: ContextTypes.DEFAULT_TYPE):
+    """משימה: ניקוי פריטים ישנים שלא הוחלטו בתהליך הזה."""
+    pruned = review_queue.prune()
+    if pruned:
+        logger.info(f"Review queue: forgot {pruned} stale items")
+
+
+def schedule_review_digest(job_queue: JobQueue):
+    """מגדיר את ניקוי התור, ואת משימת השליחה המרוכזת (רק במצב digest)."""
+    job_queue.run_repeating(review_prune_callback, interval=REVIEW_PRUNE_INTERVAL,
+                            first=REVIEW_PRUNE_INTERVAL, name="admin_review_prune")
+    if review_queue.mode != "digest":
+        return
+    logger.info(f"Admin review digest every {ADMIN_DIGEST_INTERVAL}s / {ADMIN_DIGEST_MAX_ITEMS} items")
+    job_queue.run_repeating(review_digest_callback, interval=ADMIN_DIGEST_INTERVAL, name="admin_review_digest")
@@ -2,6 +2,7 @@
 # קובץ: handlers/selling.py (מלא ומתוקן - כפתור עובד)
 # ==================================
 import logging
+from typing import Dict, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -13,23 +14,42 @@ from telegram.ext import (
     CommandHandler
 )
 
-from db_operations import add_sell_post, get_user_posts, get_sell_post, update_sell_post, delete_sell_post
+from db_operations import (
+    add_sell_post, get_user_posts, get_sell_post, submit_post_edit, delete_sell_post, mark_post_sold
+)
 from handlers.utils import is_user_approved, ALL_COMMUNITY_CHATS, ADMIN_CHAT_ID, build_main_menu_for_user, add_back_button
+from handlers.review_queue import review_queue, ReviewItem, decision_callback
+from handlers.ui import render
+from handlers.publisher import refresh_published_post, remove_published_post
+from handlers.sessions import CONVERSATION_TIMEOUT, timeout_handlers
+from handlers.rate_limit import check_rate, check_daily_posts
+from cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 # --- Conversation States ---
 AWAITING_POST_CONTENT, AWAITING_EDIT_POST_ID, AWAITING_NEW_CONTENT = range(3)
 
+# --- אינדקס מודעות לכל משתמש (קאש קצר בין לחיצות כפתור) ---
+POSTS_INDEX_TTL = 120 # שניות
+_posts_index_cache = TTLCache('posts_index', ttl=POSTS_INDEX_TTL, maxsize=10_000)
+
 
 # --- Handlers ---
 
 async def sell_start_check(update: Update, user_id: int) -> bool:
     """בדיקת עזר האם למשתמש מותר לפרסם."""
-    if not is_user_approved(user_id):
+    # הגבלת הקצב נבדקת בזיכרון לפני כל בדיקה שעשויה להגיע ל-DB
+    refusal = check_rate(user_id, 'sell')
+    if refusal is None:
+        if not is_user_approved(user_id):
+            refusal = "⛔️ עליך לעבור אימות מלא לפני פרסום מודעות."
+        else:
+            refusal = check_daily_posts(user_id)
+    if refusal:
         # הודעה למשתמש
-        message = update.message if update.message else update.callback_query.message
-        await message.reply_text("⛔️ עליך לעבור אימות מלא לפני פרסום מודעות.")
+        await render(update, refusal,
+                     reply_markup=build_main_menu_for_user(user_id) if update.callback_query else None)
         return False
     return True
 
@@ -49,17 +69,44 @@ async def sell_start_button(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not await sell_start_check(update, query.from_user.id):
         return ConversationHandler.END
 
-    await query.message.reply_text("✏️ אנא שלח כעת את תוכן מודעת המכירה שלך (טקסט/תמונה):")
+    await render(update, "✏️ אנא שלח כעת את תוכן מודעת המכירה שלך (טקסט/תמונה):")
     return AWAITING_POST_CONTENT
 
 
+def _build_post_review_item(post, telegram_user, edited: bool = False) -> ReviewItem:
+    """פריט הבדיקה של מודעה לערוץ הניהול (מודעה חדשה, או עריכה של מודעה קיימת)."""
+    full_name = telegram_user.full_name or "לא צוין שם"
+    username = f"@{telegram_user.username}" if telegram_user.username else "אין Username"
+    title = "✏️ עריכת מודעה ממתינה לאישור" if edited else "📦 מודעת מכירה חדשה ממתינה"
+
+    message_to_admin = f"""{title}:
+    
+👤 מפרסם: {full_name} ({username})
+🆔 Post ID: {post.id}
+
+📝 תוכן:
+{post.description}
+    """
+
+    return ReviewItem(
+        key=f"post:{post.id}",
+        text=message_to_admin,
+        photo_id=post.image_id,
+        buttons=[
+            InlineKeyboardButton("✅ אשר מודעה", callback_data=decision_callback("approve_post", post.id, post.user_id)),
+            InlineKeyboardButton("❌ דחה", callback_data=decision_callback("reject_post", post.id, post.user_id))
+        ]
+    )
+
+
 async def sell_receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """שומר את תוכן המודעה ושולח לאדמין לאישור."""
     
     # תמיכה בטקסט או תמונה עם כיתוב
+    image_id = None
     if update.message.photo:
         post_content = update.message.caption or "[תמונה ללא טקסט]"
-        # כאן אפשר להוסיף לוגיקה לשמירת ה-File ID של התמונה ב-DB אם רוצים
+        image_id = update.message.photo[-1].file_id
     else:
         post_content = update.message.text
 
@@ -69,48 +116,25 @@ async def sell_receive_content(update: Update, context: ContextTypes.DEFAULT_TYP
 
     user_id = update.effective_user.id
 
+    # 0. המכסה היומית (השיחה עשויה הייתה להתחיל לפני שהמכסה מוצתה)
+    refusal = check_daily_posts(user_id)
+    if refusal:
+        await update.message.reply_text(refusal, reply_markup=build_main_menu_for_user(user_id))
+        return ConversationHandler.END
+
     # 1. שמירה ב-DB
-    post = add_sell_post(user_id, post_content)
+    post = add_sell_post(user_id, post_content, image_id=image_id)
+    if not post:
+        await update.message.reply_text("❌ שגיאה בשמירת המודעה. נסה שוב.")
+        return ConversationHandler.END
+    _invalidate_posts_index(user_id)
     
     # 2. שליחה לאדמין לאישור
-    telegram_user = update.effective_user
-    full_name = telegram_user.full_name or "לא צוין שם"
-    username = f"@{telegram_user.username}" if telegram_user.username else "אין Username"
-    
-    message_to_admin = f"""📦 **מודעת מכירה חדשה ממתינה:**
-    
-👤 מפרסם: {full_name} ({username})
-🆔 Post ID: `{post.id}`
-
-📝 **תוכן:**
-{post_content}
-    """
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ אשר מודעה", callback_data=f"approve_post_{post.id}"),
-            InlineKeyboardButton("❌ דחה", callback_data=f"reject_post_{post.id}")
-        ]
-    ]
+    item = _build_post_review_item(post, update.effective_user)
 
     try:
-        # אם יש תמונה, נשלח תמונה. אם לא, טקסט.
-        if update.message.photo:
-             await context.bot.send_photo(
-                chat_id=int(ADMIN_CHAT_ID),
-                photo=update.message.photo[-1].file_id,
-                caption=message_to_admin,
-                parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=int(ADMIN_CHAT_ID),
-                text=message_to_admin,
-                parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            
+        # במצב digest הפריט נאגר ונשלח בהודעה מרוכזת; אחרת נשלח מיד
+        await review_queue.submit(context.bot, item)
     except Exception as e:
         logger.error(f"Failed to send selling post to admin: {e}")
         await update.message.reply_text("❌ שגיאה בשליחת המודעה לאדמין. נסה שוב.")
@@ -130,24 +154,160 @@ async def sell_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     text = "🔄 יצירת המודעה בוטלה."
     if update.callback_query:
         await update.callback_query.answer()
-        await update.callback_query.message.reply_text(text, reply_markup=build_main_menu_for_user(update.effective_user.id))
-    else:
-        await update.message.reply_text(text, reply_markup=build_main_menu_for_user(update.effective_user.id))
+    await render(update, text, reply_markup=build_main_menu_for_user(update.effective_user.id))
         
     return ConversationHandler.END
 
-# --- Edit Handlers Placeholder ---
+# --- עריכת מודעות (/editposts) ---
+
+def _get_posts_index(user_id: int, refresh: bool = False) -> Dict[int, object]:
+    """מחזיר {post_id: post} של המשתמש מהקאש, או שולף מחדש מה-DB אם פג תוקף."""
+    index = None if refresh else _posts_index_cache.get(user_id)
+    if index is None:
+        index = {post.id: post for post in get_user_posts(user_id)}
+        _posts_index_cache.set(user_id, index)
+    return index
+
+def _invalidate_posts_index(user_id: int):
+    _posts_index_cache.invalidate(user_id)
+
+def _build_posts_list(index: Dict[int, object]) -> Tuple[str, InlineKeyboardMarkup]:
+    """בונה את רשימת המודעות עם כפתורי פעולה לכל מודעה."""
+    status_labels = {'active': '🟢', 'sold': '✅', 'expired': '⌛'}
+    text = "📝 המודעות שלך:\n\n"
+    keyboard = []
+    for post_id, post in sorted(index.items()):
+        preview = post.description[:40] + ("…" if len(post.description) > 40 else "")
+        approval = "" if post.is_approved else " (ממתינה לאישור)"
+        text += f"{status_labels.get(post.status, '•')} #{post_id}{approval}: {preview}\n"
+        row = [InlineKeyboardButton(f"✏️ #{post_id}", callback_data=f"mypost_edit_{post_id}")]
+        if post.status == 'active':
+            row.append(InlineKeyboardButton("✅ נמכר", callback_data=f"mypost_sold_{post_id}"))
+        row.append(InlineKeyboardButton("🗑 מחק", callback_data=f"mypost_del_{post_id}"))
+        keyboard.append(row)
+    keyboard.append([InlineKeyboardButton("✔️ סיום", callback_data="mypost_done")])
+    return text, InlineKeyboardMarkup(keyboard)
+
 async def edit_my_posts_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """(Placeholder) עריכת מודעות."""
+    """מציג את מודעות המשתמש עם כפתורי עריכה / מחיקה / נמכר."""
     user_id = update.effective_user.id
-    posts = get_user_posts(user_id)
-    if not posts:
+    index = _get_posts_index(user_id, refresh=True)
+    if not index:
         await update.message.reply_text("אין לך מודעות פעילות.")
         return ConversationHandler.END
-    await update.message.reply_text(f"יש לך {len(posts)} מודעות פעילות.")
+
+    text, markup = _build_posts_list(index)
+    await update.message.reply_text(text, reply_markup=markup)
+    return AWAITING_EDIT_POST_ID
+
+async def edit_post_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """מטפל בלחיצה על כפתור פעולה של מודעה מהרשימה."""
+    query = update.callback_query
+    user_id = query.from_user.id
+
+    if query.data == "mypost_done":
+        await query.answer()
+        _invalidate_posts_index(user_id)
+        await render(update, "✔️ העריכה הסתיימה.", reply_markup=build_main_menu_for_user(user_id))
+        return ConversationHandler.END
+
+    _, action, raw_id = query.data.split("_")
+    post_id = int(raw_id)
+    index = _get_posts_index(user_id)
+    post = index.get(post_id)
+    if not post:
+        # הבדיקה מול האינדקס היא גם בדיקת בעלות על המודעה
+        await query.answer("המודעה לא נמצאה.", show_alert=True)
+        return AWAITING_EDIT_POST_ID
+
+    if action == "edit":
+        await query.answer()
+        context.user_data['edit_post_id'] = post_id
+        await render(update, f"✏️ שלח את התוכן החדש למודעה #{post_id} (או /cancel לביטול):")
+        return AWAITING_NEW_CONTENT
+
+    if action == "sold":
+        if not mark_post_sold(post_id, user_id):
+            await query.answer("לא ניתן לסמן את המודעה כנמכרה.", show_alert=True)
+            return AWAITING_EDIT_POST_ID
+        post.status = 'sold'
+        await refresh_published_post(context.bot, post)
+        await query.answer("✅ סומנה כנמכרה")
+    elif action == "del":
+        if not delete_sell_post(post_id):
+            await query.answer("שגיאה במחיקת המודעה.", show_alert=True)
+            return AWAITING_EDIT_POST_ID
+        index.pop(post_id, None)
+        await remove_published_post(context.bot, post_id)
+        await query.answer("🗑 המודעה נמחקה")
+
+    if not index:
+        await render(update, "אין לך מודעות פעילות.", reply_markup=build_main_menu_for_user(user_id))
+        return ConversationHandler.END
+
+    text, markup = _build_posts_list(index)
+    await render(update, text, reply_markup=markup)
+    return AWAITING_EDIT_POST_ID
+
+async def edit_post_receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    שומר את התוכן החדש ושולח אותו שוב לאישור מנהל.
+    ההודעות שכבר פורסמו בקבוצות נשארות עם הטקסט המאושר, ונערכות רק כשמנהל מאשר את העריכה.
+    """
+    user_id = update.effective_user.id
+    post_id = context.user_data.pop('edit_post_id', None)
+    index = _get_posts_index(user_id)
+    post = index.get(post_id)
+    if not post:
+        await update.message.reply_text("⚠️ המודעה לא נמצאה.")
+        return ConversationHandler.END
+
+    new_content = update.message.text
+    if not submit_post_edit(post_id, new_content):
+        await update.message.reply_text("❌ שגיאה בעדכון המודעה.")
+        return ConversationHandler.END
+
+    post.description = new_content
+    post.is_approved = False
+    try:
+        # אותו key כמו המודעה המקורית - מחליף בקשה שעדיין ממתינה
+        await review_queue.submit(context.bot, _build_post_review_item(post, update.effective_user, edited=True))
+    except Exception as e:
+        logger.error(f"Failed to send edited post {post_id} to admin: {e}")
+
+    text, markup = _build_posts_list(index)
+    await update.message.reply_text("✅ העריכה נשלחה לאישור מנהל.\n\n" + text, reply_markup=markup)
+    return AWAITING_EDIT_POST_ID
+
+async def edit_posts_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """מסיים את שיחת העריכה."""
+    context.user_data.pop('edit_post_id', None)
+    _invalidate_posts_index(update.effective_user.id)
+    await update.message.reply_text("🔄 העריכה בוטלה.", reply_markup=build_main_menu_for_user(update.effective_user.id))
     return ConversationHandler.END
 
 
+async def mark_sold_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """מסמן מודעה כנמכרה: /sold <post_id>"""
+    if not context.args:
+        await update.message.reply_text("שימוש: /sold <מספר מודעה>")
+        return
+    try:
+        post_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("שגיאה בפורמט מספר המודעה.")
+        return
+
+    if mark_post_sold(post_id, update.effective_user.id):
+        _invalidate_posts_index(update.effective_user.id)
+        post = get_sell_post(post_id)
+        if post:
+            await refresh_published_post(context.bot, post)
+        await update.message.reply_text(f"✅ מודעה {post_id} סומנה כנמכרה.")
+    else:
+        await update.message.reply_text("⚠️ לא נמצאה מודעה פעילה שלך עם המספר הזה.")
+
+
 def setup_selling_handlers(application: Application):
     """רושם את כל ה-Handlers של מודול המכירה."""
     
@@ -161,12 +321,35 @@ def setup_selling_handlers(application: Application):
             AWAITING_POST_CONTENT: [
                 MessageHandler(filters.TEXT | filters.PHOTO & ~filters.COMMAND, sell_receive_content)
             ],
+            ConversationHandler.TIMEOUT: timeout_handlers(),
         },
         fallbacks=[CommandHandler('cancel', sell_cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        name="sell_conversation",
+        persistent=application.persistence is not None # מצב multi-worker (cluster.py)
     )
     application.add_handler(sell_conv_handler)
     
-    application.add_handler(CommandHandler("editposts", edit_my_posts_start))
+    # עריכת מודעות קיימות
+    edit_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("editposts", edit_my_posts_start)],
+        states={
+            AWAITING_EDIT_POST_ID: [
+                CallbackQueryHandler(edit_post_action, pattern=r"^mypost_((edit|sold|del)_\d+|done)$")
+            ],
+            AWAITING_NEW_CONTENT: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, edit_post_receive_content)
+            ],
+            ConversationHandler.TIMEOUT: timeout_handlers('edit_post_id'),
+        },
+        fallbacks=[CommandHandler('cancel', edit_posts_cancel)],
+        allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        name="edit_posts_conversation",
+        persistent=application.persistence is not None # מצב multi-worker (cluster.py)
+    )
+    application.add_handler(edit_conv_handler)
+    application.add_handler(CommandHandler("sold", mark_sold_command))
 
     logger.info("Selling handlers setup complete")
@@ -0,0 +1,91 @@
+# ==================================
+# קובץ: handlers/sessions.py (תפוגת שיחות ופינוי user_data לא פעיל)
+# ==================================
+"""
+בלי פינוי, ל-Application יש user_data לכל משתמש ששלח אי פעם עדכון (גם מצטרפים לקבוצות),
+ושיחות שננטשו באמצע (/verify, /sell) נשארות פתוחות לתמיד.
+
+- לכל ConversationHandler יש conversation_timeout; מצב TIMEOUT מנקה את שדות השיחה מ-user_data.
+- זמן הפעילות האחרון נשמר כמספר שלם (שניות) לכל משתמש - בלי אובייקטי datetime.
+- משימה מחזורית מוחקת user_data ריק מיד, ו-user_data עם תוכן אחרי USER_DATA_IDLE_TTL בלי פעילות.
+  במצב multi-worker המחיקה עוברת גם ל-SharedPersistence (drop_user_data).
+"""
+import os
+import time
+import logging
+from typing import Dict, List
+from telegram import Update
+from telegram.ext import Application, ContextTypes, JobQueue, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+CONVERSATION_TIMEOUT = int(os.getenv("CONVERSATION_TIMEOUT", 15 * 60))  # שניות בלי תגובה עד שהשיחה נסגרת
+USER_DATA_IDLE_TTL = int(os.getenv("USER_DATA_IDLE_TTL", 30 * 60))      # שניות בלי פעילות עד פינוי user_data
+SESSION_SWEEP_INTERVAL = 300
+# קבוצת handlers שרצה לפני כל השאר ולא חוסמת אותם
+ACTIVITY_HANDLER_GROUP = -1
+
+_last_seen: Dict[int, int] = {} # user_id -> שניות (monotonic)
+stats = {'timed_out': 0, 'evicted': 0, 'dropped_empty': 0}
+
+
+def _now() -> int:
+    return int(time.monotonic())
+
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user:
+        _last_seen[update.effective_user.id] = _now()
+
+
+def timeout_handlers(*keys: str) -> List[TypeHandler]:
+    """handlers למצב ConversationHandler.TIMEOUT: מנקים את שדות השיחה מ-user_data."""
+    async def on_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        stats['timed_out'] += 1
+        if context.user_data is not None:
+            for key in keys:
+                context.user_data.pop(key, None)
+    return [TypeHandler(Update, on_timeout)]
+
+
+def active_sessions(application: Application) -> int:
+    """כמה משתמשים מחזיקים כרגע user_data עם תוכן."""
+    return sum(1 for data in application.user_data.values() if data)
+
+
+async def sweep_sessions_callback(context: ContextTypes.DEFAULT_TYPE):
+    """משימה: פינוי user_data ריק או לא פעיל, ורשומות פעילות ישנות."""
+    application = context.application
+    now = _now()
+    cutoff = now - USER_DATA_IDLE_TTL
+    evicted = dropped = 0
+    recent = now - SESSION_SWEEP_INTERVAL
+    for user_id, data in list(application.user_data.items()):
+        if not data:
+            # לא נוגעים במשתמש שפעיל ממש עכשיו - handler באמצע ריצה עלול עוד לכתוב לאותו dict
+            if _last_seen.get(user_id, 0) < recent:
+                application.drop_user_data(user_id)
+                dropped += 1
+        elif _last_seen.setdefault(user_id, now) < cutoff: # בלי רישום (למשל נטען מ-persistence) - נספר מעכשיו
+            application.drop_user_data(user_id)
+            evicted += 1
+    for user_id in [uid for uid, seen in _last_seen.items() if seen < cutoff]:
+        del _last_seen[user_id]
+
+    stats['evicted'] += evicted
+    stats['dropped_empty'] += dropped
+    if evicted:
+        logger.info(f"Sessions: evicted {evicted} idle user_data, dropped {dropped} empty "
+                    f"({active_sessions(application)} active)")
+
+
+def setup_session_tracking(application: Application):
+    application.add_handler(TypeHandler(Update, track_activity), group=ACTIVITY_HANDLER_GROUP)
+
+
+def schedule_session_sweep(job_queue: JobQueue):
+    """מגדיר את הפינוי המחזורי (user_data הוא לכל תהליך, ולכן רץ בכל worker)."""
+    logger.info(f"Scheduling session sweep every {SESSION_SWEEP_INTERVAL}s (idle TTL {USER_DATA_IDLE_TTL}s)")
+    job_queue.run_repeating(sweep_sessions_callback, interval=SESSION_SWEEP_INTERVAL,
+                            first=SESSION_SWEEP_INTERVAL, name="session_sweep")
@@ -0,0 +1,97 @@
+# ==================================
+# קובץ: handlers/ui.py (שכבת תצוגה לתפריטים - עריכה במקום שליחה)
+# ==================================
+"""
+render() מציג מסך (טקסט + מקלדת) בתגובה ללחיצה על כפתור או להודעה:
+- בלחיצה על כפתור - עורך את ההודעה שעליה נלחץ, במקום לשלוח הודעה חדשה.
+- אם המסך זהה למה שכבר מוצג - לא שולח כלום (טלגרם היה מחזיר "message is not modified").
+- אם השתנתה רק המקלדת - עורך רק אותה.
+- אם אי אפשר לערוך (הודעת תמונה, הודעה ישנה/שנמחקה) - שולח הודעה חדשה.
+"""
+import json
+import hashlib
+import logging
+from typing import Optional
+from telegram import Update, Message, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# המסך האחרון שהוצג בכל הודעה: (chat_id, message_id) -> (hash, הטקסט כפי שטלגרם החזיר אותו).
+# הטקסט נשמר כדי לזהות עריכות שנעשו מחוץ ל-render (למשל query.edit_message_text) - אז הטביעה לא תקפה.
+_rendered = TTLCache('ui_rendered', ttl=24 * 3600, maxsize=50_000)
+
+stats = {'sent': 0, 'edited': 0, 'markup_only': 0, 'skipped': 0}
+
+
+def _fingerprint(text: str, reply_markup: Optional[InlineKeyboardMarkup], parse_mode: Optional[str]) -> str:
+    markup = json.dumps(reply_markup.to_dict(), sort_keys=True) if reply_markup else ""
+    return hashlib.blake2b(f"{parse_mode}\0{text}\0{markup}".encode(), digest_size=16).hexdigest()
+
+
+def _markup_equal(message: Message, reply_markup: Optional[InlineKeyboardMarkup]) -> bool:
+    current = message.reply_markup
+    if not current or not current.inline_keyboard:
+        return reply_markup is None or not reply_markup.inline_keyboard
+    return reply_markup is not None and current.to_dict() == reply_markup.to_dict()
+
+
+def _text_equal(message: Message, key, text: str, reply_markup, parse_mode) -> Optional[bool]:
+    """
+    האם הטקסט המוצג זהה. בלי parse_mode משווים להודעה החיה עצמה.
+    עם Markdown/HTML אי אפשר להשוות ישירות (טלגרם מחזיר טקסט בלי סימון), ולכן סומכים על הטביעה השמורה -
+    רק אם הטקסט החי הוא עדיין מה ש-render הציג. אחרת None (לא ידוע).
+    """
+    if parse_mode is None:
+        return message.text == text
+    entry = _rendered.get(key)
+    if entry is not None and entry == (_fingerprint(text, reply_markup, parse_mode), message.text):
+        return True
+    return None
+
+def _remember(message: Message, fingerprint: str):
+    _rendered.set((message.chat_id, message.message_id), (fingerprint, message.text))
+
+
+async def render(update: Update, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                 parse_mode: Optional[str] = None) -> Optional[Message]:
+    """
+    מציג מסך למשתמש, עם העדפה לעריכת ההודעה הקיימת.
+    מחזיר את ההודעה שמציגה את המסך (None אם לא נדרשה שום קריאה).
+    """
+    query = update.callback_query
+    message = query.message if query else None
+
+    if message is not None and message.text is not None:
+        key = (message.chat_id, message.message_id)
+        fingerprint = _fingerprint(text, reply_markup, parse_mode)
+        same_text = _text_equal(message, key, text, reply_markup, parse_mode)
+        same_markup = _markup_equal(message, reply_markup)
+        try:
+            if same_text and same_markup:
+                stats['skipped'] += 1
+                return None
+            if same_text:
+                result = await message.edit_reply_markup(reply_markup=reply_markup)
+                stats['markup_only'] += 1
+            else:
+                result = await message.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+                stats['edited'] += 1
+            if isinstance(result, Message):
+                _remember(result, fingerprint)
+                return result
+            return message
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                _remember(message, fingerprint)
+                stats['skipped'] += 1
+                return None
+            logger.info(f"Cannot edit message {key}, sending a new one: {e}")
+
+    chat_id = update.effective_chat.id
+    sent = await update.get_bot().send_message(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+    stats['sent'] += 1
+    _remember(sent, _fingerprint(text, reply_markup, parse_mode))
+    return sent
@@ -7,7 +7,11 @@ from telegram import Bot, ChatPermissions, Update, InlineKeyboardButton, InlineK
 from telegram.ext import ContextTypes
 from typing import List, Union
 
-from db_operations import get_user, ban_user_in_db, get_all_admins, get_all_pending_users, get_pending_sell_posts
+from db_operations import (
+    get_user, ban_user_with_side_effects, get_all_admins, count_pending_users, count_pending_sell_posts
+)
+from cache import TTLCache
+from handlers.ui import render
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +26,15 @@ if os.getenv("ALL_COMMUNITY_CHATS"):
     except ValueError:
         logger.error("ALL_COMMUNITY_CHATS must contain comma-separated integer IDs.")
 
+# --- קאשים (מתמלאים ברקע אחרי העלייה, ראה warm_caches) ---
+_admin_ids_cache = TTLCache('admin_ids', ttl=300)
+_pending_counts_cache = TTLCache('pending_counts', ttl=30)
+# סטטוס משתמש (מאושר, חסום) - TTL ארוך: כל כתיבה ל-users מפנה את המפתח בכל התהליכים (invalidation.py)
+_user_status_cache = TTLCache('user_status', ttl=3600, maxsize=100_000)
+# מנהלי כל קבוצה (chat_id -> set של user ids) - מתרענן ע"י handlers/chat_admins.py ועל שינויי הרשאות
+CHAT_ADMINS_REFRESH_INTERVAL = int(os.getenv("CHAT_ADMINS_REFRESH_INTERVAL", 3600)) # שניות
+_chat_admins_cache = TTLCache('chat_admins', ttl=CHAT_ADMINS_REFRESH_INTERVAL * 2)
+
 # --- קבועים ---
 DAY_NAMES = {
     0: "ראשון", 1: "שני", 2: "שלישי", 3: "רביעי", 4: "חמישי", 5: "שישי"
@@ -32,37 +45,87 @@ def is_super_admin(user_id: int) -> bool:
     """מחזיר True אם המשתמש הוא הסופר-אדמין."""
     return user_id == SUPER_ADMIN_ID
 
+def get_user_status(user_id: int):
+    """(is_approved, is_banned) מהקאש, או None אם המשתמש לא קיים ב-DB."""
+    def load():
+        user = get_user(user_id)
+        return None if user is None else (bool(user.is_approved), bool(user.is_banned))
+    return _user_status_cache.get_or_load(user_id, load)
+
 def is_user_approved(user_id: int) -> bool:
     """מחזיר True אם המשתמש מאושר ואינו חסום (נדרש על ידי selling.py)."""
-    user = get_user(user_id)
-    return user is not None and user.is_approved and not user.is_banned
+    status = get_user_status(user_id)
+    return status is not None and status[0] and not status[1]
+
+def get_admin_ids() -> set:
+    """סט ה-IDs של אדמיני ה-DB (מהקאש)."""
+    return _admin_ids_cache.get_or_load('all', lambda: {u.telegram_id for u in get_all_admins()})
+
+def get_pending_counts() -> tuple:
+    """(משתמשים ממתינים, מודעות ממתינות) - מהקאש, לתפריט הראשי של אדמינים."""
+    return _pending_counts_cache.get_or_load('all', lambda: (count_pending_users(), count_pending_sell_posts()))
+
+def warm_caches():
+    """ממלא מראש את הקאשים (רץ ברקע אחרי שהבוט התחיל לקבל עדכונים)."""
+    get_admin_ids()
+    get_pending_counts()
 
 def is_user_admin(user_id: int) -> bool:
     """בודק אם המשתמש הוא אדמין רגיל או סופר אדמין."""
-    user = get_user(user_id)
-    return (user is not None and user.is_admin) or is_super_admin(user_id)
+    return is_super_admin(user_id) or user_id in get_admin_ids()
     
+async def refresh_chat_admins(bot: Bot, chat_id: int) -> set:
+    """טוען מחדש את מנהלי הקבוצה (קריאת API אחת לכל הקבוצה) ושומר בקאש."""
+    try:
+        admins = await bot.get_chat_administrators(chat_id)
+    except Exception as e:
+        logger.warning(f"Failed to load administrators of chat {chat_id}: {e}")
+        _chat_admins_cache.set(chat_id, set(), ttl=60) # לא לנסות שוב על כל בדיקה
+        return set()
+    admin_ids = {member.user.id for member in admins}
+    set_cached_chat_admins(chat_id, admin_ids)
+    return admin_ids
+
+def get_cached_chat_admins(chat_id: int):
+    """סט מנהלי הקבוצה מהקאש בלבד (בלי קריאת API), או None אם לא נטען."""
+    return _chat_admins_cache.get(chat_id)
+
+def set_cached_chat_admins(chat_id: int, admin_ids: set):
+    """שומר בקאש את סט מנהלי הקבוצה (למשל אחרי עדכון ידוע של מנהל אחד)."""
+    _chat_admins_cache.set(chat_id, admin_ids)
+
+async def get_chat_admin_ids(bot: Bot, chat_id: int) -> set:
+    """סט מנהלי הקבוצה מהקאש; נטען מה-API רק אם חסר/פג תוקף."""
+    admin_ids = get_cached_chat_admins(chat_id)
+    if admin_ids is None:
+        admin_ids = await refresh_chat_admins(bot, chat_id)
+    return admin_ids
+
 async def is_chat_admin(chat: Update.effective_chat, user: Update.effective_user) -> bool:
-    """בדיקה אם המשתמש הוא אדמין בצ'אט הנתון (כולל אדמין DB)."""
-    user_db = get_user(user.id)
-    if user_db and user_db.is_admin:
+    """בדיקה אם המשתמש הוא אדמין בצ'אט הנתון (כולל אדמין DB) - חיפוש בזיכרון, בלי קריאת רשת."""
+    if user.id in get_admin_ids() or is_super_admin(user.id):
         return True
-    
-    try:
-        member = await chat.get_member(user.id)
-        if member.status in ('administrator', 'creator'):
-            return True
-    except Exception:
-        pass
-    
-    return is_super_admin(user.id)
+    if chat.type == 'private':
+        return False
+    return user.id in await get_chat_admin_ids(chat.get_bot(), chat.id)
 
 # --- פעולות על הרשאות ---
-async def restrict_user_permissions(chat_id: int, user_id: int):
+def _media_permissions(allowed: bool) -> dict:
+    """ההרשאות הפרטניות שהחליפו את can_send_media_messages ב-Bot API 6.5 (ו-PTB 20.x)."""
+    return dict(
+        can_send_audios=allowed,
+        can_send_documents=allowed,
+        can_send_photos=allowed,
+        can_send_videos=allowed,
+        can_send_video_notes=allowed,
+        can_send_voice_notes=allowed
+    )
+
+async def restrict_user_permissions(chat_id: int, user_id: int, bot: Bot = None):
     """מגביל משתמש להודעות טקסט בלבד ומונע מדיה."""
     permissions = ChatPermissions(
         can_send_messages=False,
-        can_send_media_messages=False,
+        **_media_permissions(False),
         can_send_polls=False,
         can_send_other_messages=False,
         can_add_web_page_previews=False,
@@ -70,13 +133,13 @@ async def restrict_user_permissions(chat_id: int, user_id: int):
         can_invite_users=False,
         can_pin_messages=False
     )
-    await Bot(os.getenv("BOT_TOKEN")).restrict_chat_member(chat_id, user_id, permissions)
+    await (bot or Bot(os.getenv("BOT_TOKEN"))).restrict_chat_member(chat_id, user_id, permissions)
 
-async def grant_user_permissions(chat_id: int, user_id: int):
+async def grant_user_permissions(chat_id: int, user_id: int, bot: Bot = None):
     """נותן למשתמש הרשאות כתיבה מלאות."""
     permissions = ChatPermissions(
         can_send_messages=True,
-        can_send_media_messages=True,
+        **_media_permissions(True),
         can_send_polls=True,
         can_send_other_messages=True,
         can_add_web_page_previews=True,
@@ -84,21 +147,14 @@ async def grant_user_permissions(chat_id: int, user_id: int):
         can_invite_users=True,
         can_pin_messages=False
     )
-    await Bot(os.getenv("BOT_TOKEN")).restrict_chat_member(chat_id, user_id, permissions)
+    await (bot or Bot(os.getenv("BOT_TOKEN"))).restrict_chat_member(chat_id, user_id, permissions)
 
 async def ban_user_globally(bot: Bot, user_id: int) -> bool:
-    """חוסם משתמש מכל קבוצות הקהילה ומעדכן DB."""
-    success = True
-    for chat_id in ALL_COMMUNITY_CHATS:
-        try:
-            await bot.ban_chat_member(chat_id, user_id)
-        except Exception as e:
-            logger.error(f"Failed to ban user {user_id} from chat {chat_id}: {e}")
-            success = False
-            
-    ban_user_in_db(user_id)
-    
-    return success
+    """
+    חוסם משתמש מכל קבוצות הקהילה ומעדכן DB.
+    ה-DB מתעדכן קודם, והחסימות בטלגרם נכנסות ל-outbox באותה טרנזקציה (מבוצעות ע"י handlers/outbox.py).
+    """
+    return ban_user_with_side_effects(user_id, ALL_COMMUNITY_CHATS)
 
 async def set_group_read_only(bot: Bot, chat_id: int, is_read_only: bool) -> bool:
     """הופך קבוצה למצב קריאה בלבד או מחזיר הרשאות כתיבה."""
@@ -107,7 +163,7 @@ async def set_group_read_only(bot: Bot, chat_id: int, is_read_only: bool) -> boo
     else:
         permissions = ChatPermissions(
             can_send_messages=True,
-            can_send_media_messages=True
+            **_media_permissions(True)
         )
         
     try:
@@ -118,9 +174,9 @@ async def set_group_read_only(bot: Bot, chat_id: int, is_read_only: bool) -> boo
         return False
 
 # --- פונקציות לתמיכה במקלדת ---
-async def check_user_status_and_reply(message: Update.message, context: ContextTypes.DEFAULT_TYPE):
-    """בדיקת סטטוס אימות ושליחת תגובה מתאימה (עבור המקלדת הצפה)."""
-    user_id = message.chat_id
+async def check_user_status_and_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """בדיקת סטטוס אימות והצגתו במקום התפריט (עבור המקלדת הצפה)."""
+    user_id = update.effective_user.id
     user = get_user(user_id)
     
     if not user:
@@ -132,7 +188,7 @@ async def check_user_status_and_reply(message: Update.message, context: ContextT
     else:
         status_text = "⏳ ממתין לאישור מנהל. פרטיך נשלחו לבדיקה."
         
-    await message.reply_text(status_text)
+    await render(update, status_text, reply_markup=build_main_menu_for_user(user_id))
     
 def build_back_button():
     """בונה מקלדת עם כפתור חזרה בסיסי (נדרש על ידי verification.py)."""
@@ -156,8 +212,7 @@ def build_main_menu_for_user(user_id: int) -> InlineKeyboardMarkup:
     ]
     
     if is_user_admin(user_id):
-        pending_users = len(get_all_pending_users())
-        pending_posts = len(get_pending_sell_posts())
+        pending_users, pending_posts = get_pending_counts()
         
         keyboard.append([
             InlineKeyboardButton(f"🚨 אישור ממתינים ({pending_users} / {pending_posts})", callback_data="admin_pending_menu")
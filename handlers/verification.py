@@ -16,9 +16,10 @@ from telegram.ext import (
 )
 
 
-from db_operations import get_user, create_or_update_user
+from db_operations import get_user
 from handlers.utils import (
     restrict_user_permissions, 
+    is_user_approved,
     build_main_menu_for_user, # השם תוקן
     get_menu_text, 
     ALL_COMMUNITY_CHATS,
@@ -26,6 +27,10 @@ from handlers.utils import (
     add_back_button,
     build_back_button # הייבוא תוקן
 )
+from handlers.verification_intake import verification_intake, Submission, validate_license_photo
+from handlers.antispam import on_member_joined
+from handlers.sessions import CONVERSATION_TIMEOUT, timeout_handlers
+from handlers.rate_limit import check_rate
 
 logger = logging.getLogger(__name__)
 
@@ -42,17 +47,22 @@ async def handle_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if new_member.status == telegram.constants.ChatMemberStatus.MEMBER:
         user_id = new_member.user.id
-        user = get_user(user_id)
+        # ספירת קצב ההצטרפות, נעילת הקבוצה בגל וניקוד חשדנות - לפני כל קריאה ל-DB/API
+        send_welcome = await on_member_joined(
+            context.bot, context.job_queue, chat_member.chat.id, new_member.user,
+            via_join_request=bool(chat_member.via_join_request)
+        )
+        approved = is_user_approved(user_id)
         
         # 1. הגבלת הרשאות בקבוצה (אם לא מאושר)
-        if not (user and user.is_approved):
+        if not approved:
             try:
                 await restrict_user_permissions(chat_member.chat.id, user_id)
             except Exception as e:
                 logger.error(f"Failed to restrict user {user_id} in chat {chat_member.chat.id}: {e}")
         
-        # 2. שליחת הודעת אימות פרטית (אם המשתמש עדיין לא מאומת)
-        if not (user and user.is_approved):
+        # 2. שליחת הודעת אימות פרטית (אם המשתמש עדיין לא מאומת ולא נראה כמו בוט)
+        if not approved and send_welcome:
             try:
                 await context.bot.send_message(
                     chat_id=user_id,
@@ -67,6 +77,11 @@ async def verify_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     if update.effective_chat.type != "private":
         return ConversationHandler.END
 
+    refusal = check_rate(update.effective_user.id, 'verify')
+    if refusal:
+        await update.message.reply_text(refusal)
+        return ConversationHandler.END
+
     user = get_user(update.effective_user.id)
     if user and user.is_approved:
         await update.message.reply_text("✅ אתה כבר מאושר. אין צורך באימות נוסף.")
@@ -104,45 +119,24 @@ async def verify_license(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("אנא שלח תמונה בלבד.")
         return AWAITING_LICENSE
     
-    photo_file_id = update.message.photo[-1].file_id
+    photo = update.message.photo[-1]
+    error = validate_license_photo(photo)
+    if error:
+        await update.message.reply_text(error)
+        return AWAITING_LICENSE
     
     user_id = update.effective_user.id
-    full_name = context.user_data.get('full_name')
-    phone_number = context.user_data.get('phone_number')
-    
-    # 1. שמירת הנתונים ב-DB
-    create_or_update_user(
-        user_id, 
-        full_name=full_name, 
-        phone_number=phone_number, 
-        license_photo_id=photo_file_id, 
-        is_approved=False # מחכים לאישור אדמין
+    submission = Submission(
+        user_id=user_id,
+        full_name=context.user_data.get('full_name'),
+        phone_number=context.user_data.get('phone_number'),
+        photo_id=photo.file_id
     )
     
-    # 2. שליחה לאדמין לאישור
-    message_to_admin = f"""🔔 בקשת אימות חדשה:
-
-    👤 שם: {full_name}
-    📱 טלפון: {phone_number}
-    🆔 Telegram ID: `{user_id}`
-    """
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ אשר", callback_data=f"approve_{user_id}"),
-            InlineKeyboardButton("❌ דחה (חסום)", callback_data=f"ban_{user_id}")
-        ]
-    ]
-
-    try:
-        await context.bot.send_photo(
-            chat_id=int(ADMIN_CHAT_ID),
-            photo=photo_file_id,
-            caption=message_to_admin,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    except Exception as e:
-        logger.error(f"Failed to send verification request to admin chat {ADMIN_CHAT_ID}: {e}")
+    # 1+2. שמירה ב-DB ושליחה לאדמין - ברקע, דרך תור הקליטה (שליחה חוזרת מחליפה את הקודמת)
+    if not verification_intake.submit(context.bot, submission):
+        await update.message.reply_text("⏳ יש כרגע עומס בקשות אימות. אנא שלח את התמונה שוב בעוד כמה דקות.")
+        return AWAITING_LICENSE
 
     # 3. תגובה למשתמש
     await update.message.reply_text(
@@ -175,10 +169,14 @@ def setup_verification_flow(application: Application):
             AWAITING_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, verify_name)],
             AWAITING_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, verify_phone)],
             AWAITING_LICENSE: [MessageHandler(filters.PHOTO, verify_license)],
+            ConversationHandler.TIMEOUT: timeout_handlers('full_name', 'phone_number'),
         },
         fallbacks=[CommandHandler('cancel', verify_cancel)],
         allow_reentry=True,
-        per_user=True
+        name="verification_conversation",
+        per_user=True,
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        persistent=application.persistence is not None # מצב multi-worker (cluster.py)
     )
     
     application.add_handler(conv_handler)
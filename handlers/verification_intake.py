@@ -0,0 +1,146 @@
+# ==================================
+# קובץ: handlers/verification_intake.py (תור קליטה לבקשות אימות)
+# ==================================
+"""
+שלב קליטה בין verify_license לבין ערוץ הניהול.
+- שליחה חוזרת של אותו משתמש לפני שהבקשה הקודמת טופלה מחליפה אותה (נשמרת רק האחרונה).
+- הכתיבה ל-DB וההעברה לערוץ הניהול נעשות ע"י worker ברקע, עם מגבלה על מספר ההעברות במקביל.
+- התור חסום בגודלו: כשהוא מלא, בקשות של משתמשים חדשים נדחות (backpressure) עד שיתפנה מקום.
+"""
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Set
+from telegram import Bot, InlineKeyboardButton, PhotoSize
+
+from db_operations import create_or_update_user
+from handlers.review_queue import review_queue, ReviewItem, decision_callback
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+INTAKE_MAX_INFLIGHT = int(os.getenv("INTAKE_MAX_INFLIGHT", 3))   # העברות לערוץ הניהול במקביל
+INTAKE_MAX_PENDING = int(os.getenv("INTAKE_MAX_PENDING", 500))   # משתמשים שונים בתור
+INTAKE_DEPTH_WARNING = 50                                         # מעל זה נרשמת אזהרה ביומן
+LICENSE_PHOTO_MIN_SIDE = 320                                      # פיקסלים - קטן מזה לא קריא
+LICENSE_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+
+
+def validate_license_photo(photo: PhotoSize) -> Optional[str]:
+    """מחזיר הודעת שגיאה למשתמש אם התמונה לא מתאימה, אחרת None."""
+    if min(photo.width, photo.height) < LICENSE_PHOTO_MIN_SIDE:
+        return "התמונה קטנה מדי לקריאה. אנא שלח צילום ברור וקרוב יותר של הרישיון."
+    if photo.file_size and photo.file_size > LICENSE_PHOTO_MAX_BYTES:
+        return "התמונה גדולה מדי. אנא שלח אותה כתמונה רגילה (לא כקובץ)."
+    return None
+
+
+@dataclass
+class Submission:
+    user_id: int
+    full_name: Optional[str]
+    phone_number: Optional[str]
+    photo_id: str
+
+
+class VerificationIntake:
+    """תור בקשות אימות עם איחוד לפי משתמש ומגבלת מקביליות."""
+
+    def __init__(self, max_inflight: int = INTAKE_MAX_INFLIGHT, max_pending: int = INTAKE_MAX_PENDING):
+        self.max_pending = max_pending
+        self._pending: "OrderedDict[int, Submission]" = OrderedDict()
+        self._inflight: Set[int] = set()
+        self.max_inflight = max_inflight
+        # נוצרים בתוך לולאת האירועים (ב-Python 3.8 הם נקשרים ללולאה ביצירה)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.coalesced = 0
+        self.rejected = 0
+
+    def depth(self) -> int:
+        """כמה בקשות ממתינות או בטיפול כרגע."""
+        return len(self._pending) + len(self._inflight)
+
+    def submit(self, bot: Bot, submission: Submission) -> bool:
+        """מכניס בקשה לתור. מחזיר False אם התור מלא (והמשתמש צריך לנסות שוב מאוחר יותר)."""
+        if submission.user_id in self._pending:
+            self.coalesced += 1
+            self._pending[submission.user_id] = submission # מחליף במקום, שומר על המקום בתור
+        elif len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f"Verification intake full ({len(self._pending)} pending), rejecting {submission.user_id}")
+            return False
+        else:
+            self._pending[submission.user_id] = submission
+
+        depth = self.depth()
+        if depth >= INTAKE_DEPTH_WARNING:
+            logger.warning(f"Verification intake depth {depth} (coalesced {self.coalesced}, rejected {self.rejected})")
+        self._ensure_worker(bot)
+        self._wakeup.set()
+        return True
+
+    def _ensure_worker(self, bot: Bot):
+        if self._worker is None or self._worker.done():
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_inflight)
+                self._wakeup = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run(bot))
+
+    async def _run(self, bot: Bot):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                await self._semaphore.acquire()
+                # משתמש שבקשה שלו כבר בטיפול ממתין לסיומה, כדי שהסדר (והאחרונה) יישמרו
+                user_id = next((uid for uid in self._pending if uid not in self._inflight), None)
+                if user_id is None:
+                    self._semaphore.release()
+                    break
+                submission = self._pending.pop(user_id)
+                self._inflight.add(user_id)
+                asyncio.get_running_loop().create_task(self._process(bot, submission))
+
+    async def _process(self, bot: Bot, submission: Submission):
+        try:
+            create_or_update_user(
+                submission.user_id,
+                full_name=submission.full_name,
+                phone_number=submission.phone_number,
+                license_photo_id=submission.photo_id,
+                is_approved=False # מחכים לאישור אדמין
+            )
+            await review_queue.submit(bot, _review_item(submission))
+        except Exception as e:
+            logger.error(f"Failed to forward verification request of {submission.user_id}: {e}")
+        finally:
+            self._inflight.discard(submission.user_id)
+            self._semaphore.release()
+            if self._pending:
+                self._wakeup.set()
+
+
+def _review_item(submission: Submission) -> ReviewItem:
+    message_to_admin = f"""🔔 בקשת אימות חדשה:
+
+    👤 שם: {submission.full_name}
+    📱 טלפון: {submission.phone_number}
+    🆔 Telegram ID: {submission.user_id}
+    """
+    return ReviewItem(
+        key=f"user:{submission.user_id}",
+        text=message_to_admin,
+        photo_id=submission.photo_id,
+        buttons=[
+            InlineKeyboardButton("✅ אשר", callback_data=decision_callback("approve", submission.user_id, submission.user_id)),
+            InlineKeyboardButton("❌ דחה (חסום)", callback_data=decision_callback("ban", submission.user_id, submission.user_id))
+        ]
+    )
+
+
+# מופע יחיד לכל התהליך
+verification_intake = VerificationIntake()
@@ -0,0 +1,165 @@
+# ==================================
+# קובץ: invalidation.py (פינוי קאש בין תהליכים דרך LISTEN/NOTIFY)
+# ==================================
+"""
+אפיק פינויי קאש בין תהליכים ורפליקות.
+
+- צד הכתיבה: פעולות DB קוראות ל-queue_invalidation(session, name, key) לפני commit.
+  ב-Postgres נשלח pg_notify בתוך אותה טרנזקציה - ההודעה נמסרת רק אם ה-commit הצליח, ואף פעם לפניו.
+  אחרי commit מתבצע גם פינוי מקומי מיידי בתהליך הכותב.
+- צד הקריאה: InvalidationListener מאזין ב-LISTEN על חיבור ייעודי, משולב בלולאת האירועים (add_reader),
+  ומפנה מקומית את המפתחות שהגיעו מתהליכים אחרים.
+"""
+import json
+import uuid
+import asyncio
+import logging
+from typing import Optional
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import Session as OrmSession
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+# מזהה אקראי לכל תהליך: ב-Docker התהליך הראשי של כל רפליקה הוא PID 1, כך ש-PID לא מבחין ביניהן
+ORIGIN = uuid.uuid4().hex
+RECONNECT_DELAY = 5 # שניות
+
+
+# ---------------------------------------------------------
+# ✍️ צד הכתיבה
+# ---------------------------------------------------------
+
+def queue_invalidation(session, name: str, key=None):
+    """רושם פינוי שיתבצע עם ה-commit של session (ויבוטל ב-rollback)."""
+    session.info.setdefault('invalidations', []).append((name, key))
+
+@event.listens_for(OrmSession, "before_commit")
+def _notify_before_commit(session):
+    events = session.info.get('invalidations')
+    if not events or session.get_bind().dialect.name != 'postgresql':
+        return
+    for name, key in dict.fromkeys(events): # בלי כפילויות, שומר סדר
+        payload = json.dumps({"origin": ORIGIN, "name": name, "key": key})
+        session.execute(select(func.pg_notify(CHANNEL, payload)))
+
+@event.listens_for(OrmSession, "after_commit")
+def _evict_after_commit(session):
+    events = session.info.pop('invalidations', None)
+    if not events:
+        return
+    postgres = session.get_bind().dialect.name == 'postgresql'
+    for name, key in dict.fromkeys(events):
+        if postgres:
+            # שאר התהליכים יקבלו את ה-NOTIFY; כאן רק פינוי מקומי
+            _evict(name, key)
+        else:
+            # בלי Postgres אין NOTIFY - מפנים ומפיצים דרך ה-publisher הרגיל (למשל backend בזיכרון)
+            cache.invalidate(name) if key is None else cache.invalidate(name, key)
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop('invalidations', None)
+
+def _evict(name, key):
+    if key is None:
+        cache.evict_local(name)
+    else:
+        cache.evict_local(name, key)
+
+
+# ---------------------------------------------------------
+# 👂 צד הקריאה
+# ---------------------------------------------------------
+
+class InvalidationListener:
+    """מאזין אסינכרוני ל-NOTIFY ומפנה מפתחות מהקאשים המקומיים."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.received = 0
+        self._raw = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._connect()
+
+    def _connect(self):
+        self._raw = self.engine.raw_connection()
+        conn = self._raw.driver_connection
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{CHANNEL}"')
+        self._loop.add_reader(conn.fileno(), self._on_readable)
+        logger.info("Cache invalidation listener started")
+
+    def _on_readable(self):
+        conn = self._raw.driver_connection
+        try:
+            conn.poll()
+        except Exception as e:
+            logger.error(f"Invalidation listener connection lost: {e}")
+            self._disconnect()
+            # ייתכן שפספסנו הודעות - מרוקנים הכל וממשיכים מנקודה נקייה
+            for name in cache.cache_names():
+                cache.evict_local(name)
+            if not self._stopped:
+                self._loop.call_later(RECONNECT_DELAY, self._reconnect)
+            return
+
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            try:
+                message = json.loads(notify.payload)
+            except ValueError:
+                continue
+            if message.get("origin") == ORIGIN:
+                continue # כבר פונה מקומית ב-after_commit
+            self.received += 1
+            _evict(message["name"], message.get("key"))
+
+    def _reconnect(self):
+        try:
+            self._connect()
+        except Exception as e:
+            logger.error(f"Invalidation listener reconnect failed: {e}")
+            self._loop.call_later(RECONNECT_DELAY, self._reconnect)
+
+    def _disconnect(self):
+        if self._raw is None:
+            return
+        try:
+            self._loop.remove_reader(self._raw.driver_connection.fileno())
+        except Exception:
+            pass
+        try:
+            self._raw.close()
+        except Exception:
+            pass
+        self._raw = None
+
+    async def stop(self):
+        self._stopped = True
+        self._disconnect()
+
+
+_listener: Optional[InvalidationListener] = None
+
+async def start_invalidation_listener(engine) -> Optional[InvalidationListener]:
+    """מפעיל את המאזין (Postgres בלבד; בלי Postgres אין רפליקות שצריך לסנכרן)."""
+    global _listener
+    if _listener is not None or engine is None or engine.dialect.name != 'postgresql':
+        return _listener
+    _listener = InvalidationListener(engine)
+    await _listener.start()
+    return _listener
+
+async def stop_invalidation_listener():
+    global _listener
+    if _listener is not None:
+        await _listener.stop()
+        _listener = None
@@ -2,35 +2,51 @@
 # קובץ: main.py (מלא וסופי - נקי)
 # ==================================
 import os
+import asyncio
 import logging
-from datetime import datetime, time
-import pytz
-import telegram
+from dotenv import load_dotenv
+
+# לפני שאר הייבואים: חלק מהמודולים (tracing, handlers) קוראים הגדרות מהסביבה בזמן הייבוא
+load_dotenv()
+
 from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
     ContextTypes,
-    MessageHandler, 
-    filters, 
-    ChatMemberHandler,
+    MessageHandler,
+    filters,
     CallbackQueryHandler
 )
-from dotenv import load_dotenv
 
+import cluster
+import db_models
+import tracing
 from db_models import init_db
-from handlers.verification import handle_new_member, setup_verification_flow
+from invalidation import start_invalidation_listener, stop_invalidation_listener
+
+tracing.instrument_db_operations() # לפני ייבוא ה-handlers, כדי שיקבלו את הפונקציות העטופות (רק אם TRACING=1)
+
+from handlers.utils import check_user_status_and_reply, build_main_menu_for_user, warm_caches
+from handlers.ui import render
+from handlers.verification import setup_verification_flow
 from handlers.admin import setup_admin_handlers, set_admin_command
 from handlers.selling import setup_selling_handlers
-from handlers.utils import check_user_status_and_reply, build_main_menu_for_user
+from handlers.review_queue import schedule_review_digest
+from handlers.outbox import schedule_outbox
+from handlers.reconcile import schedule_permission_reconcile
+from handlers.chat_admins import setup_chat_admins_handlers, schedule_chat_admins_refresh
+from handlers.audit import setup_audit_handlers, schedule_audit_flush, flush_audit_log
+from handlers.sessions import setup_session_tracking, schedule_session_sweep
+from handlers.rate_limit import schedule_rate_limit_sweep
+from handlers.antispam import schedule_chat_lock_restore
 
 try:
-    from handlers.jobs import schedule_weekly_posts
+    from handlers.jobs import schedule_weekly_posts, schedule_post_lifecycle
 except ImportError:
     def schedule_weekly_posts(job_queue): pass 
+    def schedule_post_lifecycle(job_queue): pass
 
-ISRAEL_TZ = pytz.timezone('Asia/Jerusalem')
-load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DB_URL = os.getenv("DATABASE_URL") or os.getenv("DB_URL")
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -51,7 +67,7 @@ async def handle_general_callbacks(update: Update, context: ContextTypes.DEFAULT
     
     if query.data == "check_verification_status":
         await query.answer()
-        await check_user_status_and_reply(query.message, context)
+        await check_user_status_and_reply(update, context)
         
     elif query.data == "help_menu_main":
         await query.answer()
@@ -63,15 +79,12 @@ async def handle_general_callbacks(update: Update, context: ContextTypes.DEFAULT
 
 לכל בעיה, פנה למנהלי הקבוצה.
 """
-        await query.message.edit_text(help_text, parse_mode="Markdown", 
-                                      reply_markup=build_main_menu_for_user(query.from_user.id))
+        await render(update, help_text, parse_mode="Markdown",
+                     reply_markup=build_main_menu_for_user(query.from_user.id))
     
     elif query.data == "main_menu_return":
         await query.answer()
-        await query.message.edit_text(
-            "תפריט ראשי:",
-            reply_markup=build_main_menu_for_user(query.from_user.id)
-        )
+        await render(update, "תפריט ראשי:", reply_markup=build_main_menu_for_user(query.from_user.id))
 
 async def show_main_keyboard_on_private_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_chat.type == "private":
@@ -80,17 +93,38 @@ async def show_main_keyboard_on_private_message(update: Update, context: Context
             reply_markup=build_main_menu_for_user(update.effective_user.id)
         )
 
-def main():
-    if not BOT_TOKEN or not DB_URL:
-        return
+async def warm_caches_callback(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """ממלא קאשים (אדמינים, מוני ממתינים לתפריט) ב-thread נפרד, בלי לעכב טיפול בעדכונים."""
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, warm_caches)
+        logger.info("Caches warmed")
+    except Exception as e:
+        logger.warning(f"Cache warm-up failed: {e}")
+
+async def post_init(application: Application) -> None:
+    # רץ לפני תחילת הקבלה; מתזמנים את החימום לשנייה אחרי שהעדכונים כבר זורמים
+    application.job_queue.run_once(warm_caches_callback, when=1, name="warm_caches")
 
+    # פינויי קאש מתהליכים/רפליקות אחרים (LISTEN/NOTIFY)
     try:
-        init_db(DB_URL)
+        await start_invalidation_listener(db_models.engine)
     except Exception as e:
-        logger.critical(f"DB Error: {e}")
-        return
-    
-    application = Application.builder().token(BOT_TOKEN).build()
+        logger.error(f"Failed to start cache invalidation listener: {e}")
+
+async def post_shutdown(application: Application) -> None:
+    await flush_audit_log() # לא לאבד רשומות יומן שעוד לא נכתבו
+    await stop_invalidation_listener()
+
+def build_application(primary: bool = True, persistence=None) -> Application:
+    """
+    בונה Application עם כל ה-Handlers.
+    primary: האם להריץ משימות מחזוריות גלובליות (במצב multi-worker רק worker 0).
+    """
+    builder = Application.builder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    builder = tracing.setup(builder)
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = builder.build()
     
     # 1. פקודות בסיס
     application.add_handler(CommandHandler("start", start_command))
@@ -100,6 +134,7 @@ def main():
     # Selling חייב להיות לפני ה-General Callback כדי לתפוס את "start_sell_flow"
     setup_selling_handlers(application) 
     setup_admin_handlers(application)   # תופס את admin_stats וכו'
+    setup_audit_handlers(application)
     
     # 3. Callback כללי (שאריות: עזרה, סטטוס, חזרה)
     application.add_handler(CallbackQueryHandler(handle_general_callbacks, pattern="^(check_verification_status|help_menu_main|main_menu_return)$"))
@@ -111,14 +146,96 @@ def main():
     ))
 
     setup_verification_flow(application)
-    
+    setup_chat_admins_handlers(application)
+    setup_session_tracking(application)
+
+    # הבאפר של ה-digest הוא לכל תהליך, ולכן השליחה המרוכזת רצה בכל worker
     try:
-        schedule_weekly_posts(application.job_queue)
-    except:
-        pass
-    
+        schedule_review_digest(application.job_queue)
+    except Exception as e:
+        logger.error(f"Failed to schedule admin review digest: {e}")
+
+    # הריקון בטוח להרצה מכמה workers (SKIP LOCKED + חכירה), כך שכל worker מרוקן גם את מה שהוא הכניס
+    try:
+        schedule_outbox(application.job_queue)
+    except Exception as e:
+        logger.error(f"Failed to schedule outbox drain: {e}")
+
+    # קאש מנהלי הקבוצות הוא לכל תהליך; הריצה הראשונה (אחרי 2 שניות) היא גם החימום
+    try:
+        schedule_chat_admins_refresh(application.job_queue)
+    except Exception as e:
+        logger.error(f"Failed to schedule chat admins refresh: {e}")
+
+    try:
+        schedule_audit_flush(application.job_queue)
+    except Exception as e:
+        logger.error(f"Failed to schedule audit log flush: {e}")
+
+    try:
+        schedule_session_sweep(application.job_queue)
+    except Exception as e:
+        logger.error(f"Failed to schedule session sweep: {e}")
+
+    try:
+        schedule_rate_limit_sweep(application.job_queue)
+    except Exception as e:
+        logger.error(f"Failed to schedule rate limit sweep: {e}")
+
+    if primary:
+        try:
+            schedule_weekly_posts(application.job_queue)
+        except:
+            pass
+
+        try:
+            schedule_post_lifecycle(application.job_queue)
+        except Exception as e:
+            logger.error(f"Failed to schedule post lifecycle job: {e}")
+
+        try:
+            schedule_permission_reconcile(application.job_queue)
+        except Exception as e:
+            logger.error(f"Failed to schedule permission reconcile: {e}")
+
+        # קבוצות שננעלו בגל הצטרפות לפני הפעלה מחדש - נפתחות במועד השמור
+        try:
+            schedule_chat_lock_restore(application.job_queue)
+        except Exception as e:
+            logger.error(f"Failed to schedule chat lock restore: {e}")
+
+    return application
+
+def run_worker(index: int, queue) -> None:
+    """נקודת הכניסה של תהליך worker (מצב multi-worker)."""
+    init_db(DB_URL) # מנוע חדש בתהליך הזה (המסלול המהיר - הסכמה כבר עודכנה ע"י ה-dispatcher)
+
+    backend = cluster.get_backend()
+    cluster.enable_shared_invalidation(backend)
+    application = build_application(primary=(index == 0), persistence=cluster.SharedPersistence(backend))
+    logger.info(f"Worker {index} started")
+    asyncio.run(cluster.serve_worker(application, queue))
+
+def main():
+    if not BOT_TOKEN or not DB_URL:
+        return
+
+    try:
+        init_db(DB_URL)
+    except Exception as e:
+        logger.critical(f"DB Error: {e}")
+        return
+
+    workers = int(os.getenv("BOT_WORKERS", 1))
+    if workers > 1:
+        logger.info(f"Starting bot with {workers} workers...")
+        cluster.run_cluster(BOT_TOKEN, workers, run_worker)
+        return
+
+    application = build_application()
     logger.info("Starting bot...")
-    application.run_polling(drop_pending_updates=True)
+    # chat_member לא נשלח כברירת מחדל - נדרש להצטרפויות ולעדכוני מנהלים
+    application.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
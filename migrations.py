@@ -0,0 +1,265 @@
+# ==================================
+# קובץ: migrations.py (מיגרציות סכמה עם גרסאות)
+# ==================================
+"""
+מנגנון מיגרציות פשוט עם גרסאות.
+כל מיגרציה היא פונקציה שמקבלת engine ונכתבת כך שאפשר להריץ אותה שוב בבטחה (IF NOT EXISTS).
+שינויים על טבלאות חיות נעשים בלי נעילות ארוכות:
+- עמודות חדשות נוספות כ-nullable ללא default (שינוי מטא-דאטה בלבד), עם lock_timeout וניסיונות חוזרים.
+- מילוי ערכים לעמודות קיימות נעשה באצוות קטנות, כל אצווה בטרנזקציה נפרדת.
+- אינדקסים נבנים עם CREATE INDEX CONCURRENTLY (מחוץ לטרנזקציה).
+
+שימוש מה-CLI:
+    python migrations.py upgrade   # מריץ מיגרציות שטרם הורצו
+    python migrations.py status    # מציג גרסה נוכחית מול האחרונה
+"""
+import os
+import sys
+import time
+import logging
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, Boolean, BigInteger, DateTime, ForeignKey, text, inspect
+from sqlalchemy.exc import OperationalError, DBAPIError
+
+from db_models import Base, SellPostMessage, SellPostHistory, SharedState, OutboxEvent, AuditLog, create_db_engine
+
+logger = logging.getLogger(__name__)
+
+VERSION_TABLE = 'schema_version'
+ADVISORY_LOCK_ID = 727_001 # מונע הרצה מקבילה של מיגרציות מכמה תהליכים
+LOCK_TIMEOUT = '3s'
+DDL_RETRIES = 5
+BACKFILL_BATCH_SIZE = 5000
+
+
+# ---------------------------------------------------------
+# 🧰 כלי עזר לשינויי סכמה "אונליין"
+# ---------------------------------------------------------
+
+def _is_postgres(engine):
+    return engine.dialect.name == 'postgresql'
+
+def add_column(engine, table, column, ddl_type):
+    """מוסיף עמודה nullable ללא default. ב-Postgres זה שינוי מטא-דאטה בלבד; lock_timeout מונע תקיעת הטבלה."""
+    if column in {c['name'] for c in inspect(engine).get_columns(table)}:
+        return
+    for attempt in range(1, DDL_RETRIES + 1):
+        try:
+            with engine.begin() as conn:
+                if _is_postgres(engine):
+                    conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {ddl_type}"))
+                else:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+            return
+        except OperationalError as e:
+            # לא קיבלנו את הנעילה בזמן - מחכים ומנסים שוב במקום לחסום את כל התנועה
+            logger.warning(f"add_column {table}.{column} attempt {attempt} failed: {e}")
+            time.sleep(attempt)
+    raise RuntimeError(f"Could not add column {table}.{column} after {DDL_RETRIES} attempts")
+
+def backfill(engine, table, set_clause, where, batch_size=BACKFILL_BATCH_SIZE):
+    """מעדכן שורות קיימות באצוות (כל אצווה בטרנזקציה קצרה משלה)."""
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            result = conn.execute(text(
+                f"UPDATE {table} SET {set_clause} WHERE id IN "
+                f"(SELECT id FROM {table} WHERE {where} LIMIT {int(batch_size)})"
+            ))
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+
+def create_index(engine, name, table, columns, where=None, unique=False, using=None):
+    """בונה אינדקס. ב-Postgres עם CONCURRENTLY, ומנקה קודם אינדקס INVALID שנשאר מבנייה שנכשלה."""
+    unique_sql = "UNIQUE " if unique else ""
+    using_sql = f" USING {using}" if using else ""
+    where_sql = f" WHERE {where}" if where else ""
+
+    if not _is_postgres(engine):
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns}){where_sql}"))
+        return
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(
+            f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table}{using_sql} ({columns}){where_sql}"
+        ))
+
+def create_tables(engine, *models):
+    """יוצר טבלאות של מודלים חדשים (אם חסרות)."""
+    Base.metadata.create_all(engine, tables=[m.__table__ for m in models])
+
+
+# ---------------------------------------------------------
+# 📜 המיגרציות עצמן (לפי הסדר; לא משנים מיגרציה שכבר שוחררה)
+# ---------------------------------------------------------
+
+# הסכמה כפי שהייתה לפני מנגנון המיגרציות. מוגדרת כאן במפורש (ולא מתוך המודלים), כדי שעמודות
+# ואינדקסים שנוספו אחר כך ייווצרו רק במיגרציות שלהם - גם ב-DB ריק.
+_baseline = MetaData()
+Table('users', _baseline,
+      Column('id', Integer, primary_key=True),
+      Column('telegram_id', BigInteger, unique=True, nullable=False),
+      Column('username', String),
+      Column('full_name', String),
+      Column('is_approved', Boolean),
+      Column('is_admin', Boolean),
+      Column('is_banned', Boolean),
+      Column('created_at', DateTime))
+Table('sell_posts', _baseline,
+      Column('id', Integer, primary_key=True),
+      Column('user_id', BigInteger, ForeignKey('users.telegram_id')),
+      Column('description', String, nullable=False),
+      Column('price', String),
+      Column('contact_info', String),
+      Column('image_id', String),
+      Column('is_approved', Boolean),
+      Column('status', String),
+      Column('created_at', DateTime))
+
+def m001_baseline(engine):
+    """טבלאות הבסיס (users, sell_posts) בצורתן המקורית."""
+    _baseline.create_all(engine)
+
+def m002_user_verification_columns(engine):
+    add_column(engine, 'users', 'phone_number', 'VARCHAR')
+    add_column(engine, 'users', 'license_photo_id', 'VARCHAR')
+
+def m003_sell_post_lifecycle_columns(engine):
+    add_column(engine, 'sell_posts', 'status_changed_at', 'TIMESTAMP')
+    add_column(engine, 'sell_posts', 'last_sent_at', 'TIMESTAMP')
+    create_tables(engine, SellPostMessage, SellPostHistory)
+    # מודעות שכבר לא פעילות צריכות תאריך שינוי סטטוס כדי שהארכוב יתפוס אותן
+    backfill(engine, 'sell_posts', "status_changed_at = created_at",
+             "status <> 'active' AND status_changed_at IS NULL")
+
+def m004_sell_post_indexes(engine):
+    create_index(engine, 'ix_sell_posts_live', 'sell_posts', 'is_approved, created_at', where="status = 'active'")
+    create_index(engine, 'ix_sell_posts_status_changed', 'sell_posts', 'status, status_changed_at')
+    create_index(engine, 'ix_sell_posts_user_id', 'sell_posts', 'user_id')
+
+def m005_shared_state(engine):
+    create_tables(engine, SharedState)
+
+def m006_outbox(engine):
+    create_tables(engine, OutboxEvent)
+
+def m007_user_updated_at(engine):
+    add_column(engine, 'users', 'updated_at', 'TIMESTAMP')
+    backfill(engine, 'users', "updated_at = COALESCE(created_at, CURRENT_TIMESTAMP)", "updated_at IS NULL")
+    create_index(engine, 'ix_users_updated_at', 'users', 'updated_at')
+
+def m008_audit_log(engine):
+    # טבלה חדשה ומחולקת - האינדקס נוצר עם הטבלה (CONCURRENTLY לא נתמך על טבלה מחולקת), המחיצות נוצרות בכתיבה
+    create_tables(engine, AuditLog)
+
+def m009_user_search_indexes(engine):
+    # רשימת הממתינים בעמודים - אינדקס חלקי, רק על השורות שעדיין לא טופלו
+    create_index(engine, 'ix_users_pending', 'users', 'created_at, id', where="is_approved = false AND is_banned = false")
+    if not _is_postgres(engine):
+        create_index(engine, 'ix_users_username_lower', 'users', 'lower(username)')
+        create_index(engine, 'ix_users_full_name_lower', 'users', 'lower(full_name)')
+        return
+    # /find: תחילית (LIKE 'q%') דרך btree עם text_pattern_ops, והתאמה באמצע המחרוזת דרך GIN של pg_trgm
+    create_index(engine, 'ix_users_username_prefix', 'users', 'lower(username) text_pattern_ops')
+    create_index(engine, 'ix_users_full_name_prefix', 'users', 'lower(full_name) text_pattern_ops')
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError as e:
+        # בלי הרשאה ליצור הרחבה החיפוש עדיין עובד, רק סורק את הטבלה בהתאמה באמצע המחרוזת
+        logger.warning(f"pg_trgm is not available, skipping trigram indexes: {e}")
+        return
+    create_index(engine, 'ix_users_username_trgm', 'users', 'lower(username) gin_trgm_ops', using='gin')
+    create_index(engine, 'ix_users_full_name_trgm', 'users', 'lower(full_name) gin_trgm_ops', using='gin')
+
+MIGRATIONS = [
+    (1, "baseline tables", m001_baseline),
+    (2, "users: phone_number, license_photo_id", m002_user_verification_columns),
+    (3, "sell_posts: status_changed_at, last_sent_at; sell_post_messages, sell_posts_history", m003_sell_post_lifecycle_columns),
+    (4, "sell_posts: live/status/user indexes", m004_sell_post_indexes),
+    (5, "shared_state table (multi-worker mode)", m005_shared_state),
+    (6, "outbox table", m006_outbox),
+    (7, "users: updated_at + index (permission reconciliation)", m007_user_updated_at),
+    (8, "audit_log table (partitioned by month)", m008_audit_log),
+    (9, "users: pending + name search indexes (pg_trgm)", m009_user_search_indexes),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ---------------------------------------------------------
+# ▶️ הרצה
+# ---------------------------------------------------------
+
+def current_version(engine):
+    """מחזיר את גרסת הסכמה הנוכחית (0 אם טבלת הגרסאות לא קיימת)."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text(f"SELECT COALESCE(MAX(version), 0) FROM {VERSION_TABLE}")).scalar()
+    except DBAPIError:
+        return 0
+
+def run_migrations(engine):
+    """מריץ את כל המיגרציות שטרם הורצו ומחזיר את הגרסה הסופית."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+            "version INTEGER PRIMARY KEY, description VARCHAR, applied_at TIMESTAMP)"
+        ))
+
+    lock_conn = None
+    if _is_postgres(engine):
+        # נעילה ברמת ה-session: תהליך נוסף שעולה במקביל ימתין עד שהמיגרציות יסתיימו
+        lock_conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+
+    try:
+        version = current_version(engine)
+        for number, description, migrate in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info(f"Applying migration {number}: {description}")
+            started = time.monotonic()
+            migrate(engine)
+            with engine.begin() as conn:
+                conn.execute(
+                    text(f"INSERT INTO {VERSION_TABLE} (version, description, applied_at) VALUES (:v, :d, :t)"),
+                    {"v": number, "d": description, "t": datetime.utcnow()}
+                )
+            logger.info(f"Migration {number} done in {time.monotonic() - started:.1f}s")
+            version = number
+        return version
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": ADVISORY_LOCK_ID})
+            lock_conn.close()
+
+
+def main(argv):
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    command = argv[1] if len(argv) > 1 else "upgrade"
+    engine = create_db_engine(os.getenv("DATABASE_URL") or os.getenv("DB_URL"))
+
+    if command == "status":
+        print(f"Schema version: {current_version(engine)} (latest: {LATEST_VERSION})")
+    elif command == "upgrade":
+        print(f"✅ Schema upgraded to version {run_migrations(engine)}.")
+    else:
+        print("שימוש: python migrations.py [upgrade|status]")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,105 @@
+# ==================================
+# קובץ: tests/test_cluster.py (worker במצב multi-worker)
+# ==================================
+"""
+בדיקת ה-NOTIFY דורשת Postgres: TEST_DATABASE_URL=postgresql://... python -m pytest tests
+"""
+import os
+import json
+import asyncio
+import queue
+
+import pytest
+from sqlalchemy import text
+
+import cache
+import cluster
+import db_models
+import invalidation
+import main
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, name=None):
+        self.jobs.append(name)
+
+
+class FakeApplication:
+    """מספיק מ-telegram.ext.Application עבור serve_worker."""
+
+    def __init__(self, post_init=None, post_shutdown=None):
+        self.post_init = post_init
+        self.post_shutdown = post_shutdown
+        self.job_queue = FakeJobQueue()
+        self.update_queue = asyncio.Queue()
+        self.bot = None
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def start(self):
+        self.calls.append('start')
+
+    async def stop(self):
+        self.calls.append('stop')
+
+
+def test_serve_worker_runs_post_init_and_post_shutdown():
+    calls = []
+
+    async def post_init(app):
+        calls.append('post_init')
+
+    async def post_shutdown(app):
+        calls.append('post_shutdown')
+
+    app = FakeApplication(post_init, post_shutdown)
+    updates = queue.Queue()
+    updates.put(None) # סגירה מיידית
+    asyncio.run(cluster.serve_worker(app, updates))
+    assert calls == ['post_init', 'post_shutdown']
+    assert app.calls == ['start', 'stop']
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL.startswith("postgres"), reason="requires TEST_DATABASE_URL (Postgres)")
+def test_worker_receives_invalidation_from_peer():
+    db_models.engine = db_models.create_db_engine(TEST_DATABASE_URL)
+    status_cache = cache.get_cache('user_status')
+
+    async def scenario():
+        updates = queue.Queue()
+        app = FakeApplication(main.post_init, main.post_shutdown)
+        worker = asyncio.create_task(cluster.serve_worker(app, updates))
+        for _ in range(50):
+            if invalidation._listener is not None:
+                break
+            await asyncio.sleep(0.1)
+        assert invalidation._listener is not None, "worker did not start the invalidation listener"
+        assert 'warm_caches' in app.job_queue.jobs
+
+        status_cache.set(42, (True, False))
+        payload = json.dumps({"origin": "peer-worker", "name": "user_status", "key": 42})
+        with db_models.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {"channel": invalidation.CHANNEL, "payload": payload})
+        for _ in range(50):
+            if status_cache.get(42) is None:
+                break
+            await asyncio.sleep(0.1)
+        received = status_cache.get(42) is None
+
+        updates.put(None)
+        await worker
+        return received
+
+    assert asyncio.run(scenario()), "peer NOTIFY did not evict the local cache entry"
+    assert invalidation._listener is None # post_shutdown עצר את המאזין
@@ -0,0 +1,184 @@
+# ==================================
+# קובץ: tracing.py (מעקב זמנים: עדכון → handler → DB → Bot API)
+# ==================================
+"""
+רשם spans מובנה, כבוי כברירת מחדל (TRACING=1 להפעלה).
+
+- span שורש לכל Update (TracingApplication.process_update).
+- span בן לכל קריאה לפונקציה ציבורית ב-db_operations (instrument_db_operations).
+- span בן לכל בקשת Bot API (TracingRequest - שכבת ה-HTTP של הבוט).
+- עקבות שנמשכו יותר מ-TRACE_SLOW_MS נשמרים בחוצץ מעגלי בזיכרון, ומוצגים לאדמינים ב-/traces.
+
+כשהמעקב כבוי לא מותקן כלום: אין עטיפות, אין מחלקות משנה, ואין עלות לעדכון.
+ה-span הנוכחי מועבר ב-contextvars, כך שקוד שרץ ב-executor (בלי הקשר) פשוט לא נמדד.
+"""
+import os
+import time
+import logging
+import functools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- הגדרות ---
+TRACING_ENABLED = os.getenv("TRACING", "0").lower() in ("1", "true", "yes")
+TRACE_SLOW_MS = int(os.getenv("TRACE_SLOW_MS", 1000))       # מעל זה העקבה נשמרת
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 50))  # כמה עקבות איטיות לשמור
+MAX_SPANS_PER_TRACE = 200
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "children", "error", "_count")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+        self._count = 1 # בשורש: מספר ה-spans בעקבה
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+_root: ContextVar[Optional[Span]] = ContextVar("trace_root", default=None)
+slow_traces: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """פותח span בן תחת ה-span הנוכחי (או שורש, אם אין). לא עושה כלום כשהמעקב כבוי."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+
+    parent, root = _current.get(), _root.get()
+    current = Span(name, attrs)
+    if parent is not None:
+        if root._count >= MAX_SPANS_PER_TRACE:
+            yield None # עקבה ענקית - מפסיקים להקליט ילדים
+            return
+        root._count += 1
+        parent.children.append(current)
+    span_token = _current.set(current)
+    root_token = _root.set(current) if parent is None else None
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current.reset(span_token)
+        if root_token is not None:
+            _root.reset(root_token)
+            if current.duration_ms >= TRACE_SLOW_MS:
+                slow_traces.append((time.time(), render(current)))
+
+
+def render(root: Span) -> str:
+    """מציג עקבה כעץ: משך, היסט מתחילת העקבה, ותכונות."""
+    lines = []
+
+    def walk(node: Span, depth: int):
+        attrs = " ".join(f"{k}={v}" for k, v in node.attrs.items())
+        error = f" !{node.error}" if node.error else ""
+        offset = (node.start - root.start) * 1000
+        lines.append(f"{'  ' * depth}{node.name} {node.duration_ms:.0f}ms @+{offset:.0f}{error} {attrs}".rstrip())
+        for child in node.children:
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------
+# 🔌 נקודות חיבור
+# ---------------------------------------------------------
+
+def _update_attrs(update) -> dict:
+    """תיאור קצר של העדכון, בלי תוכן הודעות."""
+    attrs = {"update_id": getattr(update, "update_id", None)}
+    user = getattr(update, "effective_user", None)
+    if user:
+        attrs["user"] = user.id
+    if getattr(update, "callback_query", None):
+        attrs["callback"] = (update.callback_query.data or "")[:32]
+    elif getattr(update, "message", None) and update.message.text and update.message.text.startswith("/"):
+        attrs["command"] = update.message.text.split()[0][:32]
+    elif getattr(update, "chat_member", None):
+        attrs["chat_member"] = update.chat_member.chat.id
+    return attrs
+
+
+_instrumented = False
+
+def instrument_db_operations():
+    """
+    עוטף כל פונקציה ציבורית ב-db_operations ב-span.
+    חייב לרוץ לפני שמודולי ה-handlers מייבאים ממנו (from db_operations import ...).
+    """
+    global _instrumented
+    if not TRACING_ENABLED or _instrumented:
+        return
+    _instrumented = True
+    import inspect
+    import db_operations
+    for name, func in list(vars(db_operations).items()):
+        if name.startswith("_") or not inspect.isfunction(func) or func.__module__ != db_operations.__name__:
+            continue
+
+        def wrap(func, span_name):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if _current.get() is None:
+                    return func(*args, **kwargs) # מחוץ לעקבה (למשל ב-executor) - בלי מדידה
+                with span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+
+        setattr(db_operations, name, wrap(func, f"db.{name}"))
+
+
+def build_tracing_request(**kwargs):
+    """שכבת HTTP של הבוט שמודדת כל קריאת Bot API."""
+    from telegram.request import HTTPXRequest
+
+    class TracingRequest(HTTPXRequest):
+        async def do_request(self, url, method, *args, **kw):
+            if _current.get() is None:
+                return await super().do_request(url, method, *args, **kw)
+            with span(f"bot.{url.rsplit('/', 1)[-1]}"):
+                return await super().do_request(url, method, *args, **kw)
+
+    return TracingRequest(**kwargs)
+
+
+def tracing_application_class():
+    """Application שפותח span שורש לכל Update."""
+    from telegram.ext import Application
+
+    class TracingApplication(Application):
+        async def process_update(self, update):
+            with span("update", **_update_attrs(update)):
+                return await super().process_update(update)
+
+    return TracingApplication
+
+
+def setup(builder):
+    """מחבר את המעקב ל-ApplicationBuilder (רק אם הופעל). מחזיר את ה-builder."""
+    if not TRACING_ENABLED:
+        return builder
+    instrument_db_operations()
+    logger.info(f"Tracing enabled (slow threshold {TRACE_SLOW_MS}ms, buffer {TRACE_BUFFER_SIZE})")
+    # גודל המאגר כמו ברירת המחדל של ApplicationBuilder
+    return (builder.application_class(tracing_application_class())
+                   .request(build_tracing_request(connection_pool_size=256)))